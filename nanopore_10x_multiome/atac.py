@@ -1,6 +1,16 @@
 import regex
 
-from nanopore_10x_multiome.utils import RC, REV, get_barcode_parasail
+from nanopore_10x_multiome.utils import (
+    RC,
+    REV,
+    get_barcode_parasail,
+    get_barcode_parasail_span,
+    SeedPrefilter,
+    FlankedPattern,
+    MyersBatch,
+    PatternScanner,
+    check_search_backend
+)
 from nanopore_10x_multiome.barcodes import translate_barcode, correct_barcode
 
 ###############################################################################
@@ -24,6 +34,24 @@ tenx_re = regex.compile(
     flags=regex.IGNORECASE
 )
 
+# Exact seeds from the 20bp constant region (up to 3 errors)
+# The longest tenx_re match is 14 + 16 + 23 bases
+tenx_prefilter = SeedPrefilter(
+    'CGCGTCTGTCGTCGGCAGCG',
+    3,
+    14 + 16 + 23
+)
+
+# The same patterns for the Myers search backend
+TENX_ATAC_PATTERN = FlankedPattern(
+    'CGAGATCTACAC',
+    2,
+    16,
+    'CGCGTCTGTCGTCGGCAGCG',
+    3
+)
+TENX_ATAC_PATTERN_RC = TENX_ATAC_PATTERN.reverse_complement()
+
 tn5_re = regex.compile(
     '(AGATGTGTATAAGAGACAG){e<=3}',
     flags=regex.IGNORECASE | regex.BESTMATCH
@@ -33,12 +61,25 @@ tn5_rev_re = regex.compile(
     flags=regex.IGNORECASE | regex.BESTMATCH
 )
 
+TN5_PATTERNS = (
+    ('AGATGTGTATAAGAGACAG', 3),
+    ('CTGTCTCTTATACACATCT', 3)
+)
+
+# Finds the same Tn5 mosaic ends as tn5_re and tn5_rev_re, in both
+# orientations with one traversal of the read
+# Reads with 3+ mosaic ends are rejected, so scanning stops at the third
+TN5_MAX_SPANS = 3
+tn5_scanner = PatternScanner(TN5_PATTERNS, TN5_MAX_SPANS)
+
 
 def get_atac_anchors(
     seq,
     qual,
     keep_runoff_fragments=False,
-    min_len=10
+    min_len=10,
+    search_backend='regex',
+    myers_search=None
 ):
     """
     Search for ATAC technical sequences from a sequence string
@@ -52,6 +93,14 @@ def get_atac_anchors(
     :type keep_runoff_fragments: bool, optional
     :param min_len: Minimum genomic insertion to retain, defaults to 10
     :type min_len: int, optional
+    :param search_backend: Adapter search backend, 'regex' for fuzzy
+        regular expressions or 'myers' for Myers bit-parallel
+        edit distances, defaults to 'regex'
+    :type search_backend: str, optional
+    :param myers_search: Myers distances computed for a batch of reads
+        with atac_myers_search, and the index of this read in the batch,
+        defaults to None (compute for this read)
+    :type myers_search: (MyersBatch, int), optional
 
     :return: Tuple of (
         barcode sequence,
@@ -61,67 +110,214 @@ def get_atac_anchors(
     :rtype: (str, str, (int, int, int, int))
     """
 
-    n = len(seq)
+    check_search_backend(search_backend)
+
     seq = seq.upper()
 
-    # Find 10x ATAC Barcode on the forward strand
-    _bc, _bc_qual, _bc_pos = get_atac_barcode_parasail(seq, qual)
-    _fwd = True
-    
-    # If not on the forward strand, look on the reverse strand
-    if _bc is None:
-        _bc, _bc_qual, _bc_pos = get_atac_barcode_parasail(RC(seq), REV(qual))
-        _fwd = False
+    if search_backend == 'myers':
+        if myers_search is None:
+            myers_search = atac_myers_search([seq]), 0
+
+        _bc, _bc_qual, _bc_pos, _fwd = get_atac_barcode_myers(
+            seq,
+            qual,
+            *myers_search
+        )
+
+    else:
+        # Find 10x ATAC Barcode on the forward strand
+        _bc, _bc_qual, _bc_pos = get_atac_barcode_parasail(seq, qual)
+        _fwd = True
+
+        # If not on the forward strand, look on the reverse strand
+        if _bc is None:
+            _bc, _bc_qual, _bc_pos = get_atac_barcode_parasail(RC(seq), REV(qual))
+            _fwd = False
 
     # If no atac anchors, return Nones
     if _bc is None:
         return None, None, None
 
+    tn5_locs = get_atac_tn5_locs(
+        seq,
+        _bc_pos,
+        _fwd,
+        keep_runoff_fragments=keep_runoff_fragments,
+        min_len=min_len
+    )
+
+    if tn5_locs is None:
+        return None, None, None
+
+    return _bc, _bc_qual, tn5_locs
+
+
+def get_atac_tn5_locs(
+    seq,
+    bc_pos,
+    fwd,
+    keep_runoff_fragments=False,
+    min_len=10,
+    tn5_spans=None
+):
+    """
+    Find the genomic insert between Tn5 mosaic ends in an ATAC read
+
+    :param seq: Uppercase read sequence
+    :type seq: str
+    :param bc_pos: Barcode start position
+    :type bc_pos: int
+    :param fwd: Barcode was found on the forward strand
+    :type fwd: bool
+    :param keep_runoff_fragments: Keep fragments that have a barcode and single
+        Tn5 insertion, if there is no matching Tn5 on the other side, defaults to False
+    :type keep_runoff_fragments: bool, optional
+    :param min_len: Minimum genomic insertion to retain, defaults to 10
+    :type min_len: int, optional
+    :param tn5_spans: Spans of Tn5 mosaic ends from scan_atac_tn5_spans,
+        defaults to None (scan this read)
+    :type tn5_spans: list((int, int)), optional
+
+    :return: Tn5 insert locations as start, stop, start, stop,
+        or None if there is no valid insert
+    :rtype: list(int) or None
+    """
+
+    n = len(seq)
+
     # Count number of tn5 MEs
-    tn5_searches = [
-        y
-        for y in tn5_re.finditer(seq)
-    ] + [
-        y
-        for y in tn5_rev_re.finditer(seq)
-    ]
+    if tn5_spans is None:
+        tn5_spans = atac_tn5_spans(seq)
 
     # IF there's two Tn5 insertions, find the spot between them
-    if len(tn5_searches) == 2:
-        tn5_locs = sorted(tn5_searches[0].span() + tn5_searches[1].span())
+    if len(tn5_spans) == 2:
+        tn5_locs = sorted(tn5_spans[0] + tn5_spans[1])
 
         # Check for overlapping/no genomic Tn5 insertions
         if (
             ((tn5_locs[2] - tn5_locs[1]) < min_len) or
             ((tn5_locs[3] - tn5_locs[0]) < (38 + min_len))
         ):
-            return None, None, None
+            return None
 
     # IF there's one Tn5 insertion and the runoff flag is set,
     # check that the barcode is on the correct side of the Tn5
     # and then go to the end of the sequence
-    elif keep_runoff_fragments and (len(tn5_searches) == 1):
+    elif keep_runoff_fragments and (len(tn5_spans) == 1):
 
-        _single_tn5 = sorted(tn5_searches[0].span())
+        _single_tn5 = sorted(tn5_spans[0])
 
-        if _fwd and _bc_pos < _single_tn5[1]:
+        if fwd and bc_pos < _single_tn5[1]:
             tn5_locs = [0, _single_tn5[1]] + [n, n]
 
-        elif (len(seq) - _bc_pos) > _single_tn5[0]:
+        elif (len(seq) - bc_pos) > _single_tn5[0]:
             tn5_locs = [0, 0] + [_single_tn5[0], n]
 
         else:
-            return None, None, None
+            return None
 
         # Check for overlapping/no genomic Tn5 insertions
         if (tn5_locs[2] - tn5_locs[1]) < min_len:
-            return None, None, None
+            return None
 
     # IF there's 3+ or 0 Tn5 insertions return nothing
     else:
-        return None, None, None
+        return None
 
-    return _bc, _bc_qual, tn5_locs
+    return tn5_locs
+
+
+def atac_tn5_spans(seq, windows=None):
+    """
+    Find Tn5 mosaic ends in a read
+
+    :param seq: Uppercase read sequence
+    :type seq: str
+    :param windows: Only search these (start, end) windows,
+        defaults to None (search the whole read)
+    :type windows: list((int, int)), optional
+
+    :return: Spans of forward then reverse Tn5 mosaic ends,
+        at most TN5_MAX_SPANS
+    :rtype: list((int, int))
+    """
+
+    return scan_atac_tn5_spans([seq], [windows])[0]
+
+
+def scan_atac_tn5_spans(seqs, windows=None):
+    """
+    Find Tn5 mosaic ends in a list of reads with tn5_scanner.
+    The same mosaic ends as tn5_re.finditer followed by
+    tn5_rev_re.finditer are found, up to TN5_MAX_SPANS of them.
+
+    :param seqs: Uppercase read sequences
+    :type seqs: list(str)
+    :param windows: Only search these (start, end) windows of each read,
+        defaults to None (search whole reads)
+    :type windows: list(list((int, int)) or None), optional
+
+    :return: Spans of forward then reverse Tn5 mosaic ends for each read
+    :rtype: list(list((int, int)))
+    """
+
+    spans, counts = tn5_scanner.scan(seqs, windows)
+
+    return [
+        [tuple(x) for x in spans[i, :counts[i]].tolist()]
+        for i in range(len(seqs))
+    ]
+
+
+def get_atac_anchors_batch(
+    batch,
+    indices=None,
+    keep_runoff_fragments=False,
+    min_len=10,
+    search_backend='regex'
+):
+    """
+    Search for ATAC technical sequences in every read of a batch
+
+    :param batch: Reads to search
+    :type batch: ReadBatch
+    :param indices: Only search these reads, defaults to None (all reads)
+    :type indices: np.ndarray, list(int), optional
+    :param keep_runoff_fragments: Keep fragments that have a barcode and single
+        Tn5 insertion, if there is no matching Tn5 on the other side, defaults to False
+    :type keep_runoff_fragments: bool, optional
+    :param min_len: Minimum genomic insertion to retain, defaults to 10
+    :type min_len: int, optional
+    :param search_backend: Adapter search backend, 'regex' or 'myers',
+        defaults to 'regex'
+    :type search_backend: str, optional
+
+    :return: List of get_atac_anchors results, one for each searched read
+    :rtype: list((str, str, (int, int, int, int)))
+    """
+
+    seqs, quals = batch.sequences(), batch.qualities()
+
+    if indices is None:
+        indices = range(len(batch))
+
+    # Myers distances are computed for all reads in lockstep
+    if search_backend == 'myers':
+        _search = atac_myers_search([seqs[i].upper() for i in indices])
+    else:
+        _search = None
+
+    return [
+        get_atac_anchors(
+            seqs[i],
+            quals[i],
+            keep_runoff_fragments=keep_runoff_fragments,
+            min_len=min_len,
+            search_backend=search_backend,
+            myers_search=(_search, r) if _search is not None else None
+        )
+        for r, i in enumerate(indices)
+    ]
 
 
 def get_atac_barcode_parasail(seq, qual):
@@ -149,9 +345,75 @@ def get_atac_barcode_parasail(seq, qual):
         qual,
         tenx_re,
         TENX_ATAC_ADAPTER,
-        16
+        16,
+        prefilter=tenx_prefilter
     )
 
+def atac_myers_search(seqs):
+    """
+    Compute Myers distances for the ATAC adapter on both strands
+    for a list of reads at once
+
+    :param seqs: Uppercase read sequences
+    :type seqs: list(str)
+
+    :return: Myers distances for atac_myers_* functions
+    :rtype: MyersBatch
+    """
+
+    return MyersBatch(
+        seqs,
+        flanked_patterns=[TENX_ATAC_PATTERN, TENX_ATAC_PATTERN_RC]
+    )
+
+
+def get_atac_barcode_myers(seq, qual, search, i):
+    """
+    Find an ATAC barcode with the Myers search backend by
+
+    1. Myers edit distance matches of the adapter flanks
+    2. smith-waterman local sequence alignment against the match
+
+    :param seq: Uppercase read sequence
+    :type seq: str
+    :param qual: Quality string to slice
+    :type qual: str
+    :param search: Myers distances from atac_myers_search
+    :type search: MyersBatch
+    :param i: Index of this read in the search
+    :type i: int
+
+    :return: Tuple of (
+        Barcode sequence string,
+        Barcode quality string,
+        Barcode start position,
+        Barcode is on the forward strand
+    )
+    :rtype: (str, str, int, bool)
+    """
+
+    # Forward strand first, then the reverse strand
+    for k, fwd in ((0, True), (1, False)):
+        _span = search.find(i, k)
+
+        if _span is None:
+            continue
+
+        _bc, _bc_qual, _bc_pos = get_barcode_parasail_span(
+            seq,
+            qual,
+            _span,
+            TENX_ATAC_ADAPTER,
+            16,
+            reverse_complement=not fwd
+        )
+
+        if _bc is not None:
+            return _bc, _bc_qual, _bc_pos, fwd
+
+    return None, None, None, None
+
+
 def process_atac_tags(
     barcode,
     barcode_quality,
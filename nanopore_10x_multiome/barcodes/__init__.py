@@ -1,8 +1,14 @@
+import os
+
+import numpy as np
+
 from ._load_barcodes import (
     load_atac_barcodes,
     load_gex_barcodes,
     load_translations,
-    translate_barcode
+    translate_barcode,
+    ATAC_WHITELIST,
+    GEX_WHITELIST
 )
 
 from ._correct_barcodes import (
@@ -10,9 +16,49 @@ from ._correct_barcodes import (
     barcode_correction_table
 )
 
+from ._deletion_index import (
+    DeletionIndex,
+    quality_weights
+)
+
+from ._array_tables import (
+    ArrayCorrectionTable,
+    save_array
+)
+
+from ._packed_tables import (
+    PackedCorrectionTable,
+    load_correction_table,
+    pack_barcode,
+    pack_barcodes,
+    unpack_barcode
+)
+
+from ._table_cache import (
+    cached_correction_table,
+    cached_deletion_index,
+    default_cache_dir,
+    barcodes_cache_key,
+    whitelist_cache_key
+)
+
 
-def load_missing_multiome_barcode_info(pbar=False, test=False):
-    BarcodeHolder.load(pbar=pbar, test=test)
+def load_missing_multiome_barcode_info(
+    pbar=False,
+    test=False,
+    cache=True,
+    cache_dir=None,
+    compact=True,
+    n_jobs=None
+):
+    BarcodeHolder.load(
+        pbar=pbar,
+        test=test,
+        cache=cache,
+        cache_dir=cache_dir,
+        compact=compact,
+        n_jobs=n_jobs
+    )
 
 
 class BarcodeHolder:
@@ -23,8 +69,60 @@ class BarcodeHolder:
     atac_correction_table = None
     atac_gex_translation_table = None
 
+    # Deletion indices for barcode rescue, built when first needed
+    gex_deletion_index = None
+    atac_deletion_index = None
+
+    # Directory of the barcode store these tables came from
+    # (or were exported to), if any
+    store_path = None
+
     @classmethod
-    def load(cls, pbar=False, test=False):
+    def load(
+        cls,
+        pbar=False,
+        test=False,
+        cache=True,
+        cache_dir=None,
+        compact=True,
+        n_jobs=None
+    ):
+
+        # Correction tables are packed integer tables unless compact
+        # is False, in which case they are dicts of strings
+        if compact:
+            def _build_table(barcodes, pbar=False):
+                return PackedCorrectionTable.from_barcodes(
+                    barcodes,
+                    pbar=pbar,
+                    n_jobs=n_jobs
+                )
+        else:
+            _build_table = barcode_correction_table
+            cache = False
+
+        # Memory-map correction tables from the on-disk cache,
+        # building the cache for a whitelist the first time
+        if cache and cls.gex_correction_table is None:
+            cls.gex_barcodes, cls.gex_correction_table = cached_correction_table(
+                GEX_WHITELIST,
+                load_gex_barcodes,
+                cache_dir=cache_dir,
+                test=test,
+                pbar=pbar,
+                n_jobs=n_jobs
+            )
+
+        if cache and cls.atac_correction_table is None:
+            cls.atac_barcodes, cls.atac_correction_table = cached_correction_table(
+                ATAC_WHITELIST,
+                load_atac_barcodes,
+                cache_dir=cache_dir,
+                test=test,
+                pbar=pbar,
+                n_jobs=n_jobs
+            )
+
         if cls.gex_barcodes is None:
             cls.gex_barcodes = load_gex_barcodes(test=test)
 
@@ -32,13 +130,13 @@ class BarcodeHolder:
             cls.atac_barcodes = load_atac_barcodes(test=test)
 
         if cls.gex_correction_table is None:
-            cls.gex_correction_table = barcode_correction_table(
+            cls.gex_correction_table = _build_table(
                 cls.gex_barcodes,
                 pbar=pbar
             )
 
         if cls.atac_correction_table is None:
-            cls.atac_correction_table = barcode_correction_table(
+            cls.atac_correction_table = _build_table(
                 cls.atac_barcodes,
                 pbar=pbar
             )
@@ -48,3 +146,146 @@ class BarcodeHolder:
                 cls.atac_barcodes,
                 cls.gex_barcodes
             )
+
+    @classmethod
+    def load_deletion_indices(cls, max_deletions=1, cache=True, cache_dir=None):
+        """
+        Load deletion indices of the loaded whitelists for rescuing
+        barcodes more than one edit from the whitelist, if they aren't
+        loaded in this process yet. Indices are memory-mapped from the
+        on-disk cache (built the first time) unless cache is False.
+
+        :param max_deletions: Most deletions indexed for each barcode,
+            defaults to 1
+        :type max_deletions: int
+        :param cache: Use the on-disk cache, defaults to True
+        :type cache: bool
+        :param cache_dir: Cache directory, defaults to ``default_cache_dir()``
+        :type cache_dir: str, optional
+        """
+
+        if cache:
+            def _build_index(barcodes):
+                return cached_deletion_index(
+                    barcodes,
+                    cache_dir=cache_dir,
+                    max_deletions=max_deletions
+                )
+        else:
+            def _build_index(barcodes):
+                return DeletionIndex.from_barcodes(
+                    barcodes,
+                    max_deletions=max_deletions
+                )
+
+        if cls.gex_deletion_index is None:
+            cls.gex_deletion_index = _build_index(cls.gex_barcodes)
+
+        if cls.atac_deletion_index is None:
+            cls.atac_deletion_index = _build_index(cls.atac_barcodes)
+
+    @classmethod
+    def freeze(cls):
+        """
+        Convert loaded dict tables into read-only packed tables.
+        Packed tables are single numpy buffers, so forked processes
+        share their pages instead of copying them as refcounts change.
+        """
+
+        cls.gex_barcodes = np.asarray(cls.gex_barcodes, dtype=str)
+        cls.atac_barcodes = np.asarray(cls.atac_barcodes, dtype=str)
+
+        if isinstance(cls.gex_correction_table, dict):
+            cls.gex_correction_table = PackedCorrectionTable.from_dict(
+                cls.gex_correction_table,
+                cls.gex_barcodes
+            )
+
+        if isinstance(cls.atac_correction_table, dict):
+            cls.atac_correction_table = PackedCorrectionTable.from_dict(
+                cls.atac_correction_table,
+                cls.atac_barcodes
+            )
+
+        if isinstance(cls.atac_gex_translation_table, dict):
+            cls.atac_gex_translation_table = PackedCorrectionTable.from_dict(
+                cls.atac_gex_translation_table,
+                cls.gex_barcodes
+            )
+
+    @classmethod
+    def export(cls, path, pbar=False, test=False, deletion_indices=False):
+        """
+        Build (if needed) and write all barcode tables to a directory
+        which worker processes can attach to with ``attach``.
+
+        :param path: Existing directory to write the store into
+        :type path: str
+        :param deletion_indices: Also load and write the deletion indices,
+            defaults to False
+        :type deletion_indices: bool
+        """
+
+        cls.load(pbar=pbar, test=test)
+        cls.freeze()
+
+        save_array(os.path.join(path, 'gex_barcodes.npy'), cls.gex_barcodes)
+        save_array(os.path.join(path, 'atac_barcodes.npy'), cls.atac_barcodes)
+
+        cls.gex_correction_table.save(path, 'gex_correction')
+        cls.atac_correction_table.save(path, 'atac_correction')
+        cls.atac_gex_translation_table.save(path, 'atac_gex_translation')
+
+        if deletion_indices:
+            cls.load_deletion_indices()
+            cls.gex_deletion_index.save(path, 'gex_deletion')
+            cls.atac_deletion_index.save(path, 'atac_deletion')
+
+        cls.store_path = path
+
+    @classmethod
+    def attach(cls, path):
+        """
+        Replace all barcode tables with read-only memory-mapped tables
+        from a store written by ``export``. Does nothing if the tables
+        already came from this store.
+
+        :param path: Directory of the barcode store
+        :type path: str
+        """
+
+        if cls.store_path == path:
+            return
+
+        cls.gex_barcodes = np.load(
+            os.path.join(path, 'gex_barcodes.npy'),
+            mmap_mode='r'
+        )
+        cls.atac_barcodes = np.load(
+            os.path.join(path, 'atac_barcodes.npy'),
+            mmap_mode='r'
+        )
+
+        cls.gex_correction_table = load_correction_table(
+            path, 'gex_correction', cls.gex_barcodes
+        )
+        cls.atac_correction_table = load_correction_table(
+            path, 'atac_correction', cls.atac_barcodes
+        )
+        cls.atac_gex_translation_table = load_correction_table(
+            path, 'atac_gex_translation', cls.gex_barcodes
+        )
+
+        # Deletion indices are only in the store if they were exported
+        if os.path.exists(os.path.join(path, 'gex_deletion.keys.npy')):
+            cls.gex_deletion_index = DeletionIndex.load(
+                path, 'gex_deletion', cls.gex_barcodes
+            )
+            cls.atac_deletion_index = DeletionIndex.load(
+                path, 'atac_deletion', cls.atac_barcodes
+            )
+        else:
+            cls.gex_deletion_index = None
+            cls.atac_deletion_index = None
+
+        cls.store_path = path
@@ -0,0 +1,169 @@
+import mmap
+import os
+
+import numpy as np
+
+
+class ArrayCorrectionTable:
+    """
+    Read-only barcode lookup table backed by sorted numpy arrays.
+
+    Keys are stored as a sorted fixed-width bytes array and values as
+    indices into an array of target barcodes. The arrays can be written
+    to disk and memory-mapped, so worker processes can share one copy
+    of the table instead of each building their own dict.
+
+    Supports the dict operations used by ``correct_barcode`` and
+    ``translate_barcode`` (``table[key]`` raising ``KeyError``, ``in``,
+    ``get`` and ``len``).
+    """
+
+    def __init__(self, keys, values, targets):
+        self.keys = keys
+        self.values = values
+        self.targets = targets
+
+    @classmethod
+    def from_dict(cls, table, targets=None):
+        """
+        Convert a barcode lookup dict into an array table.
+
+        :param table: Lookup table of barcode -> barcode
+        :type table: dict[str, str]
+        :param targets: Array of barcodes the values are drawn from,
+            defaults to the unique values of the table
+        :type targets: np.ndarray, optional
+
+        :return: Array lookup table
+        :rtype: ArrayCorrectionTable
+        """
+
+        if targets is None:
+            targets = np.unique(np.array(list(table.values()), dtype=str))
+        else:
+            targets = np.asarray(targets, dtype=str)
+
+        target_index = {t: i for i, t in enumerate(targets)}
+
+        keys = np.array(list(table.keys()), dtype=bytes)
+        values = np.fromiter(
+            (target_index[v] for v in table.values()),
+            dtype=np.int32,
+            count=len(table)
+        )
+
+        order = np.argsort(keys, kind='stable')
+
+        return cls(keys[order], values[order], targets)
+
+    def save(self, path, name):
+        """
+        Write the key and value arrays to ``path`` as ``.npy`` files.
+        Targets are not written, they are expected to be shared between
+        tables and saved by the caller. Arrays that are already
+        memory-mapped from ``.npy`` files are symlinked, not copied.
+
+        :param path: Directory to write into
+        :type path: str
+        :param name: Table name used as the file prefix
+        :type name: str
+        """
+
+        save_array(os.path.join(path, f'{name}.keys.npy'), self.keys)
+        save_array(os.path.join(path, f'{name}.values.npy'), self.values)
+
+    @classmethod
+    def load(cls, path, name, targets, mmap_mode='r'):
+        """
+        Load a table written with ``save``.
+
+        :param path: Directory to read from
+        :type path: str
+        :param name: Table name used as the file prefix
+        :type name: str
+        :param targets: Array of barcodes the values index into
+        :type targets: np.ndarray
+        :param mmap_mode: Memory-map mode for ``np.load``, defaults to 'r'
+        :type mmap_mode: str, optional
+
+        :return: Array lookup table
+        :rtype: ArrayCorrectionTable
+        """
+
+        return cls(
+            np.load(os.path.join(path, f'{name}.keys.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, f'{name}.values.npy'), mmap_mode=mmap_mode),
+            targets
+        )
+
+    def _find(self, key):
+
+        try:
+            key = key.encode()
+        except AttributeError:
+            raise KeyError(key)
+
+        if len(key) > self.keys.dtype.itemsize:
+            return None
+
+        i = np.searchsorted(self.keys, key)
+
+        if i < self.keys.shape[0] and self.keys[i] == key:
+            return i
+        else:
+            return None
+
+    def __getitem__(self, key):
+        i = self._find(key)
+
+        if i is None:
+            raise KeyError(key)
+
+        return str(self.targets[self.values[i]])
+
+    def __contains__(self, key):
+        try:
+            return self._find(key) is not None
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        for k, v in zip(self.keys, self.values):
+            yield k.decode(), str(self.targets[v])
+
+
+def save_array(file_name, arr):
+    """
+    Save an array to a ``.npy`` file, symlinking to the source file
+    instead if the array is a memory-map of a whole ``.npy`` file
+
+    :param file_name: Output file path
+    :type file_name: str
+    :param arr: Array to save
+    :type arr: np.ndarray
+    """
+
+    _source = getattr(arr, 'filename', None)
+
+    # Only whole-file maps have the mmap itself as a base, not slices
+    if (
+        isinstance(arr.base, mmap.mmap) and
+        _source is not None and
+        _source.endswith('.npy')
+    ):
+        try:
+            os.symlink(_source, file_name)
+            return
+        except OSError:
+            pass
+
+    np.save(file_name, arr)
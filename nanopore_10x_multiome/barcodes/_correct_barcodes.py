@@ -1,7 +1,7 @@
 import numpy as np
 import tqdm
 
-from nanopore_10x_multiome.utils import convert_qual_illumina
+from ._deletion_index import quality_weights
 
 def barcode_correction_table(barcodes, pbar=False):
     """
@@ -81,7 +81,8 @@ def correct_barcode(
     max_dist=1,
     valid_barcodes=None,
     valid_barcodes_char_table=None,
-    min_weight_dist=None
+    min_weight_dist=None,
+    deletion_index=None
 ):
     
     """
@@ -92,9 +93,10 @@ def correct_barcode(
     :param qual: Barcode quality scores
     :type qual: str
     :param correction_lookup_table: Correction lookup table
-    :type correction_lookup_table: dict
+    :type correction_lookup_table: dict or ArrayCorrectionTable
     :param max_dist: Maximum distance for assignment, if this is greater than 1
-        the other kwargs in this function must be provided. Defaults to 1.
+        either deletion_index or valid_barcodes, valid_barcodes_char_table
+        and min_weight_dist must be provided. Defaults to 1.
     :type max_dist: int, optional
     :param valid_barcodes: Valid barcodes
     :type valid_barcodes: list[str]
@@ -105,6 +107,10 @@ def correct_barcode(
     :param min_weight_dist: Minimum weight distance for assignment,
         defaults to 0.5
     :type min_weight_dist: float, optional
+    :param deletion_index: Deletion index of the valid barcodes. If provided,
+        barcodes are assigned by edit distance instead of by Hamming distance
+        against every valid barcode.
+    :type deletion_index: DeletionIndex, optional
 
     :return: Assigned barcode or None
     :rtype: str or None
@@ -117,15 +123,30 @@ def correct_barcode(
 
     if max_dist <= 1:
         return None
-    
+
+    if deletion_index is not None:
+        corrected = deletion_index.correct(
+            [barcode],
+            [qual],
+            max_dist=max_dist,
+            min_weight_dist=0.5 if min_weight_dist is None else min_weight_dist
+        )[0]
+
+        if corrected is None:
+            try:
+                correction_lookup_table[barcode] = None
+            except TypeError:
+                pass
+
+        return corrected
+
     if valid_barcodes is None:
         raise RuntimeError(
-            'If max_dist > 1, pass valid_barcodes, '
+            'If max_dist > 1, pass deletion_index, or valid_barcodes, '
             'valid_barcodes_char_table, and min_weight_dist'
         )
 
-    weights = (convert_qual_illumina(qual) - 15) / 15
-    weights = np.maximum(weights, 0) + 1
+    weights = quality_weights(qual)
 
     # Encode quality scores
     quality_scores = np.array([ord(x) for x in barcode])
@@ -142,7 +163,11 @@ def correct_barcode(
     sort_order = np.argsort(wdistance)[0:4]
 
     if distance[sort_order[0]] > max_dist:
-        correction_lookup_table[barcode] = None
+        try:
+            correction_lookup_table[barcode] = None
+        except TypeError:
+            # Shared array tables are read-only, so misses aren't cached
+            pass
         return None
 
     if wdistance[sort_order[0]] < (wdistance[sort_order[1]] - min_weight_dist):
@@ -0,0 +1,505 @@
+import os
+
+import numpy as np
+
+from ._array_tables import save_array
+from ._packed_tables import (
+    PACKED_BITS,
+    PACKED_MAX_LEN,
+    _code_groups,
+    _packed_neighbours,
+    pack_barcodes
+)
+
+###############################################################################
+# Deletion-neighbourhood (SymSpell) index for barcode rescue
+# Two barcodes within edit distance k share a string which is at most k
+# deletions from each of them. Whitelist barcodes are indexed by all their
+# packed deletion variants, so barcodes within edit distance k of a query
+# are found by looking up the query's deletion variants, without comparing
+# against every whitelist barcode. Candidates are verified by edit distance.
+#
+# Indexing every 2-deletion variant of a 737K whitelist takes ~100M keys, so
+# by default only single deletions are indexed (17 keys per 16 base barcode)
+# and queries are expanded by one full edit before their deletions are
+# looked up. Any barcode within 2 edits of a query is within 1 edit of a
+# string 1 edit from the query, so no candidates are lost.
+###############################################################################
+
+# Packed keys of barcodes of length L are in [8 ** (L - 1), 8 ** L)
+_LENGTH_BOUNDS = np.array(
+    [8 ** i for i in range(PACKED_MAX_LEN + 1)],
+    dtype=np.uint64
+)
+
+
+def _key_lengths(keys):
+    """
+    Get the barcode length of each packed key
+    """
+
+    return np.searchsorted(_LENGTH_BOUNDS, keys, side='right')
+
+
+def _key_codes(keys, length):
+    """
+    Unpack packed keys of one length into a n x L matrix of base codes
+    """
+
+    _mask = np.uint64((1 << PACKED_BITS) - 1)
+
+    return np.stack(
+        [
+            (keys >> np.uint64(PACKED_BITS * (length - i - 1))) & _mask
+            for i in range(length)
+        ],
+        axis=1
+    ).reshape(keys.shape[0], length)
+
+
+def _unique_pairs(keys, values):
+    """
+    Drop repeated (key, value) pairs, returning pairs sorted by key
+    """
+
+    _order = np.lexsort((values, keys))
+    keys, values = keys[_order], values[_order]
+
+    _keep = np.ones(keys.shape[0], dtype=bool)
+    _keep[1:] = (keys[1:] != keys[:-1]) | (values[1:] != values[:-1])
+
+    return keys[_keep], values[_keep]
+
+
+def _by_length(keys, values):
+    """
+    Split packed keys and their values into groups by barcode length,
+    dropping empty barcodes
+    """
+
+    _lens = _key_lengths(keys)
+
+    return {
+        int(n): (keys[_lens == n], values[_lens == n])
+        for n in np.unique(_lens)
+        if n > 0
+    }
+
+
+def _deletion_variants(keys, values, length, max_deletions):
+    """
+    Get every variant of packed keys of one length with up to
+    ``max_deletions`` bases deleted, including the keys themselves
+
+    :return: Variant keys and the value of the key each came from
+    :rtype: np.ndarray[np.uint64], np.ndarray
+    """
+
+    _bits = np.uint64(PACKED_BITS)
+    _one = np.uint64(1)
+
+    variant_keys, variant_values = [keys], [values]
+
+    for d in range(max_deletions):
+        _len = length - d
+
+        if _len <= 1:
+            break
+
+        _keys = []
+
+        for i in range(_len):
+            _low = np.uint64(PACKED_BITS * (_len - i - 1))
+            _keys.append(
+                ((keys >> (_low + _bits)) << _low) | (keys & ((_one << _low) - _one))
+            )
+
+        keys, values = _unique_pairs(
+            np.concatenate(_keys),
+            np.tile(values, _len)
+        )
+
+        variant_keys.append(keys)
+        variant_values.append(values)
+
+    return np.concatenate(variant_keys), np.concatenate(variant_values)
+
+
+def _edit_distances(query_codes, target_codes, weights, max_dist):
+    """
+    Edit distances between pairs of equal-length queries and equal-length
+    targets, with and without weights.
+
+    Substituting or deleting query base i costs ``weights[:, i]`` in the
+    weighted distance, and a target base missing from the query costs 1.
+    Only alignments within ``max_dist`` of the diagonal are scored, so
+    distances over ``max_dist`` are not exact.
+
+    :return: Edit distances and weighted edit distances
+    :rtype: np.ndarray[int], np.ndarray[float]
+    """
+
+    _n, _lq = query_codes.shape
+    _lt = target_codes.shape[1]
+    _far = _lq + _lt + 1
+
+    dist = np.tile(np.arange(_lt + 1), (_n, 1))
+    dist[:, max_dist + 1:] = _far
+    wdist = dist.astype(float)
+
+    for i in range(_lq):
+        _w = weights[:, i]
+
+        _dist = np.full_like(dist, _far)
+        _wdist = np.full_like(wdist, np.inf)
+
+        if i < max_dist:
+            _dist[:, 0] = dist[:, 0] + 1
+            _wdist[:, 0] = wdist[:, 0] + _w
+
+        for j in range(max(i + 1 - max_dist, 1), min(i + 1 + max_dist, _lt) + 1):
+            _mismatch = query_codes[:, i] != target_codes[:, j - 1]
+
+            _dist[:, j] = np.minimum(
+                np.minimum(dist[:, j], _dist[:, j - 1]) + 1,
+                dist[:, j - 1] + _mismatch
+            )
+            _wdist[:, j] = np.minimum(
+                np.minimum(wdist[:, j] + _w, _wdist[:, j - 1] + 1),
+                wdist[:, j - 1] + _mismatch * _w
+            )
+
+        dist, wdist = _dist, _wdist
+
+    return dist[:, -1], wdist[:, -1]
+
+
+def quality_weights(qual):
+    """
+    Get barcode mismatch weights from a quality string, the same way
+    as ``correct_barcode``: high scoring mismatches are more distant
+    than low scoring mismatches
+
+    :param qual: Barcode quality string
+    :type qual: str
+
+    :return: Weight for each base (at least 1)
+    :rtype: np.ndarray[float]
+    """
+
+    weights = (np.array([ord(x) - 33 for x in qual], dtype=float) - 15) / 15
+
+    return np.maximum(weights, 0) + 1
+
+
+class DeletionIndex:
+    """
+    Deletion-neighbourhood (SymSpell) index of a barcode whitelist, for
+    finding every whitelist barcode within a small edit distance of a
+    whole batch of barcodes at once.
+
+    Keys are the packed deletion variants of whitelist barcodes (sorted,
+    with repeats) and values are indices into the whitelist. Lookups are
+    binary searches, so they don't scale with the size of the whitelist.
+    The arrays can be written to a directory and memory-mapped.
+
+    :param keys: Sorted packed deletion variant keys
+    :type keys: np.ndarray[np.uint64]
+    :param values: Whitelist index for each key
+    :type values: np.ndarray[np.int32]
+    :param targets: Whitelist barcodes
+    :type targets: np.ndarray
+    :param max_deletions: Most deletions indexed for each barcode
+    :type max_deletions: int
+    :param target_keys: Packed whitelist barcodes, defaults to None
+        (packed from targets)
+    :type target_keys: np.ndarray[np.uint64], optional
+    """
+
+    def __init__(self, keys, values, targets, max_deletions=1, target_keys=None):
+        self.keys = keys
+        self.values = values
+        self.targets = targets
+        self.max_deletions = max_deletions
+
+        if target_keys is None:
+            target_keys = pack_barcodes(targets)
+
+        self.target_keys = target_keys
+        self.target_lengths = _key_lengths(self.target_keys)
+
+    @classmethod
+    def from_barcodes(cls, barcodes, max_deletions=1):
+        """
+        Build a deletion index for a whitelist
+
+        :param barcodes: Whitelist barcode sequences (ACGTN)
+        :type barcodes: list[str]
+        :param max_deletions: Most deletions indexed for each barcode.
+            Queries are expanded by full edits up to the rest of the
+            edit distance, so 1 uses much less memory than 2 at the
+            cost of more lookups. Defaults to 1.
+        :type max_deletions: int
+
+        :return: Deletion index
+        :rtype: DeletionIndex
+        """
+
+        targets = np.asarray(barcodes, dtype=str)
+
+        keys = [np.zeros(0, dtype=np.uint64)]
+        values = [np.zeros(0, dtype=np.int32)]
+
+        if targets.shape[0] > 0:
+            for codes, _keys, _values in _code_groups(targets):
+                _k, _v = _deletion_variants(
+                    _keys,
+                    _values,
+                    codes.shape[1],
+                    max_deletions
+                )
+                keys.append(_k)
+                values.append(_v)
+
+        keys, values = _unique_pairs(
+            np.concatenate(keys),
+            np.concatenate(values)
+        )
+
+        return cls(keys, values, targets, max_deletions=max_deletions)
+
+    def save(self, path, name):
+        """
+        Write the index arrays to ``path`` as ``.npy`` files. Targets
+        are not written, they are expected to be saved by the caller.
+        Arrays that are already memory-mapped from ``.npy`` files are
+        symlinked, not copied.
+
+        :param path: Directory to write into
+        :type path: str
+        :param name: Index name used as the file prefix
+        :type name: str
+        """
+
+        save_array(os.path.join(path, f'{name}.keys.npy'), self.keys)
+        save_array(os.path.join(path, f'{name}.values.npy'), self.values)
+        save_array(
+            os.path.join(path, f'{name}.target_keys.npy'),
+            self.target_keys
+        )
+        np.save(
+            os.path.join(path, f'{name}.max_deletions.npy'),
+            np.array(self.max_deletions)
+        )
+
+    @classmethod
+    def load(cls, path, name, targets, mmap_mode='r'):
+        """
+        Load an index written with ``save``
+
+        :param path: Directory to read from
+        :type path: str
+        :param name: Index name used as the file prefix
+        :type name: str
+        :param targets: Whitelist barcodes the values index into
+        :type targets: np.ndarray
+        :param mmap_mode: Memory-map mode for ``np.load``, defaults to 'r'
+        :type mmap_mode: str, optional
+
+        :return: Deletion index
+        :rtype: DeletionIndex
+        """
+
+        def _load(suffix, mmap_mode=mmap_mode):
+            return np.load(
+                os.path.join(path, f'{name}.{suffix}.npy'),
+                mmap_mode=mmap_mode
+            )
+
+        return cls(
+            _load('keys'),
+            _load('values'),
+            targets,
+            max_deletions=int(_load('max_deletions', mmap_mode=None)),
+            target_keys=_load('target_keys')
+        )
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def candidates(self, barcodes, quals=None, max_dist=2):
+        """
+        Find every whitelist barcode within an edit distance of each
+        barcode in a batch
+
+        :param barcodes: Barcode sequences
+        :type barcodes: list[str]
+        :param quals: Barcode quality strings for weighted distances,
+            defaults to None (all weights 1)
+        :type quals: list[str], optional
+        :param max_dist: Maximum edit distance, defaults to 2
+        :type max_dist: int
+
+        :return: Query index, whitelist index, edit distance and
+            weighted edit distance of every match, sorted by query
+            and weighted edit distance
+        :rtype: np.ndarray[int], np.ndarray[np.int32],
+            np.ndarray[int], np.ndarray[float]
+        """
+
+        keys = pack_barcodes(barcodes)
+        rows = np.arange(keys.shape[0])
+
+        # Barcodes which can't be packed are never matched
+        rows = rows[keys != 0]
+        keys = keys[rows]
+
+        # Expand queries by full edits until the rest of the distance
+        # can be covered by deletions
+        for _ in range(max(max_dist - self.max_deletions, 0)):
+            _keys, _rows = [keys], [rows]
+
+            for _len, (_k, _r) in _by_length(keys, rows).items():
+
+                # Insertions wouldn't fit in a packed key
+                if _len >= PACKED_MAX_LEN:
+                    continue
+
+                _k, _r = _packed_neighbours(_key_codes(_k, _len), _k, _r)
+                _keys.append(_k)
+                _rows.append(_r)
+
+            keys, rows = _unique_pairs(
+                np.concatenate(_keys),
+                np.concatenate(_rows)
+            )
+
+        # Deletion variants of the expanded queries
+        _deletions = min(max_dist, self.max_deletions)
+        _keys, _rows = [], []
+
+        for _len, (_k, _r) in _by_length(keys, rows).items():
+            _k, _r = _deletion_variants(_k, _r, _len, _deletions)
+            _keys.append(_k)
+            _rows.append(_r)
+
+        if len(_keys) == 0:
+            return self._empty_candidates()
+
+        keys, rows = _unique_pairs(np.concatenate(_keys), np.concatenate(_rows))
+
+        # Look up every variant and expand the ranges of matching keys
+        _start = np.searchsorted(self.keys, keys, side='left')
+        _counts = np.searchsorted(self.keys, keys, side='right') - _start
+
+        _n = int(_counts.sum())
+        _offsets = np.arange(_n) - np.repeat(np.cumsum(_counts) - _counts, _counts)
+
+        rows, targets = _unique_pairs(
+            np.repeat(rows, _counts),
+            self.values[np.repeat(_start, _counts) + _offsets]
+        )
+
+        return self._verify(barcodes, quals, rows, targets, max_dist)
+
+    def correct(self, barcodes, quals, max_dist=2, min_weight_dist=0.5):
+        """
+        Correct a batch of barcodes to the closest whitelist barcode
+        within an edit distance. The best match is only assigned if its
+        quality-weighted edit distance is less than the next best match
+        by more than ``min_weight_dist``.
+
+        :param barcodes: Barcode sequences
+        :type barcodes: list[str]
+        :param quals: Barcode quality strings
+        :type quals: list[str]
+        :param max_dist: Maximum edit distance, defaults to 2
+        :type max_dist: int
+        :param min_weight_dist: Minimum weighted distance between the
+            best and next best match, defaults to 0.5
+        :type min_weight_dist: float
+
+        :return: Corrected barcodes, None where there is no correction
+        :rtype: list[str or None]
+        """
+
+        rows, targets, _, wdist = self.candidates(
+            barcodes,
+            quals,
+            max_dist=max_dist
+        )
+
+        corrected = [None] * len(barcodes)
+
+        if rows.shape[0] == 0:
+            return corrected
+
+        # Candidates are sorted by weighted distance within each query
+        _first = np.ones(rows.shape[0], dtype=bool)
+        _first[1:] = rows[1:] != rows[:-1]
+        _starts = np.where(_first)[0]
+
+        _second = np.full(_starts.shape[0], np.inf)
+        _has_second = np.append(_starts[1:], rows.shape[0]) - _starts > 1
+        _second[_has_second] = wdist[_starts[_has_second] + 1]
+
+        for i in _starts[wdist[_starts] < (_second - min_weight_dist)]:
+            corrected[rows[i]] = str(self.targets[targets[i]])
+
+        return corrected
+
+    def _verify(self, barcodes, quals, rows, targets, max_dist):
+
+        _query_lengths = np.array([len(barcodes[r]) for r in rows], dtype=int)
+        _target_lengths = self.target_lengths[targets]
+
+        dist = np.zeros(rows.shape[0], dtype=int)
+        wdist = np.zeros(rows.shape[0], dtype=float)
+
+        for _lq in np.unique(_query_lengths):
+            _query_idx = np.where(_query_lengths == _lq)[0]
+
+            # Codes and weights of each query, not each candidate
+            _queries, _query_rows = np.unique(
+                rows[_query_idx],
+                return_inverse=True
+            )
+
+            _codes = _key_codes(
+                pack_barcodes([barcodes[r] for r in _queries]),
+                _lq
+            )
+
+            if quals is None:
+                _weights = np.ones((_queries.shape[0], _lq))
+            else:
+                _weights = np.array(
+                    [quality_weights(quals[r][:_lq]) for r in _queries]
+                ).reshape(_queries.shape[0], _lq)
+
+            for _lt in np.unique(_target_lengths[_query_idx]):
+                _in = _target_lengths[_query_idx] == _lt
+                _idx = _query_idx[_in]
+
+                dist[_idx], wdist[_idx] = _edit_distances(
+                    _codes[_query_rows[_in]],
+                    _key_codes(self.target_keys[targets[_idx]], _lt),
+                    _weights[_query_rows[_in]],
+                    max_dist
+                )
+
+        _keep = dist <= max_dist
+        rows, targets = rows[_keep], targets[_keep]
+        dist, wdist = dist[_keep], wdist[_keep]
+
+        _order = np.lexsort((wdist, rows))
+
+        return rows[_order], targets[_order], dist[_order], wdist[_order]
+
+    def _empty_candidates(self):
+        return (
+            np.zeros(0, dtype=int),
+            np.zeros(0, dtype=np.int32),
+            np.zeros(0, dtype=int),
+            np.zeros(0, dtype=float)
+        )
@@ -2,10 +2,19 @@ import os
 from pathlib import Path
 import pandas as pd
 
+ATAC_WHITELIST = os.path.join(
+    Path(__file__).parent.absolute(),
+    '737K-arc-v1_atac.txt.gz'
+)
+GEX_WHITELIST = os.path.join(
+    Path(__file__).parent.absolute(),
+    '737K-arc-v1_rna.txt.gz'
+)
+
 
 def load_atac_barcodes(test=False):
     return pd.read_csv(
-        os.path.join(Path(__file__).parent.absolute(), '737K-arc-v1_atac.txt.gz'),
+        ATAC_WHITELIST,
         sep='\t',
         header=None,
         nrows=100 if test else None
@@ -14,7 +23,7 @@ def load_atac_barcodes(test=False):
 
 def load_gex_barcodes(test=False):
     return pd.read_csv(
-        os.path.join(Path(__file__).parent.absolute(), '737K-arc-v1_rna.txt.gz'),
+        GEX_WHITELIST,
         sep='\t',
         header=None,
         nrows=100 if test else None
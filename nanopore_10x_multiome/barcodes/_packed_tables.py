@@ -0,0 +1,523 @@
+import joblib
+import numpy as np
+import tqdm
+
+from ._array_tables import ArrayCorrectionTable
+
+###############################################################################
+# Barcodes are packed into uint64 keys with 3 bits per base
+# A=1 C=2 G=3 T=4 N=5 (0 is never used, so keys of different
+# lengths can't collide). Barcodes up to 21 bases long fit in a key.
+###############################################################################
+
+PACKED_BASES = 'ACGTN'
+PACKED_BITS = 3
+PACKED_MAX_LEN = 64 // PACKED_BITS
+
+# str.translate table from bases to octal digits
+# Every other ASCII character becomes 'X' so int() rejects it
+_PACK_TRANSLATE = str.maketrans({
+    **{chr(x): 'X' for x in range(128)},
+    **{b: str(i + 1) for i, b in enumerate(PACKED_BASES)}
+})
+
+# Lookup table from ASCII byte to base code, 0 for invalid
+_PACK_CODES = np.zeros(256, dtype=np.uint64)
+for _i, _b in enumerate(PACKED_BASES):
+    _PACK_CODES[ord(_b)] = _i + 1
+
+
+def pack_barcode(barcode):
+    """
+    Pack a barcode string into an integer key
+
+    :param barcode: Barcode sequence (ACGTN)
+    :type barcode: str
+
+    :raises ValueError: Barcode has other characters or is too long
+    :return: Packed key
+    :rtype: int
+    """
+
+    if not barcode.isascii() or len(barcode) > PACKED_MAX_LEN:
+        raise ValueError(f"Barcode {barcode} cannot be packed")
+
+    return int(barcode.translate(_PACK_TRANSLATE), 8)
+
+
+def unpack_barcode(key):
+    """
+    Unpack an integer key into a barcode string
+
+    :param key: Packed key
+    :type key: int
+
+    :return: Barcode sequence
+    :rtype: str
+    """
+
+    return ''.join(
+        PACKED_BASES[int(c) - 1]
+        for c in format(int(key), 'o')
+    )
+
+
+def pack_barcodes(barcodes):
+    """
+    Pack barcode strings into an array of keys. Barcodes which cannot
+    be packed get a key of 0, which never matches a table entry.
+
+    :param barcodes: Barcode sequences
+    :type barcodes: list[str]
+
+    :return: Packed keys
+    :rtype: np.ndarray[np.uint64]
+    """
+
+    keys = np.zeros(len(barcodes), dtype=np.uint64)
+
+    for i, b in enumerate(barcodes):
+        try:
+            keys[i] = pack_barcode(b)
+        except (ValueError, AttributeError):
+            pass
+
+    return keys
+
+
+def _barcode_code_matrix(barcodes):
+    """
+    Convert equal-length barcodes to a n x L matrix of base codes
+    """
+
+    _len = len(barcodes[0])
+    codes = _PACK_CODES[
+        np.frombuffer(
+            ''.join(barcodes).encode('ascii'),
+            dtype=np.uint8
+        ).reshape(-1, _len)
+    ]
+
+    if np.any(codes == 0):
+        raise ValueError(
+            f"Barcodes must only contain {PACKED_BASES}"
+        )
+
+    return codes
+
+
+def _code_groups(barcodes):
+    """
+    Group barcodes by length into code matrices with their packed keys
+    and whitelist indices, for generating variants
+
+    :return: List of (code matrix, packed keys, whitelist index)
+    :rtype: list[(np.ndarray, np.ndarray, np.ndarray)]
+    """
+
+    _lens = np.array([len(b) for b in barcodes], dtype=int)
+    _bits = np.uint64(PACKED_BITS)
+
+    groups = []
+
+    for _len in np.unique(_lens):
+        _idx = np.where(_lens == _len)[0]
+        codes = _barcode_code_matrix(barcodes[_idx])
+
+        keys = np.zeros(codes.shape[0], dtype=np.uint64)
+        for i in range(_len):
+            keys = (keys << _bits) | codes[:, i]
+
+        groups.append((codes, keys, _idx.astype(np.int32)))
+
+    return groups
+
+
+def _packed_neighbours(codes, keys, values, key_range=(None, None)):
+    """
+    Generate packed keys for every distinct single substitution,
+    insertion and deletion of each row of a code matrix.
+
+    Insertions of a base next to the same base, and deletions from
+    inside a run, are only generated once (at the start of the run)
+    so no barcode produces the same variant twice.
+
+    :param codes: n x L matrix of base codes
+    :type codes: np.ndarray[np.uint64]
+    :param keys: Packed keys for each row
+    :type keys: np.ndarray[np.uint64]
+    :param values: Value for each row
+    :type values: np.ndarray[np.int32]
+    :param key_range: Only keep variants with keys in [start, stop),
+        either end can be None for no limit
+    :type key_range: tuple(int, int)
+
+    :return: Variant keys and the value of the row each came from
+    :rtype: np.ndarray[np.uint64], np.ndarray[np.int32]
+    """
+
+    _len = codes.shape[1]
+    _bits = np.uint64(PACKED_BITS)
+    _base_codes = [np.uint64(c + 1) for c in range(len(PACKED_BASES))]
+    _start, _stop = key_range
+
+    variant_keys = []
+    variant_values = []
+
+    def _add(k, mask=None):
+
+        if _start is not None:
+            _in_range = k >= np.uint64(_start)
+            mask = _in_range if mask is None else mask & _in_range
+
+        if _stop is not None:
+            _in_range = k < np.uint64(_stop)
+            mask = _in_range if mask is None else mask & _in_range
+
+        if mask is None:
+            variant_keys.append(k)
+            variant_values.append(values)
+        else:
+            variant_keys.append(k[mask])
+            variant_values.append(values[mask])
+
+    for i in range(_len + 1):
+
+        # Bits below position i
+        _low = np.uint64(PACKED_BITS * (_len - i))
+        _prefix = keys >> _low
+        _suffix = keys & ((np.uint64(1) << _low) - np.uint64(1))
+
+        # Insertions before position i
+        for c in _base_codes:
+            _add(
+                (((_prefix << _bits) | c) << _low) | _suffix,
+                None if i == 0 else codes[:, i - 1] != c
+            )
+
+        if i == _len:
+            break
+
+        _low_next = _low - _bits
+        _suffix_next = keys & ((np.uint64(1) << _low_next) - np.uint64(1))
+
+        # Substitutions at position i
+        for c in _base_codes:
+            _add(
+                (((_prefix << _bits) | c) << _low_next) | _suffix_next,
+                codes[:, i] != c
+            )
+
+        # Deletion of position i
+        _add(
+            (_prefix << _low_next) | _suffix_next,
+            None if i == 0 else codes[:, i - 1] != codes[:, i]
+        )
+
+    return np.concatenate(variant_keys), np.concatenate(variant_values)
+
+
+def _key_ranges(groups, n_ranges, n_sample=4096, seed=100):
+    """
+    Split the variant key space into ranges with roughly equal
+    numbers of variants, based on the variants of a sample of barcodes
+
+    :return: List of (start, stop) key ranges covering all keys
+    :rtype: list[tuple(int, int)]
+    """
+
+    if n_ranges <= 1:
+        return [(None, None)]
+
+    rng = np.random.default_rng(seed)
+    _sample = []
+
+    for codes, keys, values in groups:
+        _rows = rng.choice(
+            codes.shape[0],
+            size=min(n_sample, codes.shape[0]),
+            replace=False
+        )
+        _sample.append(
+            _packed_neighbours(codes[_rows], keys[_rows], values[_rows])[0]
+        )
+
+    _sample = np.unique(np.concatenate(_sample))
+
+    _bounds = np.unique(_sample[
+        np.linspace(0, _sample.shape[0], n_ranges + 1)[1:-1].astype(int)
+    ]).tolist()
+
+    return list(zip([None] + _bounds, _bounds + [None]))
+
+
+def _mark_ambiguous(keys, values):
+    """
+    Collapse sorted keys so each appears once, setting the value of
+    any key that appeared more than once to -1
+    """
+
+    if keys.shape[0] == 0:
+        return keys, values
+
+    _first = np.ones(keys.shape[0], dtype=bool)
+    _first[1:] = keys[1:] != keys[:-1]
+
+    _starts = np.where(_first)[0]
+    _counts = np.diff(np.append(_starts, keys.shape[0]))
+
+    values = values[_starts]
+    values[_counts > 1] = -1
+
+    return keys[_starts], values
+
+
+def _merge_sorted(keys, values, new_keys, new_values):
+    """
+    Insert sorted new keys and values into sorted keys and values
+    """
+
+    _loc = np.searchsorted(keys, new_keys)
+
+    return (
+        np.insert(keys, _loc, new_keys),
+        np.insert(values, _loc, new_values)
+    )
+
+
+def _correction_table_chunk(groups, key_range=(None, None)):
+    """
+    Build the part of a correction table with keys in a key range
+
+    :param groups: Barcode groups from ``_code_groups``
+    :type groups: list
+    :param key_range: Key range [start, stop)
+    :type key_range: tuple(int, int)
+
+    :return: Sorted keys and whitelist indices
+    :rtype: np.ndarray[np.uint64], np.ndarray[np.int32]
+    """
+
+    keys = [np.zeros(0, dtype=np.uint64)]
+    values = [np.zeros(0, dtype=np.int32)]
+
+    for codes, _keys, _values in groups:
+        _k, _v = _packed_neighbours(codes, _keys, _values, key_range)
+        keys.append(_k)
+        values.append(_v)
+
+    keys = np.concatenate(keys)
+    values = np.concatenate(values)
+
+    _order = np.argsort(keys, kind='stable')
+    keys, values = _mark_ambiguous(keys[_order], values[_order])
+    del _order
+
+    # Whitelist barcodes in this range map to themselves
+    # If a barcode is duplicated the first copy wins
+    _orig_keys, _orig_loc = np.unique(
+        np.concatenate([k for _, k, _ in groups]),
+        return_index=True
+    )
+    _orig_values = np.concatenate([v for _, _, v in groups])[_orig_loc]
+
+    _in_range = np.ones(_orig_keys.shape[0], dtype=bool)
+    if key_range[0] is not None:
+        _in_range &= _orig_keys >= np.uint64(key_range[0])
+    if key_range[1] is not None:
+        _in_range &= _orig_keys < np.uint64(key_range[1])
+
+    _orig_keys = _orig_keys[_in_range]
+    _orig_values = _orig_values[_in_range]
+
+    # Drop ambiguous variants and variants which are whitelist barcodes
+    _keep = values >= 0
+    _keep &= ~np.isin(keys, _orig_keys)
+
+    return _merge_sorted(
+        keys[_keep],
+        values[_keep],
+        _orig_keys,
+        _orig_values
+    )
+
+
+class PackedCorrectionTable(ArrayCorrectionTable):
+    """
+    Read-only barcode lookup table with barcodes packed into uint64 keys
+    (3 bits per base) and values stored as int32 indices into the
+    whitelist. Uses a fraction of the memory of a dict of strings, and
+    can be queried one barcode at a time as a drop-in for the dict, or
+    for a whole batch of barcodes at once with ``lookup``.
+    """
+
+    # Approximate number of variants held in memory at once while
+    # building, the key space is split into ranges built separately
+    build_chunk_size = 2 ** 24
+
+    @classmethod
+    def from_barcodes(cls, barcodes, pbar=False, n_jobs=None):
+        """
+        Build a correction table for single-base errors directly from a
+        whitelist, with the same rules as ``barcode_correction_table``:
+        a variant reachable from more than one barcode is dropped and
+        every whitelist barcode maps to itself.
+
+        The variant key space is split into ranges which are built
+        independently (in parallel if ``n_jobs`` is set). All copies of
+        a variant fall in the same range, so ambiguous variants are
+        found without merging results between ranges.
+
+        :param barcodes: Whitelist barcode sequences (ACGTN)
+        :type barcodes: list[str]
+        :param pbar: Whether to show a progress bar
+        :type pbar: bool
+        :param n_jobs: Number of parallel processes for joblib,
+            defaults to None (build serially)
+        :type n_jobs: int or None
+
+        :return: Packed correction table
+        :rtype: PackedCorrectionTable
+        """
+
+        if pbar:
+            iter_wrap = tqdm.tqdm
+        else:
+            def iter_wrap(x):
+                return x
+
+        targets = np.asarray(barcodes, dtype=str)
+
+        if targets.shape[0] == 0:
+            return cls(
+                np.zeros(0, dtype=np.uint64),
+                np.zeros(0, dtype=np.int32),
+                targets
+            )
+
+        groups = _code_groups(targets)
+
+        # Each base has up to 4 substitutions, 5 insertions and 1 deletion
+        _n_variants = sum(c.shape[0] * c.shape[1] * 10 for c, _, _ in groups)
+        _n_ranges = int(np.ceil(_n_variants / cls.build_chunk_size))
+
+        if n_jobs is None or joblib.effective_n_jobs(n_jobs) == 1:
+            chunks = [
+                _correction_table_chunk(groups, r)
+                for r in iter_wrap(_key_ranges(groups, _n_ranges))
+            ]
+
+        else:
+            # Use a few ranges per process to balance load
+            _n_ranges = max(_n_ranges, 4 * joblib.effective_n_jobs(n_jobs))
+
+            chunks = joblib.Parallel(
+                n_jobs=n_jobs,
+                verbose=10 if pbar else 0
+            )(
+                joblib.delayed(_correction_table_chunk)(groups, r)
+                for r in _key_ranges(groups, _n_ranges)
+            )
+
+        return cls(
+            np.concatenate([k for k, _ in chunks]),
+            np.concatenate([v for _, v in chunks]),
+            targets
+        )
+
+    @classmethod
+    def from_dict(cls, table, targets=None):
+        table = ArrayCorrectionTable.from_dict(table, targets)
+
+        keys = pack_barcodes([k.decode() for k in table.keys])
+        _order = np.argsort(keys, kind='stable')
+
+        return cls(keys[_order], table.values[_order], table.targets)
+
+    def _find(self, key):
+
+        try:
+            key = pack_barcode(key)
+        except (ValueError, AttributeError):
+            return None
+
+        i = np.searchsorted(self.keys, np.uint64(key))
+
+        if i < self.keys.shape[0] and self.keys[i] == key:
+            return i
+        else:
+            return None
+
+    def lookup_keys(self, keys):
+        """
+        Look up packed keys
+
+        :param keys: Packed barcode keys
+        :type keys: np.ndarray[np.uint64]
+
+        :return: Whitelist index for each key, -1 if not in the table
+        :rtype: np.ndarray[np.int32]
+        """
+
+        keys = np.asarray(keys, dtype=np.uint64)
+
+        if self.keys.shape[0] == 0:
+            return np.full(keys.shape, -1, dtype=np.int32)
+
+        _loc = np.minimum(
+            np.searchsorted(self.keys, keys),
+            self.keys.shape[0] - 1
+        )
+
+        return np.where(
+            self.keys[_loc] == keys,
+            self.values[_loc],
+            -1
+        ).astype(np.int32)
+
+    def lookup(self, barcodes):
+        """
+        Correct a batch of barcodes
+
+        :param barcodes: Barcode sequences
+        :type barcodes: list[str]
+
+        :return: Corrected barcodes, None where there is no correction
+        :rtype: list[str or None]
+        """
+
+        return [
+            str(self.targets[i]) if i >= 0 else None
+            for i in self.lookup_keys(pack_barcodes(barcodes))
+        ]
+
+    def items(self):
+        for k, v in zip(self.keys, self.values):
+            yield unpack_barcode(k), str(self.targets[v])
+
+
+def load_correction_table(path, name, targets, mmap_mode='r'):
+    """
+    Load a correction table written with ``save``, as a
+    ``PackedCorrectionTable`` if its keys are packed integers or as an
+    ``ArrayCorrectionTable`` otherwise.
+
+    :param path: Directory to read from
+    :type path: str
+    :param name: Table name used as the file prefix
+    :type name: str
+    :param targets: Array of barcodes the values index into
+    :type targets: np.ndarray
+    :param mmap_mode: Memory-map mode for ``np.load``, defaults to 'r'
+    :type mmap_mode: str, optional
+
+    :return: Lookup table
+    :rtype: ArrayCorrectionTable
+    """
+
+    table = ArrayCorrectionTable.load(path, name, targets, mmap_mode=mmap_mode)
+
+    if table.keys.dtype == np.uint64:
+        return PackedCorrectionTable(table.keys, table.values, table.targets)
+    else:
+        return table
@@ -0,0 +1,249 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from ._deletion_index import DeletionIndex
+from ._packed_tables import PackedCorrectionTable, load_correction_table
+
+# Bump when the on-disk layout changes
+CACHE_VERSION = 2
+
+# Edits generated by barcode_correction_table
+# Bump when the correction rules change so old caches are not reused
+CORRECTION_EDIT_MODEL = 'substitution,insertion,deletion;distance=1;ATGCN'
+
+# Keys indexed by DeletionIndex
+# Bump when the deletion index layout changes so old caches are not reused
+DELETION_INDEX_MODEL = 'deletion-neighbourhood;packed'
+
+CACHE_ENV_VAR = 'NANOPORE_10X_MULTIOME_CACHE'
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    """
+    Get the correction table cache directory, from the
+    ``NANOPORE_10X_MULTIOME_CACHE`` environment variable if set,
+    otherwise ``~/.cache/nanopore_10x_multiome``
+
+    :return: Cache directory path
+    :rtype: str
+    """
+
+    try:
+        return os.environ[CACHE_ENV_VAR]
+    except KeyError:
+        return os.path.join(
+            os.path.expanduser('~'),
+            '.cache',
+            'nanopore_10x_multiome'
+        )
+
+
+def whitelist_cache_key(
+    whitelist_file,
+    test=False,
+    edit_model=CORRECTION_EDIT_MODEL
+):
+    """
+    Hash a whitelist file together with the edit model and cache version
+
+    :param whitelist_file: Path to the barcode whitelist
+    :type whitelist_file: str
+    :param test: Whether only the test subset of the whitelist is loaded
+    :type test: bool
+    :param edit_model: Description of the correction edit model
+    :type edit_model: str
+
+    :return: Hex digest
+    :rtype: str
+    """
+
+    _hash = hashlib.sha256()
+    _hash.update(f"{CACHE_VERSION}|{edit_model}|{test}|".encode())
+
+    with open(whitelist_file, mode='rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            _hash.update(block)
+
+    return _hash.hexdigest()
+
+
+def barcodes_cache_key(barcodes, model=DELETION_INDEX_MODEL):
+    """
+    Hash loaded barcodes together with a model description and the
+    cache version
+
+    :param barcodes: Barcodes
+    :type barcodes: np.ndarray
+    :param model: Description of what is built from the barcodes
+    :type model: str
+
+    :return: Hex digest
+    :rtype: str
+    """
+
+    barcodes = np.ascontiguousarray(barcodes)
+
+    _hash = hashlib.sha256()
+    _hash.update(f"{CACHE_VERSION}|{model}|{barcodes.dtype.str}|".encode())
+    _hash.update(memoryview(barcodes).cast('B'))
+
+    return _hash.hexdigest()
+
+
+def cached_correction_table(
+    whitelist_file,
+    barcode_loader,
+    cache_dir=None,
+    test=False,
+    pbar=False,
+    n_jobs=None
+):
+    """
+    Load barcodes and their correction table from the on-disk cache,
+    building and writing them on the first call for a whitelist.
+    Cached arrays are memory-mapped read-only. If the cache can't be
+    written, the table is built and kept in memory.
+
+    :param whitelist_file: Path to the barcode whitelist
+    :type whitelist_file: str
+    :param barcode_loader: Function that loads the whitelist,
+        called as ``barcode_loader(test=test)``
+    :type barcode_loader: callable
+    :param cache_dir: Cache directory, defaults to ``default_cache_dir()``
+    :type cache_dir: str, optional
+    :param test: Load only the test subset of the whitelist
+    :type test: bool
+    :param pbar: Show a progress bar while building
+    :type pbar: bool
+    :param n_jobs: Number of parallel processes used to build a
+        table which isn't cached yet
+    :type n_jobs: int or None
+
+    :return: Barcodes and correction table
+    :rtype: np.ndarray, PackedCorrectionTable
+    """
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    _name = os.path.basename(whitelist_file).split('.')[0]
+    _key = whitelist_cache_key(whitelist_file, test=test)
+    _path = os.path.join(cache_dir, f"{_name}-{_key[:16]}")
+
+    if not os.path.isdir(_path):
+        barcodes = np.asarray(barcode_loader(test=test), dtype=str)
+        table = PackedCorrectionTable.from_barcodes(
+            barcodes,
+            pbar=pbar,
+            n_jobs=n_jobs
+        )
+
+        def _write(scratch):
+            np.save(os.path.join(scratch, 'barcodes.npy'), barcodes)
+            table.save(scratch, 'correction')
+
+        if not _write_cache(_path, _write):
+            return barcodes, table
+
+    barcodes = np.load(
+        os.path.join(_path, 'barcodes.npy'),
+        mmap_mode='r'
+    )
+
+    return barcodes, load_correction_table(
+        _path,
+        'correction',
+        barcodes
+    )
+
+
+def cached_deletion_index(barcodes, cache_dir=None, max_deletions=1):
+    """
+    Load a deletion index of barcodes from the on-disk cache,
+    building and writing it on the first call for a whitelist.
+    Cached arrays are memory-mapped read-only. If the cache can't be
+    written, the index is built and kept in memory.
+
+    :param barcodes: Whitelist barcodes
+    :type barcodes: np.ndarray
+    :param cache_dir: Cache directory, defaults to ``default_cache_dir()``
+    :type cache_dir: str, optional
+    :param max_deletions: Most deletions indexed for each barcode,
+        defaults to 1
+    :type max_deletions: int
+
+    :return: Deletion index
+    :rtype: DeletionIndex
+    """
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+
+    barcodes = np.asarray(barcodes, dtype=str)
+
+    _key = barcodes_cache_key(
+        barcodes,
+        f"{DELETION_INDEX_MODEL};deletions={max_deletions}"
+    )
+    _path = os.path.join(cache_dir, f"deletion_index-{_key[:16]}")
+
+    if not os.path.isdir(_path):
+        index = DeletionIndex.from_barcodes(
+            barcodes,
+            max_deletions=max_deletions
+        )
+
+        if not _write_cache(_path, lambda x: index.save(x, 'deletion')):
+            return index
+
+    return DeletionIndex.load(_path, 'deletion', barcodes)
+
+
+def _write_cache(path, writer):
+
+    # Returns False if the cache can't be written
+
+    # Write into a scratch directory and rename it into place
+    # so a partially written cache is never picked up
+    _cache_dir = os.path.dirname(path)
+
+    # The cache directory can be read-only or not a directory
+    try:
+        os.makedirs(_cache_dir, exist_ok=True)
+        _scratch = tempfile.mkdtemp(dir=_cache_dir, prefix='.tmp-')
+    except OSError as err:
+        logger.warning(
+            "Could not write cache %s, keeping it in memory: %s",
+            path,
+            err
+        )
+        return False
+
+    try:
+        writer(_scratch)
+        os.rename(_scratch, path)
+
+    except OSError as err:
+        # Another process won the race to write this cache
+        if os.path.isdir(path):
+            return True
+
+        logger.warning(
+            "Could not write cache %s, keeping it in memory: %s",
+            path,
+            err
+        )
+        return False
+
+    finally:
+        if os.path.isdir(_scratch):
+            shutil.rmtree(_scratch)
+
+    return True
@@ -0,0 +1,664 @@
+import collections
+import time
+
+from nanopore_10x_multiome.utils import (
+    RC,
+    EndWindowSearch,
+    MyersBatch,
+    align_barcodes_parasail,
+    check_search_backend,
+    search_windows
+)
+from nanopore_10x_multiome.atac import (
+    TENX_ATAC_ADAPTER,
+    TENX_ATAC_PATTERN,
+    TENX_ATAC_PATTERN_RC,
+    tenx_re,
+    tenx_prefilter,
+    scan_atac_tn5_spans,
+    get_atac_tn5_locs
+)
+from nanopore_10x_multiome.gex import (
+    TENX_GEX_ADAPTER,
+    TENX_GEX_PATTERN,
+    TENX_GEX_PATTERN_RC,
+    gex_re,
+    gex_prefilter,
+    split_gex_barcode
+)
+
+###############################################################################
+# Single-pass ATAC / GEX read classifier
+#
+# The exact seeds of both adapters, and their reverse complements, are found
+# in the forward read once. Fuzzy adapter searches only run in windows
+# around seed hits, and reverse strand windows are reverse complemented on
+# their own instead of the whole read.
+#
+# Results are the same as get_atac_anchors, falling back to get_gex_anchors
+# for reads that aren't ATAC reads
+#
+# With the Myers search backend, flank edit distances for all adapters are
+# computed for the whole batch of reads at once instead
+#
+# With an end window set, long reads are searched only near their ends first,
+# and in full only if no adapters are found there
+#
+# With adaptive order, the Tn5 mosaic end scan runs before the ATAC barcode
+# search when that is expected to be cheaper from the reads seen so far,
+# so reads without Tn5 mosaic ends skip the barcode search. Reads are still
+# classified as ATAC first, so results don't change
+###############################################################################
+
+ATAC = 'atac'
+GEX = 'gex'
+
+# Seed groups; forward and reverse complement seeds for each adapter
+_ATAC_FWD, _ATAC_RC, _GEX_FWD, _GEX_RC = range(4)
+
+# Patterns for each seed group with the Myers search backend
+_MYERS_PATTERNS = {
+    _ATAC_FWD: TENX_ATAC_PATTERN,
+    _ATAC_RC: TENX_ATAC_PATTERN_RC,
+    _GEX_FWD: TENX_GEX_PATTERN,
+    _GEX_RC: TENX_GEX_PATTERN_RC
+}
+
+# Order of the ATAC checks
+BARCODE_FIRST = 'barcode'
+TN5_FIRST = 'tn5'
+
+# Every nth read gets both ATAC checks in adaptive order,
+# and the order is adapted once this many reads were sampled
+ADAPTIVE_SAMPLE_EVERY = 32
+ADAPTIVE_MIN_SAMPLES = 16
+
+
+class ReadClassifier:
+    """
+    Classify reads as ATAC or GEX reads by scanning each read once
+    for the adapter seeds of both modalities on both strands.
+
+    :param keep_runoff_fragments: Keep ATAC fragments that have a barcode
+        and single Tn5 insertion, defaults to False
+    :type keep_runoff_fragments: bool, optional
+    :param atac_min_len: Minimum ATAC genomic insertion to retain,
+        defaults to 10
+    :type atac_min_len: int, optional
+    :param gex_min_len: Minimum GEX cDNA length to retain, defaults to 25
+    :type gex_min_len: int, optional
+    :param bc_len: GEX barcode length, defaults to 16
+    :type bc_len: int, optional
+    :param umi_len: GEX UMI length, defaults to 12
+    :type umi_len: int, optional
+    :param search_backend: Adapter search backend, 'regex' for seeded
+        fuzzy regular expressions or 'myers' for Myers bit-parallel
+        edit distances, defaults to 'regex'
+    :type search_backend: str, optional
+    :param end_window: Search only this many bases at each end of a read
+        first, and the whole read if they have no adapters,
+        defaults to None (always search the whole read)
+    :type end_window: int, optional
+    :param max_search_length: Don't search reads longer than this in full
+        if their end windows have no adapters, defaults to None (no limit)
+    :type max_search_length: int, optional
+    :param adaptive_order: Run the cheaper ATAC check first, based on how
+        often each check passed so far, and keep search counts,
+        defaults to False
+    :type adaptive_order: bool, optional
+    """
+
+    def __init__(
+        self,
+        keep_runoff_fragments=False,
+        atac_min_len=10,
+        gex_min_len=25,
+        bc_len=16,
+        umi_len=12,
+        search_backend='regex',
+        end_window=None,
+        max_search_length=None,
+        adaptive_order=False
+    ):
+        check_search_backend(search_backend)
+
+        self.search_backend = search_backend
+        self.keep_runoff_fragments = keep_runoff_fragments
+        self.atac_min_len = atac_min_len
+        self.gex_min_len = gex_min_len
+        self.bc_len = bc_len
+        self.umi_len = umi_len
+
+        if end_window is not None:
+            self.end_window_search = EndWindowSearch(
+                end_window,
+                max_search_length=max_search_length
+            )
+        else:
+            self.end_window_search = None
+
+        self.adaptive_order = adaptive_order
+        self.counts = collections.Counter()
+
+        # Sampled reads, with ATAC barcodes, with Tn5 mosaic ends
+        self._samples = [0, 0, 0]
+
+        # Seconds and reads for each ATAC check
+        self._times = {'barcode': [0.0, 0], 'tn5': [0.0, 0]}
+
+        self._prefilters = {
+            _ATAC_FWD: tenx_prefilter,
+            _ATAC_RC: tenx_prefilter,
+            _GEX_FWD: gex_prefilter,
+            _GEX_RC: gex_prefilter
+        }
+
+        # Map each seed to the groups it belongs to
+        # The same k-mer can be a seed of more than one group
+        self._seed_groups = {}
+
+        for group, prefilter in self._prefilters.items():
+            for seed in prefilter.seeds:
+                if group in (_ATAC_RC, _GEX_RC):
+                    seed = RC(seed)
+
+                self._seed_groups.setdefault(seed, []).append(group)
+
+    def seed_hits(self, seq, windows=None):
+        """
+        Find seed hits for every seed group in one pass over the seeds.
+        Each seed is located with str.find, which runs in C and
+        finds overlapping hits.
+
+        :param seq: Uppercase read sequence
+        :type seq: str
+        :param windows: Only find seeds inside these (start, end) windows,
+            which must be the same on both strands, defaults to None
+            (the whole read)
+        :type windows: list((int, int)), optional
+
+        :return: Sorted seed hit start positions for each seed group,
+            reverse complement hits are positions in the reverse
+            complemented read
+        :rtype: list(list(int))
+        """
+
+        n = len(seq)
+        hits = [[], [], [], []]
+
+        if windows is None:
+            windows = [(0, n)]
+
+        for seed, groups in self._seed_groups.items():
+            k = len(seed)
+
+            for _start, _end in windows:
+                p = seq.find(seed, _start, _end)
+
+                while p != -1:
+                    for group in groups:
+                        if group == _ATAC_RC or group == _GEX_RC:
+                            hits[group].append(n - p - k)
+                        else:
+                            hits[group].append(p)
+
+                    p = seq.find(seed, p + 1, _end)
+
+        for group_hits in hits:
+            group_hits.sort()
+
+        return hits
+
+    def classify(self, seq, qual):
+        """
+        Classify one read. ATAC takes precedence over GEX.
+
+        :param seq: Read sequence
+        :type seq: str
+        :param qual: Read quality string
+        :type qual: str
+
+        :return: Tuple of ('atac', get_atac_anchors result),
+            ('gex', get_gex_anchors result), or (None, None)
+        :rtype: (str, tuple)
+        """
+
+        return self.classify_reads([seq], [qual])[0]
+
+    def classify_batch(self, batch):
+        """
+        Classify every read in a batch
+
+        :param batch: Reads to classify
+        :type batch: ReadBatch
+
+        :return: List of classify results, one for each read
+        :rtype: list((str, tuple))
+        """
+
+        return self.classify_reads(batch.sequences(), batch.qualities())
+
+    def classify_reads(self, seqs, quals):
+        """
+        Classify a list of reads. Adapter matches from all reads are
+        collected for each adapter and strand, then aligned in one
+        align_barcodes_parasail call.
+
+        :param seqs: Read sequences
+        :type seqs: list(str)
+        :param quals: Read quality strings
+        :type quals: list(str)
+
+        :return: List of classify results, one for each read
+        :rtype: list((str, tuple))
+        """
+
+        seqs = [seq.upper() for seq in seqs]
+
+        if self.end_window_search is None:
+            return self._classify_reads(seqs, quals)
+
+        # Search the ends of long reads, then search the reads
+        # where nothing was found in full
+        windows = self.end_window_search.windows(seqs)
+        results = self._classify_reads(seqs, quals, windows)
+
+        _fallback = self.end_window_search.fallback(
+            seqs,
+            windows,
+            [x[0] is not None for x in results]
+        )
+
+        if len(_fallback) > 0:
+            _results = self._classify_reads(
+                [seqs[i] for i in _fallback],
+                [quals[i] for i in _fallback]
+            )
+
+            self.end_window_search.fallback_found(
+                [x[0] is not None for x in _results]
+            )
+
+            for i, x in zip(_fallback, _results):
+                results[i] = x
+
+        return results
+
+    def _classify_reads(self, seqs, quals, windows=None):
+
+        if windows is None:
+            windows = [None] * len(seqs)
+
+        n = len(seqs)
+        order = self.atac_order()
+
+        # Seeds for all adapters are found in one pass for the regex
+        # backend, Myers distances are computed for the reads each
+        # adapter is searched in
+        if self.search_backend == 'myers':
+            search = None
+        else:
+            search = [
+                self.seed_hits(seq, _windows)
+                for seq, _windows in zip(seqs, windows)
+            ]
+
+        # Reads that get both ATAC checks, to keep unbiased estimates
+        # of how often each check passes
+        if self.adaptive_order:
+            _sampled = set(range(0, n, ADAPTIVE_SAMPLE_EVERY))
+        else:
+            _sampled = set()
+
+        _tn5_spans = {}
+
+        def _scan_tn5(indices):
+            indices = [i for i in indices if i not in _tn5_spans]
+
+            _start = time.perf_counter()
+            _tn5_spans.update(zip(
+                indices,
+                scan_atac_tn5_spans(
+                    [seqs[i] for i in indices],
+                    [windows[i] for i in indices]
+                )
+            ))
+            self._time_step('tn5', time.perf_counter() - _start, len(indices))
+
+        # ATAC reads need a barcode and Tn5 mosaic ends; the Tn5 scan
+        # is a cheap check which rules out ATAC before the barcode
+        # search if most reads aren't ATAC reads
+        if order == TN5_FIRST:
+            _scan_tn5(range(n))
+            _candidates = [
+                i for i in range(n)
+                if i in _sampled or self._tn5_possible(_tn5_spans[i])
+            ]
+        else:
+            _candidates = range(n)
+
+        _start = time.perf_counter()
+        _atac_barcodes = self._find_barcodes(
+            seqs,
+            quals,
+            search,
+            windows,
+            _candidates,
+            (_ATAC_FWD, _ATAC_RC),
+            tenx_re,
+            TENX_ATAC_ADAPTER,
+            (16, 16)
+        )
+        self._time_step('barcode', time.perf_counter() - _start, len(_candidates))
+
+        # Tn5 mosaic ends of all reads with ATAC barcodes are
+        # scanned together
+        _scan_tn5(sorted(set(_atac_barcodes) | _sampled))
+
+        results = [(None, None)] * n
+        not_atac = []
+
+        for i in range(n):
+
+            if i not in _atac_barcodes:
+                not_atac.append(i)
+                continue
+
+            _bc, _bc_qual, _bc_pos, _fwd = _atac_barcodes[i]
+
+            tn5_locs = get_atac_tn5_locs(
+                seqs[i],
+                _bc_pos,
+                _fwd,
+                keep_runoff_fragments=self.keep_runoff_fragments,
+                min_len=self.atac_min_len,
+                tn5_spans=_tn5_spans[i]
+            )
+
+            if tn5_locs is None:
+                not_atac.append(i)
+            else:
+                results[i] = ATAC, (_bc, _bc_qual, tn5_locs)
+
+        # If not ATAC, try to identify as GEX reads
+        _barcodes = self._find_barcodes(
+            seqs,
+            quals,
+            search,
+            windows,
+            not_atac,
+            (_GEX_FWD, _GEX_RC),
+            gex_re,
+            TENX_GEX_ADAPTER,
+            (28, self.bc_len + self.umi_len)
+        )
+
+        for i, (_bc, _bc_qual, _bc_pos, _fwd) in _barcodes.items():
+
+            _gex = split_gex_barcode(
+                len(seqs[i]),
+                _bc,
+                _bc_qual,
+                _bc_pos,
+                _fwd,
+                min_len=self.gex_min_len,
+                bc_len=self.bc_len
+            )
+
+            if _gex[0] is not None:
+                results[i] = GEX, _gex
+
+        if self.adaptive_order:
+            self._count_order(
+                order,
+                results,
+                len(_candidates),
+                len(_tn5_spans),
+                len(_atac_barcodes),
+                [
+                    (i in _atac_barcodes, self._tn5_possible(_tn5_spans[i]))
+                    for i in sorted(_sampled)
+                ]
+            )
+
+        return results
+
+    def atac_order(self):
+        """
+        Choose which ATAC check runs first for the next reads. The Tn5
+        scan goes first if the expected cost per read of scanning every
+        read and searching barcodes only in reads with Tn5 mosaic ends is
+        lower than searching barcodes in every read and scanning reads
+        with barcodes, based on the checks of sampled reads so far.
+
+        :return: BARCODE_FIRST or TN5_FIRST
+        :rtype: str
+        """
+
+        if (
+            not self.adaptive_order or
+            self._samples[0] < ADAPTIVE_MIN_SAMPLES or
+            min(x[1] for x in self._times.values()) == 0
+        ):
+            return BARCODE_FIRST
+
+        _cost_barcode, _cost_tn5 = self._step_costs()
+        _p_barcode = self._samples[1] / self._samples[0]
+        _p_tn5 = self._samples[2] / self._samples[0]
+
+        if (
+            _cost_tn5 + _p_tn5 * _cost_barcode <
+            _cost_barcode + _p_barcode * _cost_tn5
+        ):
+            return TN5_FIRST
+
+        return BARCODE_FIRST
+
+    def pop_counts(self):
+        """
+        Get the search counts since the last call, and reset them
+
+        :return: Counts
+        :rtype: collections.Counter
+        """
+
+        counts, self.counts = self.counts, collections.Counter()
+
+        if self.end_window_search is not None:
+            counts.update(self.end_window_search.counts)
+            self.end_window_search.counts.clear()
+
+        return counts
+
+    def _tn5_possible(self, tn5_spans):
+
+        # Same counts as get_atac_tn5_locs accepts
+        return (
+            len(tn5_spans) == 2 or
+            (self.keep_runoff_fragments and len(tn5_spans) == 1)
+        )
+
+    def _time_step(self, step, seconds, n):
+
+        if n > 0:
+            self._times[step][0] += seconds
+            self._times[step][1] += n
+
+    def _step_costs(self):
+
+        return tuple(
+            self._times[k][0] / max(self._times[k][1], 1)
+            for k in ('barcode', 'tn5')
+        )
+
+    def _count_order(
+        self,
+        order,
+        results,
+        barcode_searches,
+        tn5_scans,
+        barcode_reads,
+        samples
+    ):
+
+        n = len(results)
+
+        for _barcode, _tn5 in samples:
+            self._samples[0] += 1
+            self._samples[1] += _barcode
+            self._samples[2] += _tn5
+
+        _modalities = collections.Counter(x[0] for x in results)
+
+        # Searches that barcode first order would have done,
+        # with barcodes in skipped reads estimated from the samples
+        _cost_barcode, _cost_tn5 = self._step_costs()
+        _skipped = n - barcode_searches
+        _baseline_scans = barcode_reads + _skipped * (
+            self._samples[1] / max(self._samples[0], 1)
+        )
+
+        _saved = (
+            _skipped * _cost_barcode -
+            (tn5_scans - _baseline_scans) * _cost_tn5
+        )
+
+        self.counts.update({
+            'reads': n,
+            'atac_reads': _modalities[ATAC],
+            'gex_reads': _modalities[GEX],
+            'other_reads': _modalities[None],
+            'atac_barcode_searches': barcode_searches,
+            'atac_barcode_searches_skipped': _skipped,
+            'tn5_scans': tn5_scans,
+            'tn5_first_batches': int(order == TN5_FIRST),
+            'estimated_ms_saved': int(round(_saved * 1000))
+        })
+
+    def _find_barcodes(
+        self,
+        seqs,
+        quals,
+        search,
+        windows,
+        indices,
+        groups,
+        compiled_regex,
+        comparison_sequence,
+        bc_lens
+    ):
+
+        barcodes = {}
+        indices = list(indices)
+
+        # Myers distances of both strands' patterns for these reads
+        if self.search_backend == 'myers':
+            _rows = {i: r for r, i in enumerate(indices)}
+            _myers = MyersBatch(
+                [seqs[i] for i in indices],
+                flanked_patterns=[_MYERS_PATTERNS[x] for x in groups],
+                windows=[windows[i] for i in indices]
+            )
+
+        # Forward strand first, then the reverse strand for reads
+        # without a forward strand barcode
+        for k, (group, bc_len, fwd) in enumerate(
+            zip(groups, bc_lens, (True, False))
+        ):
+
+            _reads, _windows, _window_quals, _offsets = [], [], [], []
+
+            for i in indices:
+                if self.search_backend == 'myers':
+                    _match = self._search_myers(
+                        seqs[i],
+                        quals[i],
+                        _myers.find(_rows[i], k),
+                        group
+                    )
+                else:
+                    _match = self._search(
+                        seqs[i],
+                        quals[i],
+                        search[i][group],
+                        group,
+                        compiled_regex
+                    )
+
+                if _match is not None:
+                    _reads.append(i)
+                    _windows.append(_match[0])
+                    _window_quals.append(_match[1])
+                    _offsets.append(_match[2])
+
+            for i, (_bc, _bc_qual, _bc_pos) in zip(
+                _reads,
+                align_barcodes_parasail(
+                    _windows,
+                    _window_quals,
+                    comparison_sequence,
+                    bc_len,
+                    offsets=_offsets
+                )
+            ):
+                if _bc is not None:
+                    barcodes[i] = _bc, _bc_qual, _bc_pos, fwd
+
+            indices = [i for i in indices if i not in barcodes]
+
+        return barcodes
+
+    def _search(self, seq, qual, hits, group, compiled_regex):
+
+        n = len(seq)
+        windows = self._prefilters[group].hit_windows(hits, n)
+
+        if group == _ATAC_FWD or group == _GEX_FWD:
+            _match = search_windows(compiled_regex, seq, windows)
+
+            if _match is None:
+                return None
+
+            _start, _end = _match.span()
+
+            return seq[_start:_end], qual[_start:_end], _start
+
+        # Reverse complement each window (in reverse complement
+        # coordinates) instead of the whole read
+        for _a, _b in windows:
+            _match = compiled_regex.search(RC(seq[n - _b:n - _a]))
+
+            if _match is None:
+                continue
+
+            _start, _end = _match.span()
+            _start, _end = _a + _start, _a + _end
+
+            # Same as slicing REV(qual)
+            _q = len(qual)
+
+            return _match.group(0), qual[_q - _end:_q - _start][::-1], _start
+
+        return None
+
+    @staticmethod
+    def _search_myers(seq, qual, span, group):
+
+        if span is None:
+            return None
+
+        _start, _end = span
+
+        if group == _ATAC_FWD or group == _GEX_FWD:
+            return seq[_start:_end], qual[_start:_end], _start
+
+        # Reverse complement match, with positions in the
+        # reverse complemented read
+        n = len(seq)
+        _q = len(qual) - n
+
+        return (
+            RC(seq[_start:_end]),
+            qual[_start + _q:_end + _q][::-1],
+            n - _end
+        )
@@ -1,6 +1,15 @@
 import regex
 
-from nanopore_10x_multiome.utils import RC, REV, get_barcode_parasail
+from nanopore_10x_multiome.utils import (
+    RC,
+    REV,
+    get_barcode_parasail,
+    get_barcode_parasail_span,
+    SeedPrefilter,
+    FlankedPattern,
+    MyersBatch,
+    check_search_backend
+)
 from nanopore_10x_multiome.barcodes import correct_barcode
 
 ###############################################################################
@@ -23,52 +32,255 @@ gex_re = regex.compile(
     regex.IGNORECASE
 )
 
+# Exact seeds from the 22bp constant region (up to 3 errors)
+# The longest gex_re match is 25 + 28 + 3 bases
+gex_prefilter = SeedPrefilter(
+    'CTACACGACGCTCTTCCGATCT',
+    3,
+    25 + 28 + 3
+)
+
+# The same pattern for the Myers search backend
+TENX_GEX_PATTERN = FlankedPattern(
+    'CTACACGACGCTCTTCCGATCT',
+    3,
+    28,
+    'TTT',
+    0
+)
+TENX_GEX_PATTERN_RC = TENX_GEX_PATTERN.reverse_complement()
+
 def get_gex_anchors(
     seq,
     qual,
     min_len=25,
     bc_len=16,
-    umi_len=12
+    umi_len=12,
+    search_backend='regex',
+    myers_search=None
 ):
 
+    check_search_backend(search_backend)
+
     n = len(seq)
     bc_umi_len = bc_len + umi_len
     seq = seq.upper()
 
+    if search_backend == 'myers':
+        if myers_search is None:
+            myers_search = gex_myers_search([seq]), 0
+
+        _bc, _bc_qual, _bc_pos, _bc_fwd = get_gex_barcode_myers(
+            seq,
+            qual,
+            *myers_search,
+            bc_umi_len=bc_umi_len
+        )
+
+        if _bc is None:
+            return None, None, None
+
+        return split_gex_barcode(
+            n,
+            _bc,
+            _bc_qual,
+            _bc_pos,
+            _bc_fwd,
+            min_len=min_len,
+            bc_len=bc_len
+        )
+
     # Find 10x GEX Barcode on the forward strand
     _bc, _bc_qual, _bc_pos = get_barcode_parasail(
         seq,
         qual,
         gex_re,
         TENX_GEX_ADAPTER,
-        bc_len=28
+        bc_len=28,
+        prefilter=gex_prefilter
     )
-    
+    _bc_fwd = True
+
     # If not on the forward strand, look on the reverse strand
     if _bc is None:
+        _bc_fwd = False
         _bc, _bc_qual, _bc_pos = get_barcode_parasail(
             RC(seq),
             REV(qual),
             gex_re,
             TENX_GEX_ADAPTER,
-            bc_len=bc_umi_len
+            bc_len=bc_umi_len,
+            prefilter=gex_prefilter
         )
 
         if _bc is None:
             return None, None, None
 
-        _seq_loc = 0, max(n - _bc_pos - len(_bc), 0)
+    return split_gex_barcode(
+        n,
+        _bc,
+        _bc_qual,
+        _bc_pos,
+        _bc_fwd,
+        min_len=min_len,
+        bc_len=bc_len
+    )
+
+def gex_myers_search(seqs):
+    """
+    Compute Myers distances for the GEX adapter on both strands,
+    for a list of reads at once
+
+    :param seqs: Uppercase read sequences
+    :type seqs: list(str)
+
+    :return: Myers distances for get_gex_barcode_myers
+    :rtype: MyersBatch
+    """
+
+    return MyersBatch(
+        seqs,
+        flanked_patterns=[TENX_GEX_PATTERN, TENX_GEX_PATTERN_RC]
+    )
+
+def get_gex_barcode_myers(seq, qual, search, i, bc_umi_len=28):
+    """
+    Find a GEX barcode + UMI with the Myers search backend
+
+    :param seq: Uppercase read sequence
+    :type seq: str
+    :param qual: Quality string to slice
+    :type qual: str
+    :param search: Myers distances from gex_myers_search
+    :type search: MyersBatch
+    :param i: Index of this read in the search
+    :type i: int
+    :param bc_umi_len: Barcode + UMI length for reverse strand
+        matches, defaults to 28
+    :type bc_umi_len: int
+
+    :return: Tuple of (
+        Barcode sequence string,
+        Barcode quality string,
+        Barcode start position,
+        Barcode is on the forward strand
+    )
+    :rtype: (str, str, int, bool)
+    """
+
+    # Forward strand first, then the reverse strand
+    for k, fwd, _len in ((0, True, 28), (1, False, bc_umi_len)):
+        _span = search.find(i, k)
+
+        if _span is None:
+            continue
+
+        _bc, _bc_qual, _bc_pos = get_barcode_parasail_span(
+            seq,
+            qual,
+            _span,
+            TENX_GEX_ADAPTER,
+            _len,
+            reverse_complement=not fwd
+        )
+
+        if _bc is not None:
+            return _bc, _bc_qual, _bc_pos, fwd
+
+    return None, None, None, None
+
+def split_gex_barcode(
+    n,
+    bc,
+    bc_qual,
+    bc_pos,
+    fwd,
+    min_len=25,
+    bc_len=16
+):
+    """
+    Split a GEX barcode + UMI into barcode and UMI and find the
+    cDNA sequence location
+
+    :param n: Read length
+    :type n: int
+    :param bc: Barcode and UMI sequence
+    :type bc: str
+    :param bc_qual: Barcode and UMI quality string
+    :type bc_qual: str
+    :param bc_pos: Barcode start position (on the strand it was found on)
+    :type bc_pos: int
+    :param fwd: Barcode was found on the forward strand
+    :type fwd: bool
+
+    :return: Tuple of (
+        (barcode sequence, barcode quality),
+        (UMI sequence, UMI quality),
+        (cDNA start, cDNA stop)
+    ), or Nones if the cDNA is shorter than min_len
+    :rtype: ((str, str), (str, str), (int, int))
+    """
+
+    if fwd:
+        _seq_loc = min(bc_pos + len(bc), n), n
     else:
-        _seq_loc = min(_bc_pos + len(_bc), n), n
+        _seq_loc = 0, max(n - bc_pos - len(bc), 0)
 
     if (_seq_loc[1] - _seq_loc[0]) < min_len:
         return None, None, None
-    
-    barcode = _bc[0:bc_len], _bc_qual[0:bc_len]
-    umi = _bc[bc_len:], _bc_qual[bc_len:]
+
+    barcode = bc[0:bc_len], bc_qual[0:bc_len]
+    umi = bc[bc_len:], bc_qual[bc_len:]
 
     return barcode, umi, _seq_loc
 
+def get_gex_anchors_batch(
+    batch,
+    indices=None,
+    min_len=25,
+    bc_len=16,
+    umi_len=12,
+    search_backend='regex'
+):
+    """
+    Search for GEX technical sequences in every read of a batch
+
+    :param batch: Reads to search
+    :type batch: ReadBatch
+    :param indices: Only search these reads, defaults to None (all reads)
+    :type indices: np.ndarray, list(int), optional
+    :param search_backend: Adapter search backend, 'regex' or 'myers',
+        defaults to 'regex'
+    :type search_backend: str, optional
+
+    :return: List of get_gex_anchors results, one for each searched read
+    :rtype: list(((str, str), (str, str), (int, int)))
+    """
+
+    seqs, quals = batch.sequences(), batch.qualities()
+
+    if indices is None:
+        indices = range(len(batch))
+
+    # Myers distances are computed for all reads in lockstep
+    if search_backend == 'myers':
+        _search = gex_myers_search([seqs[i].upper() for i in indices])
+    else:
+        _search = None
+
+    return [
+        get_gex_anchors(
+            seqs[i],
+            quals[i],
+            min_len=min_len,
+            bc_len=bc_len,
+            umi_len=umi_len,
+            search_backend=search_backend,
+            myers_search=(_search, r) if _search is not None else None
+        )
+        for r, i in enumerate(indices)
+    ]
+
 def process_gex_tags(
     barcode,
     barcode_quality,
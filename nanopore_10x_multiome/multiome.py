@@ -1,26 +1,44 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import itertools
+import logging
+import tempfile
 
 import numpy as np
 import joblib
 
 from nanopore_10x_multiome.utils import (
-    fastqProcessor,
-    get_file_writer,
+    ALIGNMENT_CACHE,
+    BAM_READ_THREADS,
+    BAM_WRITE_THREADS,
+    BGZF_COMPRESS_LEVEL,
+    POSITIONAL_TAGS,
+    BarcodeSidecarWriter,
+    BatchWriterThread,
+    ReadBatch,
+    fastq_read_batches,
+    bam_read_batches,
+    check_comment_format,
+    get_batch_writer,
     file_opener
 )
-from nanopore_10x_multiome.atac import (
-    get_atac_anchors,
-    process_atac_tags
-)
-from nanopore_10x_multiome.gex import (
-    get_gex_anchors,
-    process_gex_tags
+from nanopore_10x_multiome.atac import process_atac_tags
+from nanopore_10x_multiome.gex import process_gex_tags
+from nanopore_10x_multiome.classifier import (
+    ReadClassifier,
+    ATAC,
+    GEX
 )
 from nanopore_10x_multiome.barcodes import (
     load_missing_multiome_barcode_info,
+    translate_barcode,
     BarcodeHolder
 )
 
+logger = logging.getLogger(__name__)
+
 ###############################################################################
 # 10x multiome ATAC tags
 # CB - Corrected barcode and translated to match GEX sequence
@@ -48,12 +66,23 @@ def split_multiome_preamp_fastq(
     n_jobs=None,
     write_only_valid_barcodes=False,
     keep_runoff_fragments=False,
+    keep_order=True,
+    search_backend='regex',
+    end_window=None,
+    max_search_length=None,
+    adaptive_order=False,
+    max_barcode_dist=1,
+    keep_input_tags=False,
+    comment_format='key=value',
+    sidecar_path=None,
+    output_threads=None,
+    compresslevel=BGZF_COMPRESS_LEVEL,
     verbose=0
 ):
     """
     Split multiome pre-amplification FASTQ file(s) into ATAC, GEX and other reads.
 
-    :param in_file_name: Input FASTQ file path(s)
+    :param in_file_name: Input FASTQ or unaligned BAM file path(s)
     :type in_file_name: str, list
     :param atac_file_name: Output FASTQ file path(s) for ATAC reads
     :type atac_file_name: str, list
@@ -64,13 +93,67 @@ def split_multiome_preamp_fastq(
     :type other_file_name: str, list
     :param atac_technical_file_name: Optional output file(s) for ATAC technical sequences
     :type atac_technical_file_name: str, list, or None
-    :param n_jobs: Number of parallel processes for joblib, defaults to None
+    :param n_jobs: Number of parallel processes for joblib, also used to build
+        barcode correction tables which aren't cached yet, defaults to None.
+        A single input file is split into batches of reads which are
+        classified in n_jobs worker processes.
     :type n_jobs: int or None
     :param keep_runoff_fragments: Keep ATAC fragments where the barcode end is intact,
         but no Tn5 site is located on the other end. Defaults to False.
     :type keep_runoff_fragments: bool
     :param write_only_valid_barcodes: Only write reads with valid barcodes
     :type write_only_valid_barcodes: bool
+    :param keep_order: Write reads from a single input file in input order
+        when classifying in parallel, otherwise batches are written as
+        they finish. Defaults to True.
+    :type keep_order: bool
+    :param search_backend: Adapter search backend, 'regex' for fuzzy
+        regular expressions or 'myers' for Myers bit-parallel edit
+        distances. Defaults to 'regex'.
+    :type search_backend: str
+    :param end_window: Search only this many bases at each end of a read
+        for adapters first, and the whole read only if none are found.
+        How often the whole read is searched is logged for each file.
+        Defaults to None (always search the whole read).
+    :type end_window: int or None
+    :param max_search_length: Don't search reads longer than this in full
+        when their end windows have no adapters. Defaults to None (no limit).
+    :type max_search_length: int or None
+    :param adaptive_order: Scan for Tn5 mosaic ends before searching for
+        ATAC barcodes when most reads aren't ATAC reads, based on the reads
+        classified so far. Reads are classified the same way. Search counts
+        and the estimated time saved are logged for each file.
+        Defaults to False.
+    :type adaptive_order: bool
+    :param max_barcode_dist: Rescue barcodes within this edit distance
+        of a whitelist barcode if they can't be corrected with one edit.
+        Uses a deletion index of each whitelist, built the first time
+        it's needed in each process. Defaults to 1 (no rescue).
+    :type max_barcode_dist: int
+    :param keep_input_tags: Copy the tags of BAM input records to the
+        output reads. Tags set by splitting take precedence, and tags
+        with read positions (POSITIONAL_TAGS) are only kept on the
+        untrimmed other reads. Defaults to False.
+    :type keep_input_tags: bool
+    :param comment_format: Format of tags in FASTQ output header comments,
+        'key=value' (CB=ACGT) or 'sam' (tab separated CB:Z:ACGT tags, which
+        ``minimap2 -y`` copies into alignments, so the aligned files don't
+        need ``sam_comment_to_tag``). With 'sam', input FASTQ header
+        comments that aren't SAM tags are dropped. Defaults to 'key=value'.
+    :type comment_format: str
+    :param sidecar_path: Write barcode tags (CB, CR, CY, UB, UR, UY) to a
+        sidecar directory of read ID -> tag arrays instead of FASTQ header
+        comments, to tag aligned files with ``tag_bam_from_sidecar``.
+        A list with one directory per input file if in_file_name is a list.
+        Defaults to None (tags in header comments).
+    :type sidecar_path: str or list(str), optional
+    :param output_threads: Number of threads compressing each .fastq.gz
+        or .bam output file, defaults to None (BAM_WRITE_THREADS for BAM
+        output and 1 for .fastq.gz output)
+    :type output_threads: int or None
+    :param compresslevel: zlib compression level of .fastq.gz and .bam
+        output files, defaults to BGZF_COMPRESS_LEVEL
+    :type compresslevel: int
     :param verbose: Verbose parameter for joblib.Parallel
     :type verbose: int
 
@@ -78,8 +161,9 @@ def split_multiome_preamp_fastq(
     :rtype: numpy.ndarray
     """
 
-    load_missing_multiome_barcode_info(pbar=verbose > 0)
-    
+    check_comment_format(comment_format)
+    load_missing_multiome_barcode_info(pbar=verbose > 0, n_jobs=n_jobs)
+
     if not isinstance(in_file_name, (tuple, list)):
         return _split_multiome_preamp_fastq(
             in_file_name,
@@ -89,33 +173,77 @@ def split_multiome_preamp_fastq(
             atac_technical_file_name,
             write_only_valid_barcodes=write_only_valid_barcodes,
             keep_runoff_fragments=keep_runoff_fragments,
+            n_jobs=n_jobs,
+            keep_order=keep_order,
+            search_backend=search_backend,
+            end_window=end_window,
+            max_search_length=max_search_length,
+            adaptive_order=adaptive_order,
+            max_barcode_dist=max_barcode_dist,
+            keep_input_tags=keep_input_tags,
+            comment_format=comment_format,
+            sidecar_path=sidecar_path,
+            output_threads=output_threads,
+            compresslevel=compresslevel
         )
 
     if atac_technical_file_name is None:
         atac_technical_file_name = itertools.repeat(None)
 
-    return np.stack([
-        r
-        for r in joblib.Parallel(
-            n_jobs=n_jobs,
-            batch_size=1,
-            verbose=verbose,
-            backend='multiprocessing'
-        )(
-            joblib.delayed(_split_multiome_preamp_fastq)(
-                *files,
-                write_only_valid_barcodes=write_only_valid_barcodes,
-                keep_runoff_fragments=keep_runoff_fragments
-            )
-            for files in zip(
-                in_file_name,
-                atac_file_name,
-                gex_file_name,
-                other_file_name,
-                atac_technical_file_name
-            )
+    if sidecar_path is None:
+        sidecar_path = itertools.repeat(None)
+    elif (
+        not isinstance(sidecar_path, (tuple, list)) or
+        len(sidecar_path) != len(in_file_name)
+    ):
+        raise ValueError(
+            "sidecar_path must be a list with one sidecar directory for "
+            f"each of the {len(in_file_name)} input files; "
+            f"{sidecar_path} provided"
+        )
+
+    # Build the barcode tables once and write them to a store that
+    # workers memory-map, instead of every worker rebuilding them
+    with tempfile.TemporaryDirectory() as barcode_store:
+        BarcodeHolder.export(
+            barcode_store,
+            deletion_indices=max_barcode_dist > 1
         )
-    ])
+
+        return np.stack([
+            r
+            for r in joblib.Parallel(
+                n_jobs=n_jobs,
+                batch_size=1,
+                verbose=verbose,
+                backend='multiprocessing'
+            )(
+                joblib.delayed(_split_multiome_preamp_fastq)(
+                    *files,
+                    write_only_valid_barcodes=write_only_valid_barcodes,
+                    keep_runoff_fragments=keep_runoff_fragments,
+                    barcode_store=barcode_store,
+                    search_backend=search_backend,
+                    end_window=end_window,
+                    max_search_length=max_search_length,
+                    adaptive_order=adaptive_order,
+                    max_barcode_dist=max_barcode_dist,
+                    keep_input_tags=keep_input_tags,
+                    comment_format=comment_format,
+                    sidecar_path=_sidecar_path,
+                    output_threads=output_threads,
+                    compresslevel=compresslevel
+                )
+                for *files, _sidecar_path in zip(
+                    in_file_name,
+                    atac_file_name,
+                    gex_file_name,
+                    other_file_name,
+                    atac_technical_file_name,
+                    sidecar_path
+                )
+            )
+        ])
 
 
 def _split_multiome_preamp_fastq(
@@ -126,12 +254,26 @@ def _split_multiome_preamp_fastq(
     atac_technical_file_name=None,
     n_records=None,
     write_only_valid_barcodes=False,
-    keep_runoff_fragments=False
+    keep_runoff_fragments=False,
+    barcode_store=None,
+    n_jobs=None,
+    keep_order=True,
+    shard=None,
+    search_backend='regex',
+    end_window=None,
+    max_search_length=None,
+    adaptive_order=False,
+    max_barcode_dist=1,
+    keep_input_tags=False,
+    comment_format='key=value',
+    sidecar_path=None,
+    output_threads=None,
+    compresslevel=BGZF_COMPRESS_LEVEL
 ):
     """
     Split a multiome pre-amplification FASTQ file into ATAC, GEX and other reads.
 
-    :param in_file_name: Input FASTQ file path
+    :param in_file_name: Input FASTQ or unaligned BAM file path
     :type in_file_name: str
     :param atac_file_name: Output FASTQ file path for ATAC reads
     :type atac_file_name: str
@@ -158,131 +300,576 @@ def _split_multiome_preamp_fastq(
     :type write_only_valid_barcodes: bool
     :param keep_runoff_fragments: Keep ATAC fragments where the barcode end is intact,
         but no Tn5 site is located on the other end. Defaults to False.
+    :param barcode_store: Directory of a barcode store written by
+        ``BarcodeHolder.export`` to attach to instead of building tables
+    :type barcode_store: str or None
+    :param n_jobs: Number of worker processes to classify batches of reads
+        from this file in, defaults to None (classify in this process)
+    :type n_jobs: int or None
+    :param keep_order: Write reads in input order when using worker processes,
+        otherwise batches are written as they finish. Defaults to True.
+    :type keep_order: bool
+    :param shard: Only split records between these (start, stop) offsets
+        from ``fastq_shards``, defaults to None (the whole file)
+    :type shard: tuple(int, int or None), optional
+    :param search_backend: Adapter search backend, 'regex' or 'myers',
+        defaults to 'regex'
+    :type search_backend: str
+    :param end_window: Search only this many bases at each end of a read
+        first, defaults to None (always search the whole read)
+    :type end_window: int or None
+    :param max_search_length: Don't search reads longer than this in full
+        when their end windows have no adapters, defaults to None
+    :type max_search_length: int or None
+    :param adaptive_order: Adapt the order of ATAC checks to the reads
+        classified so far, defaults to False
+    :type adaptive_order: bool
+    :param max_barcode_dist: Rescue barcodes within this edit distance
+        of the whitelist, defaults to 1 (no rescue)
+    :type max_barcode_dist: int
+    :param keep_input_tags: Copy the tags of BAM input records to the
+        output reads (except POSITIONAL_TAGS on trimmed reads),
+        defaults to False
+    :type keep_input_tags: bool
+    :param comment_format: Format of tags in FASTQ output header comments,
+        'key=value' or 'sam', defaults to 'key=value'
+    :type comment_format: str
+    :param sidecar_path: Write barcode tags to this sidecar directory
+        instead of FASTQ header comments, defaults to None
+    :type sidecar_path: str or None
+    :param output_threads: Number of threads compressing each .fastq.gz
+        or .bam output file, defaults to None (BAM_WRITE_THREADS for BAM
+        output and 1 for .fastq.gz output)
+    :type output_threads: int or None
+    :param compresslevel: zlib compression level of .fastq.gz and .bam
+        output files, defaults to BGZF_COMPRESS_LEVEL
+    :type compresslevel: int
 
     :return: Array of counts [ATAC reads, GEX reads, other reads]
     :rtype: numpy.ndarray
     """
 
+    _n_jobs = joblib.effective_n_jobs(n_jobs) if n_jobs is not None else 1
+
+    # Workers attach to a barcode store, so write one if there isn't one
+    if _n_jobs > 1 and barcode_store is None:
+        with tempfile.TemporaryDirectory() as barcode_store:
+            BarcodeHolder.export(
+                barcode_store,
+                deletion_indices=max_barcode_dist > 1
+            )
+
+            return _split_multiome_preamp_fastq(
+                in_file_name,
+                atac_file_name,
+                gex_file_name,
+                other_file_name,
+                atac_technical_file_name,
+                n_records=n_records,
+                write_only_valid_barcodes=write_only_valid_barcodes,
+                keep_runoff_fragments=keep_runoff_fragments,
+                barcode_store=barcode_store,
+                n_jobs=n_jobs,
+                keep_order=keep_order,
+                shard=shard,
+                search_backend=search_backend,
+                end_window=end_window,
+                max_search_length=max_search_length,
+                adaptive_order=adaptive_order,
+                max_barcode_dist=max_barcode_dist,
+                keep_input_tags=keep_input_tags,
+                comment_format=comment_format,
+                sidecar_path=sidecar_path,
+                output_threads=output_threads,
+                compresslevel=compresslevel
+            )
+
     # Initialize counters for ATAC, GEX and other reads
     result_counts = np.zeros(3, dtype=int)
+    search_counts = collections.Counter()
+
+    # Attach to shared barcode tables if the parent built them
+    if barcode_store is not None:
+        BarcodeHolder.attach(barcode_store)
 
     # Load any missing barcode information
     load_missing_multiome_barcode_info(pbar=False)
 
-    # Initialize FASTQ processor
-    processor = fastqProcessor(
-        verify_ids=False,
-        phred_type='raw',
-        n_records=n_records
+    _split = functools.partial(
+        _split_read_batch,
+        write_only_valid_barcodes=write_only_valid_barcodes,
+        keep_runoff_fragments=keep_runoff_fragments,
+        technical=atac_technical_file_name is not None,
+        search_backend=search_backend,
+        end_window=end_window,
+        max_search_length=max_search_length,
+        adaptive_order=adaptive_order,
+        max_barcode_dist=max_barcode_dist
+    )
+
+    _output = functools.partial(
+        _output_opener,
+        threads=output_threads,
+        compresslevel=compresslevel
     )
 
     # Open input and output files
+    # BAM input is decompressed on separate threads
     with (
-        file_opener(in_file_name, mode='r') as fh,
-        file_opener(atac_file_name, mode='w') as atac_fh,
-        file_opener(gex_file_name, mode='w') as gex_fh,
-        file_opener(other_file_name, mode='w') as other_fh
+        file_opener(
+            in_file_name,
+            mode='r',
+            shard=shard,
+            threads=BAM_READ_THREADS if _is_bam(in_file_name) else 1
+        ) as fh,
+        _output(atac_file_name) as atac_fh,
+        _output(gex_file_name) as gex_fh,
+        _output(other_file_name) as other_fh,
+        contextlib.ExitStack() as stack
     ):
-        
-        # Get file writers for each output
-        atac_writer = get_file_writer(atac_file_name)
-        gex_writer = get_file_writer(gex_file_name)
-        other_writer = get_file_writer(other_file_name)
 
         # Handle optional ATAC technical file
         if atac_technical_file_name is not None:
-            atac_tech_fh = file_opener(atac_technical_file_name, mode='w')
-            atac_tech_writer = get_file_writer(atac_technical_file_name)
+            atac_tech_fh = stack.enter_context(
+                _output(atac_technical_file_name)
+            )
         else:
             atac_tech_fh = None
-            atac_tech_writer = None
 
-        try:
-            # Process each FASTQ record
-            for x in processor.fastq_gen(fh):
+        # Barcode tags go to a sidecar instead of the output headers
+        if sidecar_path is not None:
+            sidecar = stack.enter_context(BarcodeSidecarWriter(sidecar_path))
+        else:
+            sidecar = None
 
-                c, s, q = x[0]  # header, sequence, quality scores
+        # Get batch writers for each output
+        # Writers run in their own threads when classifying in parallel
+        def _writer(handle, file_name):
 
-                # First try to identify as ATAC read
-                _bc, _bc_qual, tn5_locs = get_atac_anchors(
-                    s,
-                    q,
-                    keep_runoff_fragments=keep_runoff_fragments
-                )
+            if handle is None:
+                return None
 
-                if _bc is not None:
-                    # Process ATAC barcode and check validity
-                    _tags, _valid = process_atac_tags(
-                        _bc,
-                        _bc_qual,
-                        BarcodeHolder.atac_correction_table,
-                        BarcodeHolder.atac_gex_translation_table
-                    )
-
-                    if write_only_valid_barcodes and not _valid:
-                        continue
-
-                    # Write ATAC read
-                    atac_writer(
-                        atac_fh,
-                        c,
-                        s[tn5_locs[1]:tn5_locs[2]],
-                        q[tn5_locs[1]:tn5_locs[2]],
-                        **_tags
-                    )
-
-                    # Write technical sequence if requested
-                    if atac_tech_fh is not None:
-                        atac_tech_writer(
-                            atac_tech_fh,
-                            c,
-                            s[:tn5_locs[1]] + '----' + s[tn5_locs[2]:],
-                            q[:tn5_locs[1]] + '----' + q[tn5_locs[2]:],
-                           **_tags
-                        )
-
-                    result_counts[0] += 1
-                    continue
-
-                # If not ATAC, try to identify as GEX read
-                _bc, _umi, gex_locs = get_gex_anchors(s, q)
-
-                if _bc is not None:
-                    # Process GEX barcode and UMI, check validity
-                    _tags, _valid = process_gex_tags(
-                        _bc[0],
-                        _bc[1],
-                        _umi[0],
-                        _umi[1],
-                        BarcodeHolder.gex_correction_table
-                    )
-
-                    if write_only_valid_barcodes and not _valid:
-                        continue
-
-                    # Write GEX read
-                    gex_writer(
-                        gex_fh,
-                        c,
-                        s[gex_locs[0]:gex_locs[1]],
-                        q[gex_locs[0]:gex_locs[1]],
-                        **_tags
-                    )
-                    result_counts[1] += 1
-                    continue
-
-                # If neither ATAC nor GEX, write to other file
-                other_writer(
-                    other_fh,
-                    c,
-                    s,
-                    q
-                )
-                result_counts[2] += 1
+            _write = get_batch_writer(
+                file_name,
+                comment_format=comment_format
+            )
 
-        finally:
-            # Ensure technical file is closed if it was opened
-            if atac_tech_fh is not None:
-                atac_tech_fh.close()
+            if _n_jobs > 1:
+                return stack.enter_context(
+                    BatchWriterThread(handle, _write)
+                ).write
+            else:
+                return functools.partial(_write, handle)
+
+        atac_writer = _writer(atac_fh, atac_file_name)
+        gex_writer = _writer(gex_fh, gex_file_name)
+        other_writer = _writer(other_fh, other_file_name)
+        atac_tech_writer = _writer(atac_tech_fh, atac_technical_file_name)
+
+        # Process the FASTQ or BAM file in batches of records
+        if _is_bam(in_file_name):
+            batches = bam_read_batches(fh, keep_tags=keep_input_tags)
+        else:
+            batches = fastq_read_batches(fh)
+
+        batches = _limit_batches(batches, n_records)
+
+        if _n_jobs > 1:
+            results = _pool_imap(
+                _split,
+                batches,
+                _n_jobs,
+                barcode_store,
+                keep_order=keep_order
+            )
+        else:
+            results = map(_split, batches)
+
+        for atac, atac_tech, gex, other, _search_counts in results:
+
+            if sidecar is not None:
+                sidecar.add(*atac)
+                sidecar.add(*gex)
+
+                atac = atac[0], sidecar.strip(atac[1])
+                gex = gex[0], sidecar.strip(gex[1])
+
+                if atac_tech is not None:
+                    atac_tech = atac_tech[0], sidecar.strip(atac_tech[1])
+
+            atac_writer(*atac)
+            gex_writer(*gex)
+            other_writer(*other)
+
+            if atac_tech_writer is not None:
+                atac_tech_writer(*atac_tech)
+
+            result_counts += [len(atac[0]), len(gex[0]), len(other[0])]
+
+            search_counts.update(_search_counts)
+
+    # Report how often end window searches fell back to whole reads,
+    # the searches adaptive order skipped, and barcode alignment cache use
+    if len(search_counts) > 0:
+        logger.info(
+            "Search counts of %s: %s",
+            in_file_name,
+            ", ".join(f"{k}={v}" for k, v in search_counts.items())
+        )
 
     return result_counts
+
+
+def _is_bam(file_name):
+    return file_name.endswith('.bam')
+
+
+# Unaligned BAM and .fastq.gz output is compressed on separate threads
+def _output_opener(file_name, threads=None, compresslevel=BGZF_COMPRESS_LEVEL):
+
+    if threads is None:
+        threads = BAM_WRITE_THREADS if _is_bam(file_name) else 1
+
+    return file_opener(
+        file_name,
+        mode='w',
+        threads=threads,
+        compresslevel=compresslevel
+    )
+
+
+def _limit_batches(batches, n_records=None):
+
+    if n_records is None:
+        yield from batches
+        return
+
+    for batch in batches:
+        batch = batch[:n_records]
+        n_records -= len(batch)
+
+        if len(batch) > 0:
+            yield batch
+
+        if n_records <= 0:
+            return
+
+
+def _pool_imap(
+    func,
+    batches,
+    n_jobs,
+    barcode_store,
+    keep_order=True,
+    max_in_flight=None
+):
+    """
+    Map a function over batches in a pool of worker processes attached
+    to a barcode store. At most ``max_in_flight`` batches (default
+    ``2 * n_jobs``) are submitted and not yet yielded at once, so reading
+    the input never gets far ahead of the workers.
+
+    :param keep_order: Yield results in input order, otherwise
+        yield them as they finish
+    :type keep_order: bool
+    """
+
+    if max_in_flight is None:
+        max_in_flight = 2 * n_jobs
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_jobs,
+        initializer=BarcodeHolder.attach,
+        initargs=(barcode_store, )
+    ) as pool:
+
+        in_flight = collections.deque()
+
+        def _next_done():
+
+            if keep_order:
+                return [in_flight.popleft()]
+
+            done, _ = concurrent.futures.wait(
+                in_flight,
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+
+            for f in done:
+                in_flight.remove(f)
+
+            return done
+
+        try:
+            for batch in batches:
+                in_flight.append(pool.submit(func, batch))
+
+                if len(in_flight) >= max_in_flight:
+                    for f in _next_done():
+                        yield f.result()
+
+            while len(in_flight) > 0:
+                for f in _next_done():
+                    yield f.result()
+
+        finally:
+            for f in in_flight:
+                f.cancel()
+
+
+def _split_read_batch(
+    batch,
+    write_only_valid_barcodes=False,
+    keep_runoff_fragments=False,
+    technical=False,
+    search_backend='regex',
+    end_window=None,
+    max_search_length=None,
+    adaptive_order=False,
+    max_barcode_dist=1
+):
+    """
+    Classify a batch of reads as ATAC, GEX or other reads, and split
+    it into a batch of output reads with tags for each.
+
+    :param batch: Reads to classify
+    :type batch: ReadBatch
+    :param write_only_valid_barcodes: Drop reads without valid barcodes
+    :type write_only_valid_barcodes: bool
+    :param keep_runoff_fragments: Keep ATAC fragments where the barcode end is intact,
+        but no Tn5 site is located on the other end. Defaults to False.
+    :type keep_runoff_fragments: bool
+    :param technical: Build the ATAC technical sequence batch
+    :type technical: bool
+    :param search_backend: Adapter search backend, 'regex' or 'myers'
+    :type search_backend: str
+    :param end_window: Search only this many bases at each end of a read
+        first, defaults to None (always search the whole read)
+    :type end_window: int or None
+    :param max_search_length: Don't search reads longer than this in full
+        when their end windows have no adapters, defaults to None
+    :type max_search_length: int or None
+    :param adaptive_order: Adapt the order of ATAC checks to the reads
+        classified so far in this process, defaults to False
+    :type adaptive_order: bool
+    :param max_barcode_dist: Rescue barcodes within this edit distance
+        of the whitelist, defaults to 1 (no rescue)
+    :type max_barcode_dist: int
+
+    :return: (ReadBatch, tags) pairs for ATAC, ATAC technical
+        (None if technical is False), GEX and other reads, and the
+        search counts for this batch
+    :rtype: tuple((ReadBatch, list(dict)))
+    """
+
+    atac_idx, atac_locs, atac_tags, atac_valid = [], [], [], []
+    gex_idx, gex_locs, gex_tags, gex_valid = [], [], [], []
+    other_idx = []
+    rescue_counts = collections.Counter()
+
+    classifier = _get_classifier(
+        keep_runoff_fragments=keep_runoff_fragments,
+        search_backend=search_backend,
+        end_window=end_window,
+        max_search_length=max_search_length,
+        adaptive_order=adaptive_order
+    )
+
+    # Classify as ATAC reads first, then as GEX reads, in one pass
+    for i, (_modality, _anchors) in enumerate(
+        classifier.classify_batch(batch)
+    ):
+
+        if _modality == ATAC:
+            _bc, _bc_qual, tn5_locs = _anchors
+
+            # Process ATAC barcode and check validity
+            _tags, _valid = process_atac_tags(
+                _bc,
+                _bc_qual,
+                BarcodeHolder.atac_correction_table,
+                BarcodeHolder.atac_gex_translation_table
+            )
+
+            atac_idx.append(i)
+            atac_locs.append(tn5_locs)
+            atac_tags.append(_tags)
+            atac_valid.append(_valid)
+
+        elif _modality == GEX:
+            _bc, _umi, _gex_locs = _anchors
+
+            # Process GEX barcode and UMI, check validity
+            _tags, _valid = process_gex_tags(
+                _bc[0],
+                _bc[1],
+                _umi[0],
+                _umi[1],
+                BarcodeHolder.gex_correction_table
+            )
+
+            gex_idx.append(i)
+            gex_locs.append(_gex_locs)
+            gex_tags.append(_tags)
+            gex_valid.append(_valid)
+
+        else:
+            other_idx.append(i)
+
+    # Rescue barcodes the correction tables can't correct, for the
+    # whole batch at once
+    if max_barcode_dist > 1:
+        BarcodeHolder.load_deletion_indices()
+
+        _rescue_barcodes(
+            atac_tags,
+            atac_valid,
+            BarcodeHolder.atac_deletion_index,
+            max_barcode_dist,
+            rescue_counts,
+            translation_table=BarcodeHolder.atac_gex_translation_table
+        )
+        _rescue_barcodes(
+            gex_tags,
+            gex_valid,
+            BarcodeHolder.gex_deletion_index,
+            max_barcode_dist,
+            rescue_counts
+        )
+
+    if write_only_valid_barcodes:
+        atac_idx, atac_locs, atac_tags = _valid_only(
+            atac_valid, atac_idx, atac_locs, atac_tags
+        )
+        gex_idx, gex_locs, gex_tags = _valid_only(
+            gex_valid, gex_idx, gex_locs, gex_tags
+        )
+
+    atac_locs = np.array(atac_locs, dtype=np.int64).reshape(-1, 4)
+    gex_locs = np.array(gex_locs, dtype=np.int64).reshape(-1, 2)
+
+    # Carry tags from BAM input through, under the tags set here
+    # Tags with read positions only stay on untrimmed reads
+    if batch.tags is not None:
+        atac_tags = _with_input_tags(batch.tags, atac_idx, atac_tags)
+        gex_tags = _with_input_tags(batch.tags, gex_idx, gex_tags)
+        other_tags = [batch.tags[i] for i in other_idx]
+    else:
+        other_tags = None
+
+    # Technical sequences with the genomic insert masked out
+    if technical:
+        seqs, quals = batch.sequences(), batch.qualities()
+        atac_tech = ReadBatch.from_lists(
+            [batch.header(i) for i in atac_idx],
+            [
+                seqs[i][:a] + '----' + seqs[i][b:]
+                for i, a, b in zip(atac_idx, atac_locs[:, 1], atac_locs[:, 2])
+            ],
+            [
+                quals[i][:a] + '----' + quals[i][b:]
+                for i, a, b in zip(atac_idx, atac_locs[:, 1], atac_locs[:, 2])
+            ]
+        ), atac_tags
+    else:
+        atac_tech = None
+
+    return (
+        (batch.take(atac_idx, atac_locs[:, 1], atac_locs[:, 2]), atac_tags),
+        atac_tech,
+        (batch.take(gex_idx, gex_locs[:, 0], gex_locs[:, 1]), gex_tags),
+        (batch.take(other_idx), other_tags),
+        _search_counts(classifier, rescue_counts)
+    )
+
+
+def _with_input_tags(input_tags, indices, tags):
+    return [
+        {
+            **{
+                k: v for k, v in input_tags[i].items()
+                if k not in POSITIONAL_TAGS
+            },
+            **_tags
+        }
+        for i, _tags in zip(indices, tags)
+    ]
+
+
+def _search_counts(classifier, rescue_counts):
+
+    counts = classifier.pop_counts()
+    counts.update({
+        f'alignment_cache_{k}': v
+        for k, v in ALIGNMENT_CACHE.pop_counts().items()
+    })
+    counts.update(rescue_counts)
+
+    return counts
+
+
+def _rescue_barcodes(
+    tags,
+    valid,
+    deletion_index,
+    max_dist,
+    counts,
+    translation_table=None
+):
+    """
+    Correct invalid barcodes within an edit distance of the whitelist,
+    updating their tags and validity in place
+
+    :param tags: Tags of each read, with raw barcodes in CR and their
+        qualities in CY
+    :type tags: list(dict)
+    :param valid: Barcode validity of each read
+    :type valid: list(bool)
+    :param deletion_index: Deletion index of the whitelist
+    :type deletion_index: DeletionIndex
+    :param max_dist: Maximum edit distance
+    :type max_dist: int
+    :param counts: Counter for rescue attempts and rescued barcodes
+    :type counts: collections.Counter
+    :param translation_table: Table to translate rescued barcodes with,
+        defaults to None
+    :type translation_table: dict, optional
+    """
+
+    _idx = [
+        i for i, (_tags, _valid) in enumerate(zip(tags, valid))
+        if not _valid and _tags['CR'] is not None
+    ]
+
+    _rescued = deletion_index.correct(
+        [tags[i]['CR'] for i in _idx],
+        [tags[i]['CY'] for i in _idx],
+        max_dist=max_dist
+    )
+
+    counts['barcode_rescue_queries'] += len(_idx)
+
+    for i, _bc in zip(_idx, _rescued):
+        if _bc is None:
+            continue
+
+        if translation_table is not None:
+            _bc = translate_barcode(_bc, translation_table)
+
+        tags[i]['CB'] = _bc
+        valid[i] = True
+        counts['barcodes_rescued'] += 1
+
+
+def _valid_only(valid, *lists):
+    return tuple(
+        [x for x, _valid in zip(_list, valid) if _valid]
+        for _list in lists
+    )
+
+
+# One classifier for each set of options in each process, so
+# adaptive order keeps what it learned between batches
+@functools.lru_cache(maxsize=None)
+def _get_classifier(**kwargs):
+    return ReadClassifier(**kwargs)
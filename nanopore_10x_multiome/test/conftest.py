@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+
+from nanopore_10x_multiome.barcodes._table_cache import CACHE_ENV_VAR
+
+_saved_cache_dir = None
+
+
+# Keep correction table caches built by tests out of the user's cache
+# Set before collection, as some test modules load barcodes on import
+def pytest_configure(config):
+
+    global _saved_cache_dir
+
+    _saved_cache_dir = os.environ.get(CACHE_ENV_VAR)
+    os.environ[CACHE_ENV_VAR] = tempfile.mkdtemp(prefix='barcode_cache-')
+
+
+def pytest_unconfigure(config):
+
+    shutil.rmtree(os.environ[CACHE_ENV_VAR], ignore_errors=True)
+
+    if _saved_cache_dir is None:
+        del os.environ[CACHE_ENV_VAR]
+    else:
+        os.environ[CACHE_ENV_VAR] = _saved_cache_dir
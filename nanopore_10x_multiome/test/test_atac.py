@@ -1,11 +1,18 @@
+import random
+
 import pytest
 from nanopore_10x_multiome.atac import (
     get_atac_anchors,
+    scan_atac_tn5_spans,
     TENX_ATAC_ADAPTER,
-    tenx_re
+    TN5_MAX_SPANS,
+    tenx_re,
+    tn5_re,
+    tn5_rev_re
 )
 from nanopore_10x_multiome.utils import (
     RC,
+    SEARCH_BACKENDS,
     get_barcode_parasail
 )
 from nanopore_10x_multiome.utils.test import (
@@ -141,7 +148,8 @@ def test_missing_bases_moved_atac_parasail():
 
 
 
-def test_perfect_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_perfect_atac_full(search_backend):
     seq = create_atac_sequence(
         ATAC_BARCODE,
         0,
@@ -151,7 +159,8 @@ def test_perfect_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 29, 16)
+        create_qual(len(seq), 29, 16),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -163,7 +172,8 @@ def test_perfect_atac_full():
     assert locs == [67, 67 + TN5N, ABN + BSN, ABN + BSN + TN5N]
 
 
-def test_perfect_atac_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_perfect_atac_full_rc(search_backend):
     seq = create_atac_sequence(
         ATAC_BARCODE,
         0,
@@ -174,7 +184,8 @@ def test_perfect_atac_full_rc():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 29, 16, rev=True)
+        create_qual(len(seq), 29, 16, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -186,7 +197,8 @@ def test_perfect_atac_full_rc():
     assert locs == [0, 0 + TN5N, BSN + TN5N, BSN + 2 * TN5N]
 
 
-def test_extra_bases_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_extra_bases_atac_full(search_backend):
     seq = create_atac_sequence(
         'AATGATACGNGCGACCACCNGAGATCTACACATGCATGCATGCATGCCGCGTCTGTCGTCGGCAGNCGTCAGATGTGTATANAGAGACAG',
         0,
@@ -196,7 +208,8 @@ def test_extra_bases_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 31, 16)
+        create_qual(len(seq), 31, 16),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -208,7 +221,8 @@ def test_extra_bases_atac_full():
     assert locs == [67 + 3, 67 + 3 + 1 + TN5N, ABN + BSN + 4, ABN + BSN + TN5N + 4 + 2]
 
 
-def test_extra_bases_atac_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_extra_bases_atac_full_rc(search_backend):
     seq = create_atac_sequence(
         'AATGATACGNGCGACCACCNGAGATCTACACATGCATGCATGCATGCCGCGTCTGTCGTCGGCAGNCGTCAGATGTGTATANAGAGACAG',
         0,
@@ -219,7 +233,8 @@ def test_extra_bases_atac_full_rc():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 31, 16, rev=True)
+        create_qual(len(seq), 31, 16, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -231,7 +246,8 @@ def test_extra_bases_atac_full_rc():
     assert locs == [0, 0 + TN5N + 2, 2 + BSN + TN5N, BSN + 2 * TN5N + 2 + 1]
 
 
-def test_missing_bases_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_missing_bases_atac_full(search_backend):
     seq = create_atac_sequence(
         'ATACGGCGACCACCGATCTACACATGCATGCATGCATGCCGCGTCTTCGTCGGCGCGTCAGATGTGTATAAGAGACAG',
         0,
@@ -241,7 +257,8 @@ def test_missing_bases_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 23, 16)
+        create_qual(len(seq), 23, 16),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -253,7 +270,8 @@ def test_missing_bases_atac_full():
     assert locs == [67 - 8, 67 - 8 + TN5N, ABN + BSN - 8, ABN + BSN + TN5N - 6]
 
 
-def test_missing_bases_atac_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_missing_bases_atac_full_rc(search_backend):
     seq = create_atac_sequence(
         'ATACGGCGACCACCGATCTACACATGCATGCATGCATGCCGCGTCTTCGTCGGCGCGTCAGATGTGTATAAGAGACAG',
         0,
@@ -264,7 +282,8 @@ def test_missing_bases_atac_full_rc():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 23, 16, rev=True)
+        create_qual(len(seq), 23, 16, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -276,7 +295,8 @@ def test_missing_bases_atac_full_rc():
     assert locs == [0, 0 + TN5N + 2, 2 + BSN + TN5N, BSN + 2 * TN5N + 2]
 
 
-def test_near_barcode_errors_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_near_barcode_errors_atac_full(search_backend):
     seq = create_atac_sequence(
         'AATGATACGGCGACCACCGAGATCCACATGCATGCATGCATGCCGTCTGTCGTCGGCAGCGTCAGATGTGTATAAGAGACAG',
         0,
@@ -286,7 +306,8 @@ def test_near_barcode_errors_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 27, 16)
+        create_qual(len(seq), 27, 16),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -298,7 +319,8 @@ def test_near_barcode_errors_atac_full():
     assert locs == [67 - 4, 67 - 4 + TN5N, ABN + BSN - 4, ABN + BSN + TN5N - 4]
 
 
-def test_within_barcode_insertion_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_within_barcode_insertion_atac_full(search_backend):
     seq = create_atac_sequence(
         'AATGATACGGCGACCACCGAGATCTACACATGCATGCGATGCATGCCGCGTCTGTCGTCGGCAGCGTCAGATGTGTATAAGAGACAG',
         0,
@@ -308,7 +330,8 @@ def test_within_barcode_insertion_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 29, 17)
+        create_qual(len(seq), 29, 17),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -320,7 +343,8 @@ def test_within_barcode_insertion_atac_full():
     assert locs == [67 + 1, 67 + TN5N + 1, ABN + BSN + 1, ABN + BSN + TN5N + 1]
 
 
-def test_within_barcode_loss_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_within_barcode_loss_atac_full(search_backend):
     seq = create_atac_sequence(
         'AATGATACGGCGACCACCGAGATCTACACATGCATGATGCATGCCGCGTCTGTCGTCGGCAGCGTCAGATGTGTATAAGAGACAG',
         0,
@@ -330,7 +354,8 @@ def test_within_barcode_loss_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 29, 15)
+        create_qual(len(seq), 29, 15),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -342,7 +367,8 @@ def test_within_barcode_loss_atac_full():
     assert locs == [67 - 1, 67 + TN5N - 1, ABN + BSN - 1, ABN + BSN + TN5N - 1]
 
 
-def test_within_barcode_loss_atac_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_within_barcode_loss_atac_full_rc(search_backend):
     seq = create_atac_sequence(
         'AATGATACGGCGACCACCGAGATCTACACATGCATGATGCATGCCGCGTCTGTCGTCGGCAGCGTCAGATGTGTATAAGAGACAG',
         0,
@@ -353,7 +379,8 @@ def test_within_barcode_loss_atac_full_rc():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        create_qual(len(seq), 29, 15, rev=True)
+        create_qual(len(seq), 29, 15, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[1]:locs[2]]
@@ -366,7 +393,8 @@ def test_within_barcode_loss_atac_full_rc():
 
 
 
-def test_no_barcode_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_no_barcode_atac_full(search_backend):
     seq = create_atac_sequence(
         RC(TN5_SEQ),
         0,
@@ -376,7 +404,8 @@ def test_no_barcode_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        "I" * len(seq)
+        "I" * len(seq),
+        search_backend=search_backend
     )
 
     assert bc is None
@@ -384,7 +413,8 @@ def test_no_barcode_atac_full():
     assert locs is None
 
 
-def test_no_second_tn5_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_no_second_tn5_atac_full(search_backend):
     seq = create_atac_sequence(
         ATAC_BARCODE,
         0,
@@ -394,7 +424,8 @@ def test_no_second_tn5_atac_full():
 
     bc, bcq, locs = get_atac_anchors(
         seq,
-        "I" * len(seq)
+        "I" * len(seq),
+        search_backend=search_backend
     )
 
     assert bc is None
@@ -402,7 +433,8 @@ def test_no_second_tn5_atac_full():
     assert locs is None
 
 
-def test_no_second_tn5_runoff_atac_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_no_second_tn5_runoff_atac_full(search_backend):
     seq = create_atac_sequence(
         ATAC_BARCODE,
         0,
@@ -413,7 +445,8 @@ def test_no_second_tn5_runoff_atac_full():
     bc, bcq, locs = get_atac_anchors(
         seq,
         "I" * len(seq),
-        keep_runoff_fragments=True
+        keep_runoff_fragments=True,
+        search_backend=search_backend
     )
 
     assert bc == "ATGCATGCATGCATGC"
@@ -421,7 +454,8 @@ def test_no_second_tn5_runoff_atac_full():
     assert locs == [0, ABN, ABN + BSN, ABN + BSN]
 
 
-def test_no_second_tn5_runoff_atac_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_no_second_tn5_runoff_atac_full_rc(search_backend):
     seq = create_atac_sequence(
         ATAC_BARCODE,
         0,
@@ -433,9 +467,64 @@ def test_no_second_tn5_runoff_atac_full_rc():
     bc, bcq, locs = get_atac_anchors(
         seq,
         "I" * len(seq),
-        keep_runoff_fragments=True
+        keep_runoff_fragments=True,
+        search_backend=search_backend
     )
 
     assert bc == "ATGCATGCATGCATGC"
     assert bcq == "IIIIIIIIIIIIIIII"
     assert locs == [0, 0, BSN, ABN + BSN]
+
+
+@pytest.mark.parametrize("windowed", [False, True])
+def test_scan_tn5_spans(windowed):
+
+    rng = random.Random(17)
+
+    def _mutate(seq, n):
+        seq = list(seq)
+
+        for _ in range(n):
+            i = rng.randrange(len(seq))
+            op = rng.randrange(3)
+
+            if op == 0:
+                seq[i] = rng.choice('ACGT')
+            elif op == 1:
+                seq.insert(i, rng.choice('ACGT'))
+            else:
+                del seq[i]
+
+        return ''.join(seq)
+
+    seqs = []
+
+    for _ in range(100):
+        seq = ''.join(rng.choice('ACGT') for _ in range(rng.randrange(0, 1500)))
+
+        for _ in range(rng.randrange(0, 5)):
+            i = rng.randrange(len(seq) + 1)
+            seq = seq[:i] + _mutate(rng.choice((TN5_SEQ, RC(TN5_SEQ))), rng.randrange(5)) + seq[i:]
+
+        seqs.append(seq)
+
+    if windowed:
+        windows = [
+            [(0, 200), (len(seq) - 200, len(seq))] if len(seq) > 400 else None
+            for seq in seqs
+        ]
+    else:
+        windows = [None] * len(seqs)
+
+    for seq, _windows, spans in zip(seqs, windows, scan_atac_tn5_spans(seqs, windows)):
+
+        if _windows is None:
+            _windows = [(0, len(seq))]
+
+        # Same mosaic ends as the regular expressions, up to TN5_MAX_SPANS
+        assert spans == [
+            y.span()
+            for _re in (tn5_re, tn5_rev_re)
+            for a, b in _windows
+            for y in _re.finditer(seq, a, b)
+        ][:TN5_MAX_SPANS]
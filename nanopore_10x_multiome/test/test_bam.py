@@ -2,12 +2,45 @@
 Generated with cursor/claude-3.5-sonnet and then fixed to actually work
 """
 
+import array
 import os
 import pytest
 import pysam
 import tempfile
 
-from nanopore_10x_multiome.utils._bam import split_bam_by_barcode, write_bam_record
+from nanopore_10x_multiome.utils._bam import (
+    split_bam_by_barcode,
+    write_bam_record,
+    bam_read_batches,
+    open_bam_reader,
+    open_ubam_writer,
+    write_ubam_batch
+)
+from nanopore_10x_multiome.utils import RC, ReadBatch, fastq_read_batches
+
+TEST_FILE = os.path.join(os.path.dirname(__file__), 'TEST_READS.fastq')
+
+
+def write_ubam(fastq_file, bam_file, **tags):
+    """Write the reads of a FASTQ file to an unaligned BAM file."""
+
+    with open(fastq_file) as fh:
+        reads = [r for batch in fastq_read_batches(fh) for r in batch]
+
+    with pysam.AlignmentFile(bam_file, "wb", header={'HD': {'VN': '1.6'}}) as out:
+        for i, (header, seq, qual) in enumerate(reads):
+            write_bam_record(
+                out,
+                header[1:].split()[0],
+                seq,
+                qual,
+                flag=4,
+                ch=i,
+                RG='run1',
+                **tags
+            )
+
+    return reads
 
 @pytest.fixture
 def temp_bam(tmp_path):
@@ -149,4 +182,98 @@ def test_custom_barcode_tag(temp_bam, tmp_path):
         barcode_tag='BC'
     )
     
-    assert result == {"group1": 1}
\ No newline at end of file
+    assert result == {"group1": 1}
+
+def test_bam_read_batches(tmp_path):
+    bam_path = str(tmp_path / "reads.bam")
+    reads = write_ubam(TEST_FILE, bam_path)
+
+    with open_bam_reader(bam_path) as fh:
+        batches = list(bam_read_batches(fh, block_size=20000))
+
+    assert len(batches) > 1
+    assert [r for batch in batches for r in batch] == [
+        ('@' + h[1:].split()[0], s, q) for h, s, q in reads
+    ]
+    assert all(batch.tags is None for batch in batches)
+
+    with open_bam_reader(bam_path) as fh:
+        tags = [t for batch in bam_read_batches(fh, keep_tags=True) for t in batch.tags]
+
+    assert tags == [{'ch': i, 'RG': 'run1'} for i in range(len(reads))]
+
+
+def test_bam_read_batches_orientation(tmp_path):
+    bam_path = str(tmp_path / "aligned.bam")
+    header = {'HD': {'VN': '1.6'}, 'SQ': [{'LN': 1000, 'SN': 'chr1'}]}
+
+    with pysam.AlignmentFile(bam_path, "wb", header=header) as out:
+        write_bam_record(out, "fwd", "AACG", "#$%&")
+        write_bam_record(out, "rev", RC("AACG"), "&%$#", flag=16)
+        write_bam_record(out, "secondary", "AACG", "#$%&", flag=256)
+        write_bam_record(out, "supplementary", "AACG", "#$%&", flag=2048)
+
+    with open_bam_reader(bam_path) as fh:
+        reads = [r for batch in bam_read_batches(fh) for r in batch]
+
+    assert reads == [
+        ('@fwd', 'AACG', '#$%&'),
+        ('@rev', 'AACG', '#$%&')
+    ]
+
+
+def test_write_ubam_batch(tmp_path):
+    bam_path = str(tmp_path / "out.bam")
+
+    with open(TEST_FILE) as fh:
+        batches = list(fastq_read_batches(fh, block_size=20000))
+
+    tags = [
+        [{'CB': 'ACGT-1', 'CY': None, 'ch': i, 'XF': 0.5} for i in range(len(batch))]
+        for batch in batches
+    ]
+
+    with open_ubam_writer(bam_path, threads=2, command_line='split\treads') as out:
+        for batch, _tags in zip(batches, tags):
+            write_ubam_batch(out, batch, _tags)
+
+        write_ubam_batch(
+            out,
+            ReadBatch.from_lists(['@odd extra'], ['ACGTn'], ['!#%I~']),
+            [{'XB': array.array('H', [1, 2]), 'XL': [3, 4]}]
+        )
+
+    with pysam.AlignmentFile(bam_path, "rb", check_sq=False) as fh:
+        header = fh.header.to_dict()
+        records = list(fh.fetch(until_eof=True))
+
+    assert header['HD'] == {'VN': '1.6', 'SO': 'unknown'}
+    assert header['PG'][0]['ID'] == 'nanopore_10x_multiome'
+    assert header['PG'][0]['CL'] == 'split reads'
+
+    reads = [r for batch in batches for r in batch]
+    assert len(records) == len(reads) + 1
+
+    for (h, s, q), r in zip(reads, records):
+        assert r.is_unmapped
+        assert r.query_name == h[1:].split()[0]
+        assert r.query_sequence == s
+        assert r.query_qualities_str == q
+
+    assert [r.get_tags(with_value_type=True) for r in records[:2]] == [
+        [('CB', 'ACGT-1', 'Z'), ('ch', i, 'i'), ('XF', 0.5, 'f')]
+        for i in range(2)
+    ]
+
+    # Odd length sequence, lowercase bases and array tags
+    assert records[-1].query_name == 'odd'
+    assert records[-1].query_sequence == 'ACGTN'
+    assert records[-1].query_qualities_str == '!#%I~'
+    assert records[-1].get_tag('XB') == array.array('H', [1, 2])
+    assert list(records[-1].get_tag('XL')) == [3, 4]
+
+    # Reads back the same way as BAM input
+    with open_bam_reader(bam_path) as fh:
+        assert [r for batch in bam_read_batches(fh) for r in batch][:-1] == [
+            ('@' + h[1:].split()[0], s, q) for h, s, q in reads
+        ]
@@ -0,0 +1,243 @@
+import os
+import tempfile
+
+import numpy as np
+import pysam
+import pytest
+
+from nanopore_10x_multiome.multiome import split_multiome_preamp_fastq
+from nanopore_10x_multiome.utils import (
+    BarcodeSidecar,
+    BarcodeSidecarWriter,
+    ReadBatch,
+    fastqProcessor,
+    merge_sidecars,
+    read_id_hashes,
+    tag_bam_from_sidecar
+)
+from nanopore_10x_multiome.test.test_bam import write_ubam
+
+TEST_FILE = os.path.join(os.path.dirname(__file__), 'TEST_READS.fastq')
+
+
+def _batch(names):
+    return ReadBatch.from_lists(names, ['ACGT'] * len(names), ['####'] * len(names))
+
+
+def test_read_id_hashes():
+
+    hashes = read_id_hashes(['@read1 CB=ACGT', 'read1', '@read2\tCB:Z:ACGT'])
+
+    assert hashes.dtype == np.uint64
+    assert hashes[0] == hashes[1]
+    assert hashes[0] != hashes[2]
+    assert hashes[2] == read_id_hashes(['read2'])[0]
+
+
+def test_barcode_sidecar(tmp_path):
+
+    path = str(tmp_path / "sidecar")
+
+    with BarcodeSidecarWriter(path) as writer:
+        writer.add(
+            _batch(['@r3 ATAC', '@r1']),
+            [{'CB': 'AAAC-1', 'CR': 'AAAC', 'CY': '####'}, {'CB': None, 'CR': 'GGGG', 'UB': 'TT'}]
+        )
+        writer.add(_batch([]), [])
+        writer.add(_batch(['@r2', '@r3']), [{'CB': 'CCCCCCCC-1'}, {'CB': 'TTTT-1'}])
+
+        assert writer.strip([{'CB': 'A', 'RG': 'run1'}]) == [{'RG': 'run1'}]
+
+    sidecar = BarcodeSidecar.load(path)
+
+    assert isinstance(sidecar.ids, np.memmap)
+    assert len(sidecar) == 3
+    assert np.all(np.diff(sidecar.ids.astype(float)) > 0)
+    assert sidecar.columns['CB'].dtype.itemsize == 10
+
+    # First tags of a repeated read are kept, empty values left out
+    assert sidecar.tags(['r1', 'r2', '@r3 extra', 'missing']) == [
+        {'CR': 'GGGG', 'UB': 'TT'},
+        {'CB': 'CCCCCCCC-1'},
+        {'CB': 'AAAC-1', 'CR': 'AAAC', 'CY': '####'},
+        None
+    ]
+    assert sidecar.tags(['r3'], keys=['CB', 'XX']) == [{'CB': 'AAAC-1'}]
+
+    with BarcodeSidecarWriter(str(tmp_path / "empty")):
+        pass
+
+    assert BarcodeSidecar.load(str(tmp_path / "empty")).tags(['r1']) == [None]
+
+
+def test_barcode_sidecar_chunks(tmp_path):
+
+    rng = np.random.default_rng(3)
+    names = [f'@r{i}' for i in rng.integers(0, 50, 200)]
+    tags = [
+        {'CB': 'A' * int(rng.integers(1, 12)) + f'-{i}', 'UB': f'{i}' if i % 3 else None}
+        for i in range(200)
+    ]
+
+    with BarcodeSidecarWriter(str(tmp_path / "memory")) as writer:
+        for i in range(0, 200, 7):
+            writer.add(_batch(names[i:i + 7]), tags[i:i + 7])
+
+    with BarcodeSidecarWriter(str(tmp_path / "chunks"), chunk_size=10) as writer:
+        for i in range(0, 200, 7):
+            writer.add(_batch(names[i:i + 7]), tags[i:i + 7])
+
+        assert len(writer._chunks) == 14
+
+    # Scratch chunks are removed
+    assert sorted(os.listdir(tmp_path / "chunks")) == sorted(os.listdir(tmp_path / "memory"))
+
+    expected = BarcodeSidecar.load(str(tmp_path / "memory"))
+    sidecar = BarcodeSidecar.load(str(tmp_path / "chunks"))
+
+    np.testing.assert_array_equal(sidecar.ids, expected.ids)
+
+    for k, v in expected.columns.items():
+        np.testing.assert_array_equal(sidecar.columns[k], v)
+
+    # First tags of a repeated read are kept across chunks
+    _first = {}
+    for n, t in zip(names, tags):
+        _first.setdefault(n, {k: v for k, v in t.items() if v is not None})
+
+    assert sidecar.tags(list(_first)) == list(_first.values())
+
+    merge_sidecars([], str(tmp_path / "empty"))
+    assert len(BarcodeSidecar.load(str(tmp_path / "empty"))) == 0
+
+
+def test_barcode_sidecar_writer_error(tmp_path):
+
+    path = tmp_path / "sidecar"
+
+    with pytest.raises(RuntimeError):
+        with BarcodeSidecarWriter(str(path), chunk_size=1) as writer:
+            writer.add(_batch(['@r1', '@r2']), [{'CB': 'A'}, {'CB': 'C'}])
+            raise RuntimeError
+
+    assert os.listdir(path) == []
+
+
+def test_tag_bam_from_sidecar(tmp_path, monkeypatch):
+
+    from nanopore_10x_multiome.utils import _barcode_sidecar
+    monkeypatch.setattr(_barcode_sidecar, 'SIDECAR_LOOKUP_BATCH', 2)
+
+    path = str(tmp_path / "sidecar")
+    bam_file = str(tmp_path / "in.bam")
+    out_file = str(tmp_path / "out.bam")
+
+    with BarcodeSidecarWriter(path) as writer:
+        writer.add(_batch(['@r1', '@r3']), [{'CB': 'AAAC-1', 'UB': 'TT'}, {'CB': 'GGGG-1'}])
+
+    with pysam.AlignmentFile(bam_file, "wb", header={'HD': {'VN': '1.6'}}) as out:
+        for name in ('r1', 'r2', 'r3'):
+            a = pysam.AlignedSegment()
+            a.query_name = name
+            a.query_sequence = 'ACGT'
+            a.flag = 4
+            out.write(a)
+
+    assert tag_bam_from_sidecar(bam_file, path, out_file, threads=2, write_threads=2) == (3, 2)
+
+    with pysam.AlignmentFile(out_file, check_sq=False) as fh:
+        assert [dict(r.get_tags()) for r in fh.fetch(until_eof=True)] == [
+            {'CB': 'AAAC-1', 'UB': 'TT'},
+            {},
+            {'CB': 'GGGG-1'}
+        ]
+
+
+def test_multiome_sidecar():
+
+    _keys = ('CB=', 'CR=', 'CY=', 'UB=', 'UR=', 'UY=')
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [os.path.join(td, f'out{i}.fastq') for i in range(4)]
+        side_files = [os.path.join(td, f'side{i}.fastq') for i in range(4)]
+        sidecar_path = os.path.join(td, 'sidecar')
+
+        counts = split_multiome_preamp_fastq(TEST_FILE, *out_files, keep_runoff_fragments=True)
+        side_counts = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *side_files,
+            keep_runoff_fragments=True,
+            sidecar_path=sidecar_path
+        )
+
+        assert list(side_counts) == list(counts)
+
+        processor = fastqProcessor(verify_ids=False, phred_type='raw')
+        sidecar = BarcodeSidecar.load(sidecar_path)
+
+        for out_file, side_file in zip(out_files, side_files):
+            with open(out_file) as fh:
+                reads = [r[0] for r in processor.fastq_gen(fh)]
+            with open(side_file) as fh:
+                side_reads = [r[0] for r in processor.fastq_gen(fh)]
+
+            assert [r[1:] for r in side_reads] == [r[1:] for r in reads]
+
+            # Headers without barcode tags
+            assert [
+                ' '.join(x for x in h.split() if x[:3] not in _keys)
+                for h, _, _ in reads
+            ] == [h for h, _, _ in side_reads]
+
+            # Sidecar has the tags that were in the headers
+            for (h, _, _), _tags in zip(reads, sidecar.tags([h for h, _, _ in side_reads])):
+                _expected = dict(
+                    x.split('=', 1) for x in h.split() if x[:3] in _keys
+                )
+
+                if len(_expected) > 0:
+                    assert _tags == {k: v for k, v in _expected.items() if v}
+
+        # Tag an unaligned BAM of the split reads from the sidecar
+        bam_file = os.path.join(td, 'gex.bam')
+        tagged_file = os.path.join(td, 'gex_tagged.bam')
+
+        write_ubam(side_files[1], bam_file)
+        n, n_tagged = tag_bam_from_sidecar(bam_file, sidecar_path, tagged_file)
+
+        assert n == n_tagged == counts[1]
+
+        with open(out_files[1]) as fh:
+            reads = [r[0] for r in processor.fastq_gen(fh)]
+
+        with pysam.AlignmentFile(tagged_file, check_sq=False) as fh:
+            for (h, _, _), r in zip(reads, fh.fetch(until_eof=True)):
+                _expected = dict(
+                    x.split('=', 1) for x in h.split() if x[:3] in _keys
+                )
+
+                assert {k: v for k, v in r.get_tags() if k != 'ch' and k != 'RG'} == {
+                    k: v for k, v in _expected.items() if v
+                }
+
+
+def test_multiome_sidecar_paths():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [[os.path.join(td, f'out{i}.fastq')] for i in range(3)]
+
+        with pytest.raises(ValueError):
+            split_multiome_preamp_fastq(
+                [TEST_FILE],
+                *out_files,
+                sidecar_path=os.path.join(td, 'sidecar')
+            )
+
+        with pytest.raises(ValueError):
+            split_multiome_preamp_fastq(
+                [TEST_FILE],
+                *out_files,
+                sidecar_path=[os.path.join(td, 'sidecar')] * 2
+            )
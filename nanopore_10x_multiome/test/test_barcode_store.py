@@ -0,0 +1,213 @@
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from nanopore_10x_multiome.barcodes import (
+    ArrayCorrectionTable,
+    BarcodeHolder,
+    barcode_correction_table,
+    correct_barcode,
+    translate_barcode,
+    cached_correction_table,
+    whitelist_cache_key,
+    load_gex_barcodes,
+    GEX_WHITELIST,
+    ATAC_WHITELIST
+)
+
+
+BARCODES = ["AAAA", "CCAA", "ACGT", "TTTT"]
+
+
+def test_array_table_matches_dict():
+    table = barcode_correction_table(BARCODES)
+    array_table = ArrayCorrectionTable.from_dict(table, BARCODES)
+
+    assert len(array_table) == len(table)
+
+    for k, v in table.items():
+        assert array_table[k] == v
+        assert k in array_table
+
+    assert "CAAA" not in array_table
+    assert array_table.get("CAAA") is None
+
+    with pytest.raises(KeyError):
+        array_table["CAAA"]
+
+    with pytest.raises(KeyError):
+        array_table["AAAAAAAAAAAAAAAA"]
+
+
+def test_array_table_save_load():
+    table = barcode_correction_table(BARCODES)
+    array_table = ArrayCorrectionTable.from_dict(table, BARCODES)
+
+    with tempfile.TemporaryDirectory() as td:
+        array_table.save(td, 'test')
+        loaded = ArrayCorrectionTable.load(
+            td,
+            'test',
+            np.asarray(BARCODES)
+        )
+
+        assert isinstance(loaded.keys, np.memmap)
+
+        for k, v in table.items():
+            assert loaded[k] == v
+
+
+def test_correct_barcode_array_table():
+    table = ArrayCorrectionTable.from_dict(
+        barcode_correction_table(BARCODES),
+        BARCODES
+    )
+
+    assert correct_barcode("ACGA", "IIII", table) == "ACGT"
+    assert correct_barcode("CAAA", "IIII", table) is None
+    assert translate_barcode("ACGT", table) == "ACGT"
+    assert translate_barcode("GGGG", table) == "GGGG"
+
+
+@pytest.fixture
+def holder():
+    """Restore BarcodeHolder state after a test replaces its tables"""
+
+    _attrs = [
+        'gex_barcodes',
+        'atac_barcodes',
+        'gex_correction_table',
+        'atac_correction_table',
+        'atac_gex_translation_table',
+        'gex_deletion_index',
+        'atac_deletion_index',
+        'store_path'
+    ]
+
+    BarcodeHolder.load(test=True)
+    _saved = {k: getattr(BarcodeHolder, k) for k in _attrs}
+
+    yield BarcodeHolder
+
+    for k, v in _saved.items():
+        setattr(BarcodeHolder, k, v)
+
+
+def test_export_attach(holder):
+    gex_table = dict(holder.gex_correction_table.items())
+
+    with tempfile.TemporaryDirectory() as td:
+        holder.export(td)
+
+        assert holder.store_path == td
+        assert isinstance(holder.gex_correction_table, ArrayCorrectionTable)
+
+        # Force a reattach from the files on disk
+        holder.store_path = None
+        holder.attach(td)
+
+        assert isinstance(holder.gex_correction_table.keys, np.memmap)
+
+        for k, v in gex_table.items():
+            assert holder.gex_correction_table[k] == v
+
+        assert translate_barcode(
+            str(holder.atac_barcodes[0]),
+            holder.atac_gex_translation_table
+        ) == str(holder.gex_barcodes[0])
+
+
+def test_export_attach_deletion_indices(holder, tmp_path):
+    holder.gex_deletion_index = None
+    holder.atac_deletion_index = None
+
+    holder.export(str(tmp_path), test=True, deletion_indices=True)
+
+    holder.store_path = None
+    holder.gex_deletion_index = None
+    holder.atac_deletion_index = None
+    holder.attach(str(tmp_path))
+
+    assert isinstance(holder.gex_deletion_index.keys, np.memmap)
+    assert isinstance(holder.atac_deletion_index.values, np.memmap)
+
+    barcode = str(holder.gex_barcodes[0])
+    assert holder.gex_deletion_index.correct(
+        [barcode[2:]],
+        ['I' * 14]
+    ) == [barcode]
+
+    # Stores without deletion indices don't leave stale indices attached
+    with tempfile.TemporaryDirectory() as td:
+        holder.export(td, test=True)
+        holder.store_path = None
+        holder.attach(td)
+
+    assert holder.gex_deletion_index is None
+
+
+def test_cached_correction_table(tmp_path):
+
+    barcodes, table = cached_correction_table(
+        GEX_WHITELIST,
+        load_gex_barcodes,
+        cache_dir=str(tmp_path),
+        test=True
+    )
+
+    assert len(os.listdir(tmp_path)) == 1
+    assert isinstance(table.keys, np.memmap)
+
+    expected = barcode_correction_table(load_gex_barcodes(test=True))
+    assert len(table) == len(expected)
+
+    for k, v in expected.items():
+        assert table[k] == v
+
+    # Second load should come from the cache without building
+    def _no_build(test=False):
+        raise AssertionError("Cache was not used")
+
+    barcodes_2, table_2 = cached_correction_table(
+        GEX_WHITELIST,
+        _no_build,
+        cache_dir=str(tmp_path),
+        test=True
+    )
+
+    assert np.all(barcodes == barcodes_2)
+    assert len(table_2) == len(table)
+
+
+def test_cached_correction_table_unwritable(tmp_path, caplog):
+
+    # Cache directory under a file can't be created
+    (tmp_path / "file").write_text("")
+
+    barcodes, table = cached_correction_table(
+        GEX_WHITELIST,
+        load_gex_barcodes,
+        cache_dir=str(tmp_path / "file" / "cache"),
+        test=True
+    )
+
+    assert "Could not write cache" in caplog.text
+    assert not isinstance(table.keys, np.memmap)
+    assert np.all(barcodes == np.asarray(load_gex_barcodes(test=True), dtype=str))
+
+    expected = barcode_correction_table(barcodes)
+    assert len(table) == len(expected)
+
+    for k, v in expected.items():
+        assert table[k] == v
+
+
+def test_cache_key():
+    assert whitelist_cache_key(GEX_WHITELIST) != whitelist_cache_key(ATAC_WHITELIST)
+    assert whitelist_cache_key(GEX_WHITELIST) != whitelist_cache_key(GEX_WHITELIST, test=True)
+    assert whitelist_cache_key(GEX_WHITELIST) != whitelist_cache_key(
+        GEX_WHITELIST,
+        edit_model='substitution;distance=1;ATGC'
+    )
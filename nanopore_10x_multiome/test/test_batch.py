@@ -0,0 +1,159 @@
+import os
+import pickle
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from nanopore_10x_multiome.utils import (
+    ReadBatch,
+    fastq_read_batches,
+    fastqProcessor,
+    write_fastq_batch,
+    write_fastq_record
+)
+from nanopore_10x_multiome.atac import get_atac_anchors, get_atac_anchors_batch
+from nanopore_10x_multiome.gex import get_gex_anchors, get_gex_anchors_batch
+
+TEST_FILE = os.path.join(Path(__file__).parent.absolute(), 'TEST_READS.fastq')
+
+HEADERS = ["@read1", "@read2 CB=AAAA", "@réad3", "@read4"]
+SEQS = ["ACGT", "", "GGGGCCCC", "N"]
+QUALS = ["IIII", "", "#$%&'()*", "!"]
+
+
+@pytest.fixture
+def batch():
+    return ReadBatch.from_lists(HEADERS, SEQS, QUALS)
+
+
+def test_batch_from_lists(batch):
+
+    assert len(batch) == 4
+    assert list(batch) == list(zip(HEADERS, SEQS, QUALS))
+    assert batch[2] == (HEADERS[2], SEQS[2], QUALS[2])
+    assert batch[-1] == (HEADERS[-1], SEQS[-1], QUALS[-1])
+    assert list(batch.lengths) == [4, 0, 8, 1]
+
+    with pytest.raises(IndexError):
+        batch[4]
+
+    with pytest.raises(ValueError):
+        ReadBatch.from_lists(["@a"], ["ACGT"], ["III"])
+
+    with pytest.raises(ValueError):
+        ReadBatch.from_lists(["@a"], ["ACGT", "A"], ["IIII", "I"])
+
+
+def test_batch_slice_view(batch):
+
+    view = batch[1:3]
+
+    assert len(view) == 2
+    assert list(view) == list(zip(HEADERS[1:3], SEQS[1:3], QUALS[1:3]))
+    assert view.headers() == HEADERS[1:3]
+
+    # Slices share the read buffers
+    assert view._sequences is batch._sequences
+    assert np.shares_memory(view.offsets, batch.offsets)
+
+    assert len(batch[3:1]) == 0
+    assert list(batch[3:1]) == []
+
+    with pytest.raises(ValueError):
+        batch[::2]
+
+
+def test_batch_take(batch):
+
+    taken = batch.take([2, 0])
+    assert list(taken) == [
+        (HEADERS[2], SEQS[2], QUALS[2]),
+        (HEADERS[0], SEQS[0], QUALS[0])
+    ]
+
+    trimmed = batch[1:].take([1, 2], starts=[2, 0], stops=[5, 10])
+    assert list(trimmed) == [
+        (HEADERS[2], "GGC", "%&'"),
+        (HEADERS[3], "N", "!")
+    ]
+
+    assert len(batch.take([])) == 0
+    assert batch.take([]).sequences() == []
+
+
+def test_batch_tags():
+
+    tags = [{'ch': i} for i in range(4)]
+    batch = ReadBatch.from_lists(HEADERS, SEQS, QUALS, tags=tags)
+
+    assert batch[1:3].tags == tags[1:3]
+    assert batch.take([2, 0]).tags == [tags[2], tags[0]]
+    assert pickle.loads(pickle.dumps(batch[1:])).tags == tags[1:]
+
+    assert ReadBatch.from_lists(HEADERS, SEQS, QUALS).take([0]).tags is None
+
+    with pytest.raises(ValueError):
+        ReadBatch.from_lists(HEADERS, SEQS, QUALS, tags=tags[:2])
+
+
+def test_fastq_batch_writer(batch):
+
+    tags = [
+        {'CB': 'ATGC', 'CR': None},
+        {},
+        {'UB': 'TTTT'},
+        {'CB': None}
+    ]
+
+    expected = StringIO()
+    for (h, s, q), t in zip(batch, tags):
+        write_fastq_record(expected, h, s, q, **t)
+
+    written = StringIO()
+    write_fastq_batch(written, batch, tags)
+
+    assert written.getvalue() == expected.getvalue()
+
+    expected = StringIO()
+    for h, s, q in batch:
+        write_fastq_record(expected, h, s, q)
+
+    written = StringIO()
+    write_fastq_batch(written, batch)
+
+    assert written.getvalue() == expected.getvalue()
+
+
+def test_fastq_read_batches():
+
+    processor = fastqProcessor(verify_ids=False, phred_type='raw')
+
+    with open(TEST_FILE) as fh:
+        expected = [x[0] for x in processor.fastq_gen(fh)]
+
+    with open(TEST_FILE) as fh:
+        batches = list(fastq_read_batches(fh, block_size=1000))
+
+    assert len(batches) > 1
+    assert [r for b in batches for r in b] == expected
+
+
+def test_batch_anchors():
+
+    with open(TEST_FILE) as fh:
+        batch, = fastq_read_batches(fh)
+
+    seqs, quals = batch.sequences(), batch.qualities()
+
+    assert get_atac_anchors_batch(batch, keep_runoff_fragments=True) == [
+        get_atac_anchors(s, q, keep_runoff_fragments=True)
+        for s, q in zip(seqs, quals)
+    ]
+
+    assert get_gex_anchors_batch(batch, indices=[3, 1]) == [
+        get_gex_anchors(seqs[i], quals[i])
+        for i in [3, 1]
+    ]
+
@@ -0,0 +1,293 @@
+import random
+
+import pytest
+
+from nanopore_10x_multiome import classifier as classifier_module
+from nanopore_10x_multiome.classifier import (
+    ReadClassifier,
+    ATAC,
+    GEX,
+    BARCODE_FIRST,
+    TN5_FIRST
+)
+from nanopore_10x_multiome.atac import get_atac_anchors, TENX_ATAC_ADAPTER
+from nanopore_10x_multiome.gex import get_gex_anchors, TENX_GEX_ADAPTER
+from nanopore_10x_multiome.utils import RC, SEARCH_BACKENDS, fastq_read_batches
+
+from nanopore_10x_multiome.test.test_atac import ATAC_BARCODE, TN5_SEQ
+from nanopore_10x_multiome.test.test_gex import GEX_BARCODE
+from nanopore_10x_multiome.utils.test import create_sequence, create_qual
+
+TEST_READS = 'nanopore_10x_multiome/test/TEST_READS.fastq'
+
+
+def _reference(seq, qual, keep_runoff_fragments=False):
+
+    _atac = get_atac_anchors(
+        seq,
+        qual,
+        keep_runoff_fragments=keep_runoff_fragments
+    )
+
+    if _atac[0] is not None:
+        return ATAC, tuple(_atac)
+
+    _gex = get_gex_anchors(seq, qual)
+
+    if _gex[0] is not None:
+        return GEX, tuple(_gex)
+
+    return None, None
+
+
+def _classify(classifier, seq, qual):
+
+    _modality, _anchors = classifier.classify(seq, qual)
+
+    return _modality, tuple(_anchors) if _anchors is not None else None
+
+
+@pytest.mark.parametrize("rc", [False, True])
+def test_classify_synthetic(rc):
+
+    classifier = ReadClassifier()
+
+    atac = create_sequence(ATAC_BARCODE, 0, TN5_SEQ, 1311, rc=rc)
+    gex = create_sequence(GEX_BARCODE, 0, rc=rc)
+
+    for seq, modality in ((atac, ATAC), (gex, GEX)):
+        qual = create_qual(len(seq), 33, 28)
+
+        assert classifier.classify(seq, qual)[0] == modality
+        assert _classify(classifier, seq, qual) == _reference(seq, qual)
+
+    # ATAC takes precedence if a read has both adapters
+    seq = atac + gex
+    qual = create_qual(len(seq), 33, 28)
+    assert _reference(seq, qual)[0] == ATAC
+    assert _classify(classifier, seq, qual) == _reference(seq, qual)
+
+
+def test_seed_hits():
+
+    classifier = ReadClassifier()
+
+    seq = 'G' * 20 + TENX_ATAC_ADAPTER + 'G' * 20
+    hits = classifier.seed_hits(seq)
+
+    assert hits[0] == sorted(
+        20 + TENX_ATAC_ADAPTER.find(s)
+        for s in ('CGCGT', 'CTGTC', 'GTCGG', 'CAGCG')
+    )
+
+    # Reverse complement hits are positions in RC(seq)
+    assert classifier.seed_hits(RC(seq))[1] == hits[0]
+
+
+@pytest.mark.parametrize("keep_runoff_fragments", [False, True])
+def test_classify_test_reads(keep_runoff_fragments):
+
+    classifier = ReadClassifier(keep_runoff_fragments=keep_runoff_fragments)
+
+    with open(TEST_READS) as fh:
+        for batch in fastq_read_batches(fh):
+            results = classifier.classify_batch(batch)
+
+            for (seq, qual), result in zip(
+                zip(batch.sequences(), batch.qualities()),
+                results
+            ):
+                assert (
+                    result[0],
+                    tuple(result[1]) if result[1] is not None else None
+                ) == _reference(seq, qual, keep_runoff_fragments)
+
+
+def test_classify_random():
+
+    rng = random.Random(7)
+    classifier = ReadClassifier()
+
+    def _random_seq(n):
+        return ''.join(rng.choice('ACGT') for _ in range(n))
+
+    def _mutate(seq, n):
+        seq = list(seq)
+
+        for _ in range(n):
+            i = rng.randrange(len(seq))
+            op = rng.randrange(3)
+
+            if op == 0:
+                seq[i] = rng.choice('ACGT')
+            elif op == 1:
+                seq.insert(i, rng.choice('ACGT'))
+            else:
+                del seq[i]
+
+        return ''.join(seq)
+
+    adapters = [
+        TENX_ATAC_ADAPTER + 'GTCAGATGTGTATAAGAGACAG',
+        TENX_GEX_ADAPTER,
+        TN5_SEQ,
+        RC(TN5_SEQ)
+    ]
+
+    for _ in range(300):
+        seq = _random_seq(rng.randrange(50, 300))
+
+        for _ in range(rng.randrange(0, 4)):
+            fragment = _mutate(
+                ''.join(
+                    rng.choice('ACGT') if c == 'N' else c
+                    for c in rng.choice(adapters)
+                ),
+                rng.randrange(0, 5)
+            )
+
+            if rng.random() < 0.5:
+                fragment = RC(fragment)
+
+            i = rng.randrange(len(seq))
+            seq = seq[:i] + fragment + seq[i:]
+
+        qual = ''.join(chr(33 + rng.randrange(40)) for _ in seq)
+
+        assert _classify(classifier, seq, qual) == _reference(seq, qual)
+
+
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+@pytest.mark.parametrize("rc", [False, True])
+def test_classify_end_windows(search_backend, rc):
+
+    rng = random.Random(13)
+    insert = ''.join(rng.choice('ACGT') for _ in range(5000))
+
+    # Second Tn5 mosaic end 111 bases from the end of the read
+    atac = create_sequence(ATAC_BARCODE, 0, insert + TN5_SEQ, 1200, rc=rc)
+    gex = create_sequence(GEX_BARCODE, 0, insert, 0, rc=rc)
+
+    # Adapters only in the middle of the read
+    middle = insert[:2500] + gex + insert[2500:]
+
+    seqs = [atac, gex, middle, insert]
+    quals = [create_qual(len(seq), 33, 28)[:len(seq)] for seq in seqs]
+
+    classifier = ReadClassifier(search_backend=search_backend)
+    windowed = ReadClassifier(search_backend=search_backend, end_window=500)
+
+    results = windowed.classify_reads(seqs, quals)
+
+    assert results == classifier.classify_reads(seqs, quals)
+    assert [x[0] for x in results] == [ATAC, GEX, GEX, None]
+
+    assert dict(windowed.end_window_search.counts) == {
+        'end_window_reads': 4,
+        'end_window_hits': 2,
+        'fallback_reads': 2,
+        'fallback_hits': 1,
+        'over_budget_reads': 0
+    }
+
+    # Reads longer than the budget aren't searched in full
+    budget = ReadClassifier(
+        search_backend=search_backend,
+        end_window=500,
+        max_search_length=len(insert) - 1
+    )
+
+    assert [x[0] for x in budget.classify_reads(seqs, quals)] == [ATAC, GEX, None, None]
+    assert budget.end_window_search.counts['over_budget_reads'] == 2
+    assert budget.end_window_search.counts['fallback_reads'] == 0
+
+
+def test_classify_end_windows_short_reads():
+
+    classifier = ReadClassifier(end_window=1000)
+
+    with open(TEST_READS) as fh:
+        for batch in fastq_read_batches(fh):
+            _short = [
+                i for i, seq in enumerate(batch.sequences())
+                if len(seq) <= 2000
+            ]
+
+            results = classifier.classify_batch(batch)
+
+            for i in _short:
+                seq, qual = batch.sequences()[i], batch.qualities()[i]
+                assert _classify(classifier, seq, qual) == _reference(seq, qual)
+                assert results[i][0] == _reference(seq, qual)[0]
+
+
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_classify_adaptive_order(search_backend, monkeypatch):
+
+    # Sample every other read so the order can change in a short test
+    monkeypatch.setattr(classifier_module, 'ADAPTIVE_SAMPLE_EVERY', 2)
+    monkeypatch.setattr(classifier_module, 'ADAPTIVE_MIN_SAMPLES', 4)
+
+    rng = random.Random(17)
+
+    def _insert(n):
+        return ''.join(rng.choice('ACGT') for _ in range(n))
+
+    # Mostly GEX reads, so scanning for Tn5 first is cheaper
+    seqs = []
+    for i in range(120):
+        if i % 10 == 0:
+            seqs.append(create_sequence(ATAC_BARCODE, 0, _insert(300) + TN5_SEQ, 50, rc=i % 20 == 0))
+        elif i % 10 == 1:
+            seqs.append(_insert(500))
+        else:
+            seqs.append(create_sequence(GEX_BARCODE, 0, _insert(400), 0, rc=i % 3 == 0))
+
+    quals = [create_qual(len(seq), 33, 28)[:len(seq)] for seq in seqs]
+
+    classifier = ReadClassifier(search_backend=search_backend)
+    adaptive = ReadClassifier(search_backend=search_backend, adaptive_order=True)
+
+    assert adaptive.atac_order() == BARCODE_FIRST
+
+    for i in range(0, len(seqs), 20):
+        assert (
+            adaptive.classify_reads(seqs[i:i + 20], quals[i:i + 20]) ==
+            classifier.classify_reads(seqs[i:i + 20], quals[i:i + 20])
+        )
+
+    assert adaptive.atac_order() == TN5_FIRST
+
+    counts = adaptive.pop_counts()
+
+    assert counts['reads'] == 120
+    assert counts['atac_reads'] == 12
+    assert counts['gex_reads'] == 96
+    assert counts['other_reads'] == 12
+    assert counts['tn5_first_batches'] > 0
+    assert counts['atac_barcode_searches_skipped'] > 0
+    assert adaptive.pop_counts() == {}
+
+    # Not adaptive unless asked
+    assert classifier.atac_order() == BARCODE_FIRST
+
+
+@pytest.mark.parametrize("keep_runoff_fragments", [False, True])
+def test_classify_adaptive_order_test_reads(keep_runoff_fragments, monkeypatch):
+
+    monkeypatch.setattr(classifier_module, 'ADAPTIVE_SAMPLE_EVERY', 2)
+    monkeypatch.setattr(classifier_module, 'ADAPTIVE_MIN_SAMPLES', 4)
+
+    classifier = ReadClassifier(keep_runoff_fragments=keep_runoff_fragments)
+    adaptive = ReadClassifier(
+        keep_runoff_fragments=keep_runoff_fragments,
+        adaptive_order=True
+    )
+
+    # Force the Tn5 scan first once the timings are known
+    with open(TEST_READS) as fh:
+        for batch in fastq_read_batches(fh, 20000):
+            adaptive._times = {'barcode': [1.0, 1], 'tn5': [0.01, 1]}
+            assert adaptive.classify_batch(batch) == classifier.classify_batch(batch)
+
+    assert adaptive.pop_counts()['tn5_first_batches'] > 0
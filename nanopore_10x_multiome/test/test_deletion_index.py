@@ -0,0 +1,217 @@
+import random
+
+import numpy as np
+import pytest
+
+from nanopore_10x_multiome.barcodes import (
+    DeletionIndex,
+    cached_deletion_index,
+    correct_barcode,
+    load_gex_barcodes,
+    quality_weights
+)
+
+
+def _edit_distance(a, b):
+
+    _prev = list(range(len(b) + 1))
+
+    for i, x in enumerate(a, 1):
+        _row = [i]
+
+        for j, y in enumerate(b, 1):
+            _row.append(min(
+                _prev[j] + 1,
+                _row[j - 1] + 1,
+                _prev[j - 1] + (x != y)
+            ))
+
+        _prev = _row
+
+    return _prev[-1]
+
+
+def _mutate(rng, seq, n):
+    seq = list(seq)
+
+    for _ in range(n):
+        i = rng.randrange(len(seq) + 1)
+        op = rng.randrange(3)
+
+        if op == 0 and i < len(seq):
+            seq[i] = rng.choice('ACGT')
+        elif op == 1:
+            seq.insert(i, rng.choice('ACGTN'))
+        elif i < len(seq):
+            del seq[i]
+
+    return ''.join(seq)
+
+
+@pytest.mark.parametrize("max_deletions", [1, 2])
+@pytest.mark.parametrize("max_dist", [0, 1, 2, 3])
+def test_candidates_brute_force(max_deletions, max_dist):
+
+    rng = random.Random(1)
+    whitelist = [
+        ''.join(rng.choice('ACGT') for _ in range(8))
+        for _ in range(200)
+    ]
+    queries = [
+        _mutate(rng, rng.choice(whitelist), rng.randrange(4))
+        for _ in range(150)
+    ] + ['', 'ACXT', 'A', None]
+
+    index = DeletionIndex.from_barcodes(whitelist, max_deletions=max_deletions)
+    rows, targets, dist, _ = index.candidates(queries, max_dist=max_dist)
+
+    assert set(zip(rows.tolist(), targets.tolist())) == {
+        (i, j)
+        for i, q in enumerate(queries)
+        if q and set(q) <= set('ACGTN')
+        for j, b in enumerate(whitelist)
+        if _edit_distance(q, b) <= max_dist
+    }
+
+    assert dist.tolist() == [
+        _edit_distance(queries[i], whitelist[j])
+        for i, j in zip(rows, targets)
+    ]
+
+
+def test_correct():
+
+    index = DeletionIndex.from_barcodes(['AAAACCCCGGGGTTTT', 'ACGTACGTACGTACGT'])
+
+    assert index.correct(
+        [
+            'AAAACCCCGGGGTTTT',
+            'AAACCCCGGGGTTAT',
+            'AAAACCCCGGGGTTTTAA',
+            'AAAACCCCGGGGTTTTAAA',
+            'TTTTTTTTTTTTTTTT'
+        ],
+        ['I' * 16, 'I' * 15, 'I' * 18, 'I' * 19, 'I' * 16]
+    ) == [
+        'AAAACCCCGGGGTTTT',
+        'AAAACCCCGGGGTTTT',
+        'AAAACCCCGGGGTTTT',
+        None,
+        None
+    ]
+
+    assert index.correct([], []) == []
+
+
+def test_correct_quality_tie_break():
+
+    index = DeletionIndex.from_barcodes(['AAAAAAAAAAAAAAAA', 'AAAAAAAAAAAAAACC'])
+    query = 'AAAAAAAAAAAAAAAC'
+
+    # Equal qualities can't break the tie
+    assert index.correct([query], ['I' * 16]) == [None]
+
+    # A low quality mismatch is closer than a high quality one
+    assert index.correct([query], ['I' * 15 + '#']) == ['AAAAAAAAAAAAAAAA']
+    assert index.correct([query], ['I' * 14 + '#I']) == ['AAAAAAAAAAAAAACC']
+
+    rows, _, dist, wdist = index.candidates([query], ['I' * 15 + '#'])
+    assert dist.tolist() == [1, 1]
+    assert wdist.tolist() == [1, quality_weights('I')[0]]
+
+
+def test_correct_barcode_deletion_index():
+
+    rng = random.Random(4)
+    whitelist = list(load_gex_barcodes(test=True))
+    index = DeletionIndex.from_barcodes(whitelist)
+
+    for barcode in whitelist[:20]:
+        query = _mutate(rng, barcode, 2)
+        expected = index.correct([query], ['I' * len(query)])[0]
+
+        assert correct_barcode(
+            query,
+            'I' * len(query),
+            {},
+            max_dist=2,
+            deletion_index=index
+        ) == expected
+
+        if expected is not None:
+            assert _edit_distance(query, expected) <= 2
+
+    table = {}
+    assert correct_barcode('T' * 16, 'I' * 16, table, max_dist=2, deletion_index=index) is None
+    assert table == {'T' * 16: None}
+
+
+def test_empty_index():
+
+    index = DeletionIndex.from_barcodes([])
+
+    assert len(index) == 0
+    assert index.correct(['ACGT'], ['IIII']) == [None]
+    assert np.all(index.candidates(['ACGT'])[0] == [])
+
+
+def test_save_load(tmp_path):
+
+    rng = random.Random(6)
+    whitelist = np.asarray(load_gex_barcodes(test=True), dtype=str)
+    index = DeletionIndex.from_barcodes(whitelist)
+
+    index.save(str(tmp_path), 'gex')
+    loaded = DeletionIndex.load(str(tmp_path), 'gex', whitelist)
+
+    assert isinstance(loaded.keys, np.memmap)
+    assert isinstance(loaded.target_keys, np.memmap)
+    assert loaded.max_deletions == 1
+
+    queries = [_mutate(rng, x, 2) for x in whitelist[:50]]
+    quals = ['I' * len(x) for x in queries]
+
+    assert loaded.correct(queries, quals) == index.correct(queries, quals)
+
+
+def test_cached_deletion_index(tmp_path, monkeypatch):
+
+    whitelist = np.asarray(load_gex_barcodes(test=True), dtype=str)
+
+    index = cached_deletion_index(whitelist, cache_dir=str(tmp_path))
+
+    assert len(list(tmp_path.iterdir())) == 1
+    assert isinstance(index.keys, np.memmap)
+    assert np.array_equal(
+        index.keys,
+        DeletionIndex.from_barcodes(whitelist).keys
+    )
+
+    # Second load should come from the cache without building
+    def _no_build(*args, **kwargs):
+        raise AssertionError("Cache was not used")
+
+    monkeypatch.setattr(DeletionIndex, 'from_barcodes', _no_build)
+
+    assert len(cached_deletion_index(whitelist, cache_dir=str(tmp_path))) == len(index)
+
+    # A different whitelist or deletion count isn't the same cache
+    with pytest.raises(AssertionError):
+        cached_deletion_index(whitelist[1:], cache_dir=str(tmp_path))
+
+    with pytest.raises(AssertionError):
+        cached_deletion_index(whitelist, cache_dir=str(tmp_path), max_deletions=2)
+
+
+def test_cached_deletion_index_unwritable(tmp_path, caplog):
+
+    whitelist = np.asarray(load_gex_barcodes(test=True), dtype=str)
+
+    # Cache directory under a file can't be created
+    (tmp_path / "file").write_text("")
+
+    index = cached_deletion_index(whitelist, cache_dir=str(tmp_path / "file" / "cache"))
+
+    assert "Could not write cache" in caplog.text
+    assert not isinstance(index.keys, np.memmap)
+    assert np.array_equal(index.keys, DeletionIndex.from_barcodes(whitelist).keys)
@@ -3,8 +3,13 @@ Generated with cursor/claude-3.5-sonnet and then fixed to actually work
 """
 
 import pytest
-from io import StringIO
-from nanopore_10x_multiome.utils._fastq import fastqProcessor, convert_qual_illumina, fastq_gen
+from io import BytesIO, StringIO
+from nanopore_10x_multiome.utils._fastq import (
+    fastqProcessor,
+    convert_qual_illumina,
+    fastq_gen,
+    fastq_batch_gen
+)
 from nanopore_10x_multiome.utils import RC
 
 def test_convert_qual_illumina():
@@ -111,6 +116,62 @@ def test_extract_control_id():
     assert processor.extract_control_id("@read1") == "@read1"
     assert processor.extract_control_id("") is None
 
+BATCH_DATA = [
+    ("read1 CB=AAAA", "ACGTACGTAC", "IIIIIIIIII"),
+    ("read2", "A", "@"),
+    ("read3", "GGGGCCCCTTTTAAAA", "@@@@IIII####!!!!"),
+    ("read4", "N" * 37, "+" * 37)
+]
+
+def _batch_records(fh, block_size):
+    return [
+        rec
+        for batch in fastq_batch_gen(fh, block_size=block_size)
+        for rec in zip(*batch)
+    ]
+
+@pytest.mark.parametrize("block_size", [1, 2, 3, 7, 16, 1 << 20])
+def test_fastq_batch_block_edges(block_size):
+    # Records split across any block boundary
+    expected = [(f"@{n}", s, q) for n, s, q in BATCH_DATA]
+    fh = create_fastq_file(BATCH_DATA)
+
+    assert _batch_records(fh, block_size) == expected
+
+@pytest.mark.parametrize("block_size", [1, 5, 1 << 20])
+def test_fastq_batch_formats(block_size):
+    expected = [(f"@{n}", s, q) for n, s, q in BATCH_DATA]
+    content = create_fastq_file(BATCH_DATA).getvalue()
+
+    # No trailing newline
+    fh = StringIO(content.rstrip("\n"))
+    assert _batch_records(fh, block_size) == expected
+
+    # Windows line endings
+    fh = StringIO(content.replace("\n", "\r\n"))
+    assert _batch_records(fh, block_size) == expected
+
+    # Binary handle
+    fh = BytesIO(content.encode())
+    assert _batch_records(fh, block_size) == expected
+
+def test_fastq_batch_malformed():
+    with pytest.raises(ValueError):
+        list(fastq_batch_gen(StringIO("read1\nACGT\n+\nIIII\n")))
+
+@pytest.mark.parametrize("block_size", [3, 1 << 20])
+def test_fastq_batch_misaligned_record(block_size):
+    # An extra line after the first record must not shift later records
+    content = (
+        "@r1\nACGT\n+\nIIII\n"
+        "@r2\nACGTA\n+\nIIIII\nEXTRA\n"
+        "@r3\nAC\n+\nII\n"
+        "@r4\nA\n+\nI\n"
+    )
+
+    with pytest.raises(ValueError):
+        list(fastq_batch_gen(StringIO(content), block_size=block_size))
+
 def test_rc():
 
     seq = "ATGCNCGTA"
@@ -0,0 +1,152 @@
+import gzip
+import os
+import shutil
+from pathlib import Path
+
+import pysam
+import pytest
+
+from nanopore_10x_multiome.utils import (
+    FastqIndex,
+    build_fastq_index,
+    fastq_shards,
+    fastqProcessor,
+    file_opener,
+    load_fastq_index
+)
+
+TEST_FILE = os.path.join(Path(__file__).parent.absolute(), 'TEST_READS.fastq')
+N_RECORDS = 50
+
+
+def _records(fh):
+    processor = fastqProcessor(verify_ids=False, phred_type='raw')
+    return [x[0] for x in processor.fastq_gen(fh)]
+
+
+@pytest.fixture(scope='module')
+def expected():
+    with open(TEST_FILE) as fh:
+        return _records(fh)
+
+
+@pytest.fixture(params=['fastq', 'bgzf'])
+def fastq_file(request, tmp_path):
+
+    if request.param == 'fastq':
+        _file = str(tmp_path / 'reads.fastq')
+        shutil.copy(TEST_FILE, _file)
+    else:
+        _file = str(tmp_path / 'reads.fastq.gz')
+        pysam.tabix_compress(TEST_FILE, _file)
+
+    return _file
+
+
+@pytest.mark.parametrize("interval", [1, 3, 7, 50, 100])
+def test_index_offsets(fastq_file, expected, interval):
+
+    index = build_fastq_index(fastq_file, interval=interval, save=False)
+
+    assert index.n_records == N_RECORDS
+    assert len(index) == (N_RECORDS - 1) // interval + 1
+
+    for i, offset in enumerate(index.offsets):
+        with file_opener(fastq_file, shard=(int(offset), None)) as fh:
+            assert _records(fh)[0] == expected[i * interval]
+
+
+@pytest.mark.parametrize("n_shards", [1, 2, 5, 100])
+def test_shards(fastq_file, expected, n_shards):
+
+    build_fastq_index(fastq_file, interval=3)
+    shards = fastq_shards(fastq_file, n_shards=n_shards)
+
+    assert len(shards) == min(n_shards, 17)
+
+    records = []
+    for shard in shards:
+        with file_opener(fastq_file, shard=shard) as fh:
+            records.extend(_records(fh))
+
+    assert records == expected
+
+    shards = fastq_shards(fastq_file, records_per_shard=9)
+    assert len(shards) == 6
+
+    with file_opener(fastq_file, shard=shards[1]) as fh:
+        assert _records(fh) == expected[9:18]
+
+
+def test_index_save_load(fastq_file):
+
+    index = build_fastq_index(fastq_file, interval=4)
+
+    assert os.path.exists(fastq_file + '.fqi')
+
+    loaded = load_fastq_index(fastq_file, build=False)
+
+    assert isinstance(loaded, FastqIndex)
+    assert list(loaded.offsets) == list(index.offsets)
+    assert loaded.n_records == index.n_records
+    assert loaded.bgzf == index.bgzf
+
+    # Stale indexes are rebuilt
+    index.file_size += 1
+    index.save(fastq_file + '.fqi')
+
+    with pytest.raises(FileNotFoundError):
+        load_fastq_index(fastq_file, build=False)
+
+    assert load_fastq_index(fastq_file, interval=4).file_size == os.path.getsize(fastq_file)
+
+    # Same size but rewritten
+    _stat = os.stat(fastq_file)
+    os.utime(fastq_file, ns=(_stat.st_atime_ns, _stat.st_mtime_ns + 10 ** 9))
+
+    with pytest.raises(FileNotFoundError):
+        load_fastq_index(fastq_file, build=False)
+
+    assert load_fastq_index(fastq_file, interval=4).is_current(fastq_file)
+    assert load_fastq_index(fastq_file, build=False).is_current(fastq_file)
+
+
+def test_index_read_only(tmp_path, monkeypatch):
+
+    _file = str(tmp_path / 'reads.fastq')
+    shutil.copy(TEST_FILE, _file)
+
+    def _read_only(*args, **kwargs):
+        raise PermissionError("Read-only file system")
+
+    monkeypatch.setattr(FastqIndex, 'save', _read_only)
+
+    # Index is built and used without being written
+    index = load_fastq_index(_file, interval=4)
+
+    assert index.n_records == N_RECORDS
+    assert not os.path.exists(_file + '.fqi')
+
+
+def test_index_no_trailing_newline(tmp_path, expected):
+
+    _file = str(tmp_path / 'reads.fastq')
+
+    with open(TEST_FILE) as fh, open(_file, 'w') as out:
+        out.write(fh.read().rstrip('\n'))
+
+    index = build_fastq_index(_file, interval=5, save=False)
+
+    assert index.n_records == N_RECORDS
+    assert len(index) == 10
+
+
+def test_index_plain_gzip(tmp_path):
+
+    _file = str(tmp_path / 'reads.fastq.gz')
+
+    with open(TEST_FILE, 'rb') as fh, gzip.open(_file, 'wb') as out:
+        out.write(fh.read())
+
+    with pytest.raises(ValueError):
+        build_fastq_index(_file)
@@ -6,6 +6,7 @@ from nanopore_10x_multiome.gex import (
 )
 from nanopore_10x_multiome.utils import (
     RC,
+    SEARCH_BACKENDS,
     get_barcode_parasail
 )
 from nanopore_10x_multiome.utils.test import (
@@ -113,7 +114,8 @@ def test_missing_bases_moved_gex_parasail():
     assert psloc == 550 + 33
 
 
-def test_perfect_gex_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_perfect_gex_full(search_backend):
 
     seq = create_gex_sequence(
         GEX_BARCODE,
@@ -122,7 +124,8 @@ def test_perfect_gex_full():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 33, 16, 12)
+        create_qual(len(seq), 33, 16, 12),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0] + 22:locs[1]]
@@ -137,7 +140,8 @@ def test_perfect_gex_full():
     assert umi[1] == "B" * 12
 
 
-def test_perfect_gex_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_perfect_gex_full_rc(search_backend):
     seq = create_gex_sequence(
         GEX_BARCODE,
         0,
@@ -147,6 +151,7 @@ def test_perfect_gex_full_rc():
     bc, umi, locs = get_gex_anchors(
         seq,
         create_qual(len(seq), 33, 16, 12, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0]:locs[1] - 22]
@@ -161,7 +166,8 @@ def test_perfect_gex_full_rc():
     assert umi[1] == "B" * 12
 
 
-def test_extra_bases_gex_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_extra_bases_gex_full(search_backend):
 
     seq = create_gex_sequence(
         'ACACTCTTTCCCTACACNGACGCTCNTTCCGATNCTATGCATGCATGCATGCATGCATGCATGCTTTTTTTTTTTTTTTTTTTTTT',
@@ -170,7 +176,8 @@ def test_extra_bases_gex_full():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 36, 16, 12)
+        create_qual(len(seq), 36, 16, 12),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0] + 22:locs[1]]
@@ -185,7 +192,8 @@ def test_extra_bases_gex_full():
     assert umi[1] == "B" * 12
 
 
-def test_extra_bases_gex_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_extra_bases_gex_full_rc(search_backend):
 
     seq = create_gex_sequence(
         'ACACTCTTTCCCTACACNGACGCTCNTTCCGATNCTATGCATGCATGCATGCATGCATGCATGCTTTTTTTTTTTTTTTTTTTTTT',
@@ -195,7 +203,8 @@ def test_extra_bases_gex_full_rc():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 36, 16, 12, rev=True)
+        create_qual(len(seq), 36, 16, 12, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0]:locs[1] - 22]
@@ -210,7 +219,8 @@ def test_extra_bases_gex_full_rc():
     assert umi[1] == "B" * 12
 
 
-def test_missing_bases_gex_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_missing_bases_gex_full(search_backend):
 
     seq = create_gex_sequence(
         'ACACTCTTTCCCTACACACGCTCTCCGATTATGCATGCATGCATGCATGCATGCATGCTTTTTTTTTTTTTTTTTTTTTT',
@@ -219,7 +229,8 @@ def test_missing_bases_gex_full():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 30, 16, 12)
+        create_qual(len(seq), 30, 16, 12),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0] + 22:locs[1]]
@@ -234,7 +245,8 @@ def test_missing_bases_gex_full():
     assert umi[1] == "B" * 12
 
 
-def test_extra_bases_gex_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_extra_bases_gex_full_rc(search_backend):
 
     seq = create_gex_sequence(
         'ACACTCTTTCCCTACACACGCTCTCCGATTATGCATGCATGCATGCATGCATGCATGCTTTTTTTTTTTTTTTTTTTTTT',
@@ -244,7 +256,8 @@ def test_extra_bases_gex_full_rc():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 30, 16, 12, rev=True)
+        create_qual(len(seq), 30, 16, 12, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0]:locs[1] - 22]
@@ -259,7 +272,8 @@ def test_extra_bases_gex_full_rc():
     assert umi[1] == "B" * 12
 
 
-def test_missing_bases_gex_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_missing_bases_gex_full(search_backend):
 
     seq = create_gex_sequence(
         'ACACTCTTTCCCTACACACGCTCTCCGATTATGCATGCATGCATGCATGCATGCATGCTTTTTTTTTTTTTTTTTTTTTT',
@@ -268,7 +282,8 @@ def test_missing_bases_gex_full():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 30, 16, 12)
+        create_qual(len(seq), 30, 16, 12),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0] + 22:locs[1]]
@@ -283,7 +298,8 @@ def test_missing_bases_gex_full():
     assert umi[1] == "B" * 12
 
 
-def test_missing_bases_gex_full_rc():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_missing_bases_gex_full_rc(search_backend):
 
     seq = create_gex_sequence(
         'ACACTCTTTCCCTACACACGCTCTCCGATTATGCATGCATGCATGCATGCATGCATGCTTTTTTTTTTTTTTTTTTTTTT',
@@ -293,7 +309,8 @@ def test_missing_bases_gex_full_rc():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 30, 16, 12, rev=True)
+        create_qual(len(seq), 30, 16, 12, rev=True),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0]:locs[1] - 22]
@@ -308,7 +325,8 @@ def test_missing_bases_gex_full_rc():
     assert umi[1] == "B" * 12
 
 
-def test_near_barcode_bases_gex_full():
+@pytest.mark.parametrize("search_backend", SEARCH_BACKENDS)
+def test_near_barcode_bases_gex_full(search_backend):
 
     seq = create_gex_sequence(
         'ACACTCTTTCCCTACACGACGCTCTTCCGATATGCATGCATGCATGCATGCATGCATGCTTTATTTTTTTTTTTTTTTTTTT',
@@ -317,7 +335,8 @@ def test_near_barcode_bases_gex_full():
 
     bc, umi, locs = get_gex_anchors(
         seq,
-        create_qual(len(seq), 31, 16, 12)
+        create_qual(len(seq), 31, 16, 12),
+        search_backend=search_backend
     )
 
     genomic = seq[locs[0] + 1 + 22:locs[1]]
@@ -0,0 +1,167 @@
+import gzip
+import io
+import os
+from pathlib import Path
+
+import pysam
+import pytest
+
+from nanopore_10x_multiome.utils import (
+    BgzfReader,
+    build_fastq_index,
+    ThreadedGzipReader,
+    file_opener,
+    is_bgzf
+)
+from nanopore_10x_multiome.utils import _threads
+
+TEST_FILE = os.path.join(Path(__file__).parent.absolute(), 'TEST_READS.fastq')
+
+
+@pytest.fixture(scope='module')
+def expected():
+    with open(TEST_FILE, 'rb') as fh:
+        return fh.read()
+
+
+@pytest.fixture
+def gzip_file(tmp_path, expected):
+
+    # Two gzip members
+    _file = str(tmp_path / 'reads.fastq.gz')
+
+    with open(_file, 'wb') as fh:
+        fh.write(gzip.compress(expected[:1000]))
+        fh.write(gzip.compress(expected[1000:]))
+
+    return _file
+
+
+@pytest.fixture
+def bgzf_file(tmp_path):
+    _file = str(tmp_path / 'reads.bgzf.fastq.gz')
+    pysam.tabix_compress(TEST_FILE, _file)
+    return _file
+
+
+def test_is_bgzf(gzip_file, bgzf_file):
+    assert is_bgzf(bgzf_file)
+    assert not is_bgzf(gzip_file)
+    assert not is_bgzf(TEST_FILE)
+
+
+@pytest.mark.parametrize("threads", [0, 1, 2, 4])
+def test_file_opener_threads(gzip_file, bgzf_file, expected, threads):
+
+    for _file in (gzip_file, bgzf_file):
+        with file_opener(_file, mode='r', threads=threads) as fh:
+            assert fh.read() == expected
+
+
+@pytest.mark.parametrize("threads", [0, 1, 2])
+def test_file_opener_text(gzip_file, bgzf_file, expected, threads):
+
+    for _file in (gzip_file, bgzf_file):
+        with file_opener(_file, mode='rt', threads=threads) as fh:
+            lines = list(fh)
+
+        assert all(isinstance(x, str) for x in lines)
+        assert ''.join(lines) == expected.decode()
+
+
+@pytest.mark.parametrize("threads", [0, 3])
+def test_bgzf_reader(bgzf_file, expected, threads):
+
+    with io.BufferedReader(
+        BgzfReader(open(bgzf_file, 'rb'), threads=threads),
+        buffer_size=100
+    ) as fh:
+        assert b''.join(iter(lambda: fh.read(77), b'')) == expected
+
+
+def test_threaded_gzip_reader_small_chunks(monkeypatch, gzip_file, expected):
+
+    monkeypatch.setattr(_threads, 'READER_CHUNK_SIZE', 10)
+
+    with io.BufferedReader(
+        ThreadedGzipReader(open(gzip_file, 'rb'), queue_size=2)
+    ) as fh:
+        assert fh.read() == expected
+
+
+def test_threaded_gzip_reader_truncated(tmp_path, gzip_file):
+
+    _file = str(tmp_path / 'truncated.fastq.gz')
+
+    with open(gzip_file, 'rb') as fh:
+        data = fh.read()
+
+    with open(_file, 'wb') as fh:
+        fh.write(data[:-100])
+
+    with pytest.raises(EOFError):
+        with file_opener(_file, mode='r') as fh:
+            fh.read()
+
+
+def test_threaded_gzip_reader_early_close(monkeypatch, gzip_file, expected):
+
+    # Closing with a full queue doesn't hang the reader thread
+    monkeypatch.setattr(_threads, 'READER_CHUNK_SIZE', 10)
+
+    fh = ThreadedGzipReader(open(gzip_file, 'rb'), queue_size=1)
+    assert fh.read(5) == expected[:5]
+    fh.close()
+
+    assert not fh._thread.is_alive()
+
+
+@pytest.mark.parametrize("threads", [0, 1, 3])
+@pytest.mark.parametrize("compresslevel", [0, 1, 9])
+def test_bgzf_writer(tmp_path, expected, threads, compresslevel):
+
+    _file = str(tmp_path / 'out.fastq.gz')
+
+    # More than one block
+    data = (expected * 2).decode()
+
+    with file_opener(
+        _file,
+        mode='w',
+        threads=threads,
+        compresslevel=compresslevel
+    ) as fh:
+        for i in range(0, len(data), 5000):
+            fh.write(data[i:i + 5000])
+
+    assert is_bgzf(_file)
+
+    with gzip.open(_file, 'rt') as fh:
+        assert fh.read() == data
+
+    with open(_file, 'rb') as fh:
+        assert fh.read()[-28:] == bytes.fromhex(
+            '1f8b08040000000000ff0600424302001b0003000000000000000000'
+        )
+
+    index = build_fastq_index(_file, interval=7, save=False)
+    assert index.n_records == 100
+
+    with file_opener(_file, shard=(int(index.offsets[3]), None)) as fh:
+        assert fh.read().decode() == ''.join(
+            data.splitlines(keepends=True)[4 * 21:]
+        )
+
+
+def test_bgzf_writer_binary(tmp_path, expected):
+
+    _file = str(tmp_path / 'out.fastq.gz')
+
+    with file_opener(_file, mode='wb') as fh:
+        fh.write(expected)
+
+    with file_opener(_file, mode='r') as fh:
+        assert fh.read() == expected
+
+    with pysam.BGZFile(_file, 'rb') as fh:
+        assert fh.read() == expected
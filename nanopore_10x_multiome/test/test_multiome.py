@@ -1,10 +1,18 @@
+import array
+import gzip
+import logging
 import os
 from pathlib import Path
 import tempfile
+import pysam
+
+import pytest
 
 from nanopore_10x_multiome.multiome import split_multiome_preamp_fastq
+from nanopore_10x_multiome.utils import _fastq
 from nanopore_10x_multiome.barcodes import load_missing_multiome_barcode_info
-from nanopore_10x_multiome.utils import fastqProcessor
+from nanopore_10x_multiome.utils import fastqProcessor, is_bgzf
+from nanopore_10x_multiome.test.test_bam import write_ubam
 
 TEST_FILE = os.path.join(Path(__file__).parent.absolute(), 'TEST_READS.fastq')
 load_missing_multiome_barcode_info(test=True)
@@ -46,3 +54,362 @@ def test_multiome_stack():
 
         with open(out_files[2], mode='r') as test_file:
             assert (50 - N_GEX - N_ATAC) == int(len(list(test_file)) / 4)
+
+
+def test_multiome_multiple_files():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [
+            [os.path.join(td, f'out{i}_{j}.fastq') for j in range(2)]
+            for i in range(4)
+        ]
+
+        counts = split_multiome_preamp_fastq(
+            [TEST_FILE, TEST_FILE],
+            *out_files,
+            n_jobs=2,
+            keep_runoff_fragments=True
+        )
+
+        assert counts.shape == (2, 3)
+        assert all(counts[:, 0] == N_ATAC)
+        assert all(counts[:, 1] == N_GEX)
+        assert all(counts[:, 2] == 50 - N_GEX - N_ATAC)
+
+        for j in range(2):
+            with open(out_files[1][j], mode='r') as test_file:
+                assert N_GEX == int(len(list(test_file)) / 4)
+
+
+def _records(text):
+
+    lines = text.splitlines()
+
+    return sorted(
+        tuple(lines[i:i + 4])
+        for i in range(0, len(lines), 4)
+    )
+
+
+@pytest.mark.parametrize("keep_order", [True, False])
+def test_multiome_single_file_parallel(monkeypatch, keep_order):
+
+    # Small blocks so the file is split into several batches
+    monkeypatch.setattr(_fastq, 'FASTQ_BLOCK_SIZE', 4096)
+
+    with tempfile.TemporaryDirectory() as td:
+
+        serial_files = [os.path.join(td, f'serial{i}.fastq') for i in range(4)]
+        parallel_files = [os.path.join(td, f'parallel{i}.fastq') for i in range(4)]
+
+        serial_counts = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *serial_files,
+            keep_runoff_fragments=True
+        )
+
+        parallel_counts = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *parallel_files,
+            n_jobs=2,
+            keep_runoff_fragments=True,
+            keep_order=keep_order
+        )
+
+        assert list(parallel_counts) == list(serial_counts)
+        assert list(serial_counts) == [N_ATAC, N_GEX, 50 - N_ATAC - N_GEX]
+
+        for f1, f2 in zip(serial_files, parallel_files):
+            with open(f1) as fh1, open(f2) as fh2:
+                _serial, _parallel = fh1.read(), fh2.read()
+
+            if keep_order:
+                assert _serial == _parallel
+            else:
+                assert _records(_serial) == _records(_parallel)
+
+
+@pytest.mark.parametrize("output_threads, compresslevel", [
+    (None, 6),
+    (3, 1)
+])
+def test_multiome_gzip_outputs(output_threads, compresslevel):
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [
+            os.path.join(td, f'out{i}.fastq.gz')
+            for i in range(4)
+        ]
+
+        plain_files = [
+            os.path.join(td, f'plain{i}.fastq')
+            for i in range(4)
+        ]
+
+        counts = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *out_files,
+            keep_runoff_fragments=True,
+            output_threads=output_threads,
+            compresslevel=compresslevel
+        )
+
+        split_multiome_preamp_fastq(
+            TEST_FILE,
+            *plain_files,
+            keep_runoff_fragments=True
+        )
+
+        assert list(counts) == [N_ATAC, N_GEX, 50 - N_ATAC - N_GEX]
+
+        with gzip.open(out_files[1], mode='rt') as test_file:
+            assert N_GEX == int(len(list(test_file)) / 4)
+
+        with gzip.open(out_files[0], mode='rt') as test_file:
+            assert N_ATAC == int(len(list(test_file)) / 4)
+
+        # Compressed output is BGZF with the same reads as plain output
+        for out_file, plain_file in zip(out_files, plain_files):
+            assert is_bgzf(out_file)
+
+            with gzip.open(out_file, mode='rt') as fh1, open(plain_file) as fh2:
+                assert fh1.read() == fh2.read()
+
+
+def test_multiome_end_windows(caplog):
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [
+            os.path.join(td, f'out{i}.fastq')
+            for i in range(4)
+        ]
+
+        with caplog.at_level(logging.INFO, logger='nanopore_10x_multiome.multiome'):
+            counts = split_multiome_preamp_fastq(
+                TEST_FILE,
+                *out_files,
+                keep_runoff_fragments=True,
+                end_window=500
+            )
+
+        assert list(counts) == [N_ATAC, N_GEX, 50 - N_ATAC - N_GEX]
+        assert 'fallback_reads=' in caplog.text
+
+
+def test_multiome_adaptive_order(caplog):
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [
+            os.path.join(td, f'out{i}.fastq')
+            for i in range(4)
+        ]
+
+        with caplog.at_level(logging.INFO, logger='nanopore_10x_multiome.multiome'):
+            counts = split_multiome_preamp_fastq(
+                TEST_FILE,
+                *out_files,
+                keep_runoff_fragments=True,
+                adaptive_order=True
+            )
+
+        assert list(counts) == [N_ATAC, N_GEX, 50 - N_ATAC - N_GEX]
+        assert 'estimated_ms_saved=' in caplog.text
+        assert 'alignment_cache_hits=' in caplog.text
+
+
+def test_multiome_barcode_rescue(caplog):
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [
+            os.path.join(td, f'out{i}.fastq')
+            for i in range(4)
+        ]
+
+        with caplog.at_level(logging.INFO, logger='nanopore_10x_multiome.multiome'):
+            counts = split_multiome_preamp_fastq(
+                TEST_FILE,
+                *out_files,
+                keep_runoff_fragments=True,
+                max_barcode_dist=2
+            )
+
+        assert list(counts) == [N_ATAC, N_GEX, 50 - N_ATAC - N_GEX]
+        assert 'barcode_rescue_queries=' in caplog.text
+
+        rescued = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *out_files,
+            write_only_valid_barcodes=True,
+            max_barcode_dist=2
+        )
+        valid = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *out_files,
+            write_only_valid_barcodes=True
+        )
+
+        assert rescued[0] >= valid[0]
+        assert rescued[1] >= valid[1]
+
+
+def _split_tags(header):
+    return [x for x in header.split()[1:] if x[:3] in ('CB=', 'CR=', 'CY=', 'UB=', 'UR=', 'UY=')]
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_multiome_ubam_input(n_jobs):
+
+    with tempfile.TemporaryDirectory() as td:
+
+        bam_file = os.path.join(td, 'reads.bam')
+        write_ubam(
+            TEST_FILE,
+            bam_file,
+            MM='C+m?,0;',
+            ML=array.array('B', [10, 200])
+        )
+
+        fastq_files = [os.path.join(td, f'fastq{i}.fastq') for i in range(4)]
+        bam_files = [os.path.join(td, f'bam{i}.fastq') for i in range(4)]
+        tag_files = [os.path.join(td, f'tags{i}.fastq') for i in range(4)]
+
+        fastq_counts = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *fastq_files,
+            keep_runoff_fragments=True
+        )
+        bam_counts = split_multiome_preamp_fastq(
+            bam_file,
+            *bam_files,
+            keep_runoff_fragments=True,
+            n_jobs=n_jobs
+        )
+        split_multiome_preamp_fastq(
+            bam_file,
+            *tag_files,
+            keep_runoff_fragments=True,
+            keep_input_tags=True,
+            n_jobs=n_jobs
+        )
+
+        assert list(bam_counts) == list(fastq_counts)
+
+        processor = fastqProcessor(verify_ids=False, phred_type='raw')
+
+        for k, (fastq_file, bam_file, tag_file) in enumerate(
+            zip(fastq_files, bam_files, tag_files)
+        ):
+            with open(fastq_file) as fh:
+                fastq_reads = [r[0] for r in processor.fastq_gen(fh)]
+            with open(bam_file) as fh:
+                bam_reads = [r[0] for r in processor.fastq_gen(fh)]
+            with open(tag_file) as fh:
+                tag_reads = [r[0] for r in processor.fastq_gen(fh)]
+
+            assert [r[1:] for r in bam_reads] == [r[1:] for r in fastq_reads]
+            assert [r[1:] for r in tag_reads] == [r[1:] for r in fastq_reads]
+
+            # Same tags from splitting, and input tags carried through
+            for fastq_read, bam_read, tag_read in zip(fastq_reads, bam_reads, tag_reads):
+                assert _split_tags(fastq_read[0]) == _split_tags(bam_read[0])
+                assert ' RG=run1' in tag_read[0]
+                assert ' ch=' in tag_read[0]
+
+                # Base modification tags are only kept on untrimmed
+                # (other) reads, with arrays as comma-separated values
+                _comment = tag_read[0].split()[1:]
+
+                if k == 2:
+                    assert 'ML=10,200' in _comment
+                    assert 'MM=C+m?,0;' in _comment
+                else:
+                    assert not any(x[:3] in ('MM=', 'ML=') for x in _comment)
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_multiome_ubam_output(n_jobs):
+
+    with tempfile.TemporaryDirectory() as td:
+
+        fastq_files = [os.path.join(td, f'fastq{i}.fastq') for i in range(4)]
+        bam_files = [os.path.join(td, f'bam{i}.bam') for i in range(4)]
+
+        fastq_counts = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *fastq_files,
+            keep_runoff_fragments=True
+        )
+        bam_counts = split_multiome_preamp_fastq(
+            TEST_FILE,
+            *bam_files,
+            keep_runoff_fragments=True,
+            n_jobs=n_jobs
+        )
+
+        assert list(bam_counts) == list(fastq_counts)
+
+        processor = fastqProcessor(verify_ids=False, phred_type='raw')
+
+        for fastq_file, bam_file in zip(fastq_files, bam_files):
+            with open(fastq_file) as fh:
+                fastq_reads = [r[0] for r in processor.fastq_gen(fh)]
+
+            with pysam.AlignmentFile(bam_file, 'rb', check_sq=False) as fh:
+                assert 'PG' in fh.header.to_dict()
+                records = list(fh.fetch(until_eof=True))
+
+            # Gap padding in technical reads has no BAM code and becomes N
+            assert [(r.query_sequence or '', r.query_qualities_str or '') for r in records] == [
+                (r[1].replace('-', 'N'), r[2]) for r in fastq_reads
+            ]
+
+            # Tags as SAM tags instead of header comments
+            for fastq_read, record in zip(fastq_reads, records):
+                assert record.query_name == fastq_read[0][1:].split()[0]
+                assert _split_tags(fastq_read[0]) == [
+                    f"{k}={v}" for k, v in record.get_tags()
+                ]
+
+
+def test_multiome_sam_comments():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        out_files = [os.path.join(td, f'out{i}.fastq') for i in range(4)]
+        sam_files = [os.path.join(td, f'sam{i}.fastq') for i in range(4)]
+
+        split_multiome_preamp_fastq(TEST_FILE, *out_files, keep_runoff_fragments=True)
+        split_multiome_preamp_fastq(
+            TEST_FILE,
+            *sam_files,
+            keep_runoff_fragments=True,
+            comment_format='sam'
+        )
+
+        processor = fastqProcessor(verify_ids=False, phred_type='raw')
+
+        for out_file, sam_file in zip(out_files, sam_files):
+            with open(out_file) as fh:
+                reads = [r[0] for r in processor.fastq_gen(fh)]
+            with open(sam_file) as fh:
+                sam_reads = [r[0] for r in processor.fastq_gen(fh)]
+
+            assert [r[1:] for r in sam_reads] == [r[1:] for r in reads]
+
+            # Tab separated TAG:Z:VALUE fields carry the key=value tags,
+            # and comments that aren't SAM tags are dropped, so minimap2 -y
+            # only copies valid fields into alignments
+            for read, sam_read in zip(reads, sam_reads):
+                _header, *_tags = sam_read[0].split('\t')
+
+                assert _header == read[0].split()[0]
+                assert all(t[2:5] == ':Z:' for t in _tags)
+                assert [t[:2] + '=' + t[5:] for t in _tags] == _split_tags(read[0])
+
+        with pytest.raises(ValueError):
+            split_multiome_preamp_fastq(TEST_FILE, *sam_files, comment_format='nope')
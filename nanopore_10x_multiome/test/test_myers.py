@@ -0,0 +1,324 @@
+import random
+
+import pytest
+import regex
+
+from nanopore_10x_multiome.utils import (
+    RC,
+    FlankedPattern,
+    MyersBatch,
+    PatternScanner,
+    myers_distances,
+    approximate_matches,
+    fuzzy_match_end,
+    check_search_backend
+)
+from nanopore_10x_multiome.atac import (
+    TENX_ATAC_PATTERN,
+    TENX_ATAC_PATTERN_RC,
+    tenx_re
+)
+from nanopore_10x_multiome.gex import TENX_GEX_PATTERN, gex_re
+
+
+def _edit_distance(a, b):
+
+    _prev = list(range(len(b) + 1))
+
+    for i, x in enumerate(a, 1):
+        _row = [i]
+
+        for j, y in enumerate(b, 1):
+            _row.append(min(
+                _prev[j] + 1,
+                _row[j - 1] + 1,
+                _prev[j - 1] + (x != y)
+            ))
+
+        _prev = _row
+
+    return _prev[-1]
+
+
+def _random_seq(rng, n):
+    return ''.join(rng.choice('ACGT') for _ in range(n))
+
+
+def test_myers_distances():
+
+    rng = random.Random(3)
+
+    patterns = ['ACGTAC', 'GATTACA', 'CGCGTCTGTCGTCGGCAGCG']
+    seqs = [_random_seq(rng, n) for n in (0, 5, 30, 41)]
+
+    for reverse in (False, True):
+        for seq, distances in zip(
+            seqs,
+            myers_distances(seqs, patterns, reverse=reverse)
+        ):
+            assert distances.shape == (len(patterns), len(seq))
+
+            for p, pattern in enumerate(patterns):
+                for j in range(len(seq)):
+                    if reverse:
+                        _subs = [seq[j:k] for k in range(j + 1, len(seq) + 1)]
+                    else:
+                        _subs = [seq[k:j + 1] for k in range(j + 1)]
+
+                    assert distances[p, j] == min(
+                        min(_edit_distance(pattern, x) for x in _subs),
+                        len(pattern)
+                    )
+
+
+def test_myers_distances_bad_pattern():
+
+    with pytest.raises(ValueError):
+        myers_distances(['ACGT'], ['A' * 64])
+
+    with pytest.raises(ValueError):
+        myers_distances(['ACGT'], [''])
+
+
+def test_approximate_matches():
+
+    pattern = 'AGATGTGTATAAGAGACAG'
+    seq = 'G' * 20 + pattern + 'C' * 20 + pattern[:5] + 'T' + pattern[6:] + 'C' * 20
+
+    spans = approximate_matches(
+        seq,
+        myers_distances([seq], [pattern])[0][0],
+        pattern,
+        3
+    )
+
+    assert spans == [
+        x.span()
+        for x in regex.finditer(
+            f"(?:{pattern}){{e<=3}}",
+            seq,
+            flags=regex.BESTMATCH
+        )
+    ]
+    assert len(spans) == 2
+
+
+def test_approximate_matches_max_matches():
+
+    pattern = 'GATTACA'
+    seq = ('CC' + pattern) * 5
+
+    spans = approximate_matches(
+        seq,
+        myers_distances([seq], [pattern])[0][0],
+        pattern,
+        1,
+        max_matches=3
+    )
+
+    assert spans == [(2, 9), (11, 18), (20, 27)]
+
+
+@pytest.mark.parametrize("chunk_size", [8, 128])
+def test_pattern_scanner(chunk_size):
+
+    rng = random.Random(9)
+    scanner = PatternScanner([('GATTACA', 1), ('CCGGTTAA', 2)], 4, chunk_size=chunk_size)
+
+    seqs = ['', 'GATTACA']
+
+    for _ in range(30):
+        seq = _random_seq(rng, rng.randrange(10, 300))
+
+        for _ in range(rng.randrange(4)):
+            i = rng.randrange(len(seq))
+            seq = seq[:i] + rng.choice(('GATTACA', 'GATACA', 'CCGGTAA', 'CCGCGTTAA')) + seq[i:]
+
+        seqs.append(seq)
+
+    spans, counts = scanner.scan(seqs)
+
+    assert spans.shape == (len(seqs), 4, 2)
+
+    for i, seq in enumerate(seqs):
+        _expected = [
+            x.span()
+            for _re in ('(GATTACA){e<=1}', '(CCGGTTAA){e<=2}')
+            for x in regex.finditer(_re, seq, flags=regex.BESTMATCH)
+        ][:4]
+
+        assert counts[i] == len(_expected)
+        assert [tuple(x) for x in spans[i, :counts[i]].tolist()] == _expected
+
+
+def test_flanked_pattern():
+
+    rng = random.Random(5)
+    pattern = FlankedPattern('ACGTACGTAA', 1, 8, 'GGCCTTAA', 1)
+
+    bc = _random_seq(rng, 8)
+    seq = 'T' * 20 + 'ACGTACGTAA' + bc + 'GGCCTTAA' + 'T' * 20
+
+    search = MyersBatch(
+        [seq, RC(seq), 'T' * 50],
+        flanked_patterns=[pattern, pattern.reverse_complement()]
+    )
+
+    # Same as the regular expression, which extends the left flank
+    # with an insertion
+    _re = regex.compile('(ACGTACGTAA){e<=1}([ATGCN]{8})(GGCCTTAA){e<=1}')
+    assert search.find(0, 0) == _re.search(seq).span() == (19, 46)
+
+    _start, _end = search.find(1, 1)
+    assert RC(RC(seq)[_start:_end]) == _re.search(seq).group(0)
+    assert search.find(0, 1) is None
+    assert search.find(2, 0) is None
+
+    # Gap bases must be nucleotides
+    _bad = seq[:32] + '-' + seq[33:]
+    assert MyersBatch([_bad], [pattern]).find(0, 0) is None
+
+
+@pytest.mark.parametrize("pattern, compiled_regex", [
+    (TENX_ATAC_PATTERN, tenx_re),
+    (TENX_GEX_PATTERN, gex_re)
+])
+def test_flanked_pattern_adapters(pattern, compiled_regex):
+
+    rng = random.Random(11)
+
+    _adapter = pattern.left + _random_seq(rng, pattern.gap) + pattern.right
+
+    for _ in range(50):
+        seq = _random_seq(rng, 60) + _adapter + _random_seq(rng, 60)
+        search = MyersBatch([seq], [pattern])
+
+        assert search.find(0, 0) == compiled_regex.search(seq).span()
+
+
+# Reads where the regex module doesn't find the match with the fewest
+# edits; it only tries edits where a base doesn't match, so the first GEX
+# read (which needs a deletion of a matching base) has no match, and it
+# extends the right flank of the ATAC read with insertions
+@pytest.mark.parametrize("pattern, compiled_regex, seq, span", [
+    (
+        TENX_GEX_PATTERN,
+        gex_re,
+        'TGGTCATCTGGGCTAAGTGCATCCCTACACGACGCTCTTCCGATCTAGAAACGTATCTACGCGCAGTAAAAGTTTT',
+        None
+    ),
+    (
+        TENX_ATAC_PATTERN,
+        tenx_re,
+        'GCCTGACTCGAGATCTACACTCAAAAACCCGGAATTCGCGTCTGTCGTCGGCAGCCGGGCTGAATAA',
+        (6, 56)
+    ),
+    (
+        TENX_ATAC_PATTERN,
+        tenx_re,
+        'CGTACAAAGTCGAAAGTGCTGGGTTGTTCGAGATCTACACGGCCTTAGTAGGTGGACGCGTCTGTCGTCGCACGCGCCGGGAGAACAGAGTTACGCCGCAAACAATAGCGTC',
+        (26, 76)
+    )
+])
+def test_flanked_pattern_regex_edits(pattern, compiled_regex, seq, span):
+
+    _match = compiled_regex.search(seq)
+
+    assert (_match.span() if _match is not None else None) == span
+    assert MyersBatch([seq], [pattern]).find(0, 0) == span
+
+
+@pytest.mark.parametrize("pattern, compiled_regex", [
+    (TENX_ATAC_PATTERN, tenx_re),
+    (TENX_GEX_PATTERN, gex_re)
+])
+def test_flanked_pattern_mutated_adapters(pattern, compiled_regex):
+
+    rng = random.Random(17)
+
+    def _mutate(seq):
+        seq = list(seq)
+
+        for _ in range(rng.randrange(8)):
+            i = rng.randrange(len(seq))
+            _op = rng.randrange(3)
+
+            if _op == 0:
+                seq[i] = rng.choice('ACGT')
+            elif _op == 1:
+                del seq[i]
+            else:
+                seq.insert(i, rng.choice('ACGT'))
+
+        return ''.join(seq)
+
+    seqs = []
+
+    for _ in range(500):
+        _adapter = _mutate(
+            pattern.left + _random_seq(rng, pattern.gap) + pattern.right
+        )
+
+        seqs.append(
+            _random_seq(rng, rng.randrange(60)) +
+            (RC(_adapter) if rng.random() < 0.5 else _adapter) +
+            _random_seq(rng, rng.randrange(60))
+        )
+
+    search = MyersBatch(
+        seqs,
+        [pattern, pattern.reverse_complement()]
+    )
+
+    for i, seq in enumerate(seqs):
+        _match = compiled_regex.search(seq)
+        assert search.find(i, 0) == (
+            _match.span() if _match is not None else None
+        )
+
+        # The last match is the first match in the reverse complement
+        _match = compiled_regex.search(RC(seq))
+        assert search.find(i, 1) == (
+            (len(seq) - _match.end(), len(seq) - _match.start())
+            if _match is not None else None
+        )
+
+
+@pytest.mark.parametrize("seq, items, start, end", [
+    ('ABCXY', [('ABCD', 1), ('XY', 0)], 0, 5),
+    ('ABCDDXY', [('ABCD', 1), ('XY', 0)], 0, 7),
+    ('ABCDXY', [('ABCD', 1), (None, 1), ('XY', 0)], 0, None),
+    ('ACCA', [('CCA', 1)], 0, None),
+    ('ACCA', [('CCA', 1)], 1, 4),
+    ('GACCA', [('CCA', 1)], 1, 5),
+    ('ACNTACGG', [('AC', 0), (None, 2), ('ACG', 0)], 0, 7),
+    ('AC-TACGG', [('AC', 0), (None, 2), ('ACG', 0)], 0, None)
+])
+def test_fuzzy_match_end(seq, items, start, end):
+
+    _re = regex.compile(''.join(
+        f'([ATGCN]{{{k}}})' if x is None else f'({x}){{e<={k}}}'
+        for x, k in items
+    ))
+
+    assert fuzzy_match_end(seq, start, items) == end
+
+    if end is not None:
+        assert _re.search(seq).span() == (start, end)
+
+
+def test_reverse_complement_pattern():
+
+    assert TENX_ATAC_PATTERN_RC.left == RC(TENX_ATAC_PATTERN.right)
+    assert TENX_ATAC_PATTERN_RC.right == RC(TENX_ATAC_PATTERN.left)
+    assert TENX_ATAC_PATTERN_RC.last
+    assert not TENX_ATAC_PATTERN_RC.reverse_complement().last
+
+
+def test_check_search_backend():
+
+    check_search_backend('regex')
+    check_search_backend('myers')
+
+    with pytest.raises(ValueError):
+        check_search_backend('nope')
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from nanopore_10x_multiome.barcodes import (
+    PackedCorrectionTable,
+    barcode_correction_table,
+    correct_barcode,
+    load_gex_barcodes,
+    pack_barcode,
+    pack_barcodes,
+    unpack_barcode
+)
+
+
+def _random_barcodes(n, length=16, seed=10):
+    rng = np.random.default_rng(seed)
+    barcodes = [
+        ''.join(rng.choice(list('ACGT'), size=length))
+        for _ in range(n)
+    ]
+
+    # Add single-edit neighbours so there are ambiguous variants
+    barcodes += [b[:3] + 'A' + b[4:] for b in barcodes[:n // 4]]
+    barcodes += [b[1:] + 'C' for b in barcodes[:n // 4]]
+
+    return barcodes
+
+
+def _assert_same_table(barcodes):
+    expected = barcode_correction_table(barcodes)
+    packed = PackedCorrectionTable.from_barcodes(barcodes)
+
+    assert dict(packed.items()) == expected
+
+
+@pytest.mark.parametrize("barcodes", [
+    ["ACGT"],
+    ["AAAA", "CCAA"],
+    ["ACGT", "ACTT"],
+    ["AAAA", "AAAA"],
+    ["AAA", "AAAA"],
+    ["AACCGGTT", "AAACCCGG", "TTTTTTTT"]
+])
+def test_packed_matches_dict(barcodes):
+    _assert_same_table(barcodes)
+
+
+def test_packed_matches_dict_random():
+    _assert_same_table(_random_barcodes(200))
+
+
+def test_packed_matches_dict_whitelist():
+    _assert_same_table(list(load_gex_barcodes(test=True)))
+
+
+def test_packed_empty():
+    packed = PackedCorrectionTable.from_barcodes([])
+
+    assert len(packed) == 0
+    assert "ACGT" not in packed
+    assert packed.lookup(["ACGT"]) == [None]
+
+
+def test_pack_barcode():
+    assert unpack_barcode(pack_barcode("ACGTN")) == "ACGTN"
+    assert pack_barcode("A") != pack_barcode("AA")
+
+    with pytest.raises(ValueError):
+        pack_barcode("ACGU")
+
+    with pytest.raises(ValueError):
+        pack_barcode("AC 1")
+
+    assert list(pack_barcodes(["ACGT", "AXGT", None])[1:]) == [0, 0]
+
+
+def test_packed_lookup():
+    barcodes = _random_barcodes(50)
+    expected = barcode_correction_table(barcodes)
+    packed = PackedCorrectionTable.from_barcodes(barcodes)
+
+    queries = list(expected.keys())[::7] + ["ACGU", "", "A" * 30, "NNNN"]
+
+    assert packed.lookup(queries) == [expected.get(q) for q in queries]
+
+    for q in queries:
+        assert correct_barcode(q, "I" * len(q), packed) == expected.get(q)
+
+
+def test_packed_chunked_build(monkeypatch):
+    barcodes = _random_barcodes(200)
+    expected = PackedCorrectionTable.from_barcodes(barcodes)
+
+    monkeypatch.setattr(PackedCorrectionTable, 'build_chunk_size', 1000)
+    chunked = PackedCorrectionTable.from_barcodes(barcodes)
+
+    assert np.all(chunked.keys == expected.keys)
+    assert np.all(chunked.values == expected.values)
+
+
+def test_packed_parallel_build(monkeypatch):
+    barcodes = _random_barcodes(200)
+    expected = PackedCorrectionTable.from_barcodes(barcodes)
+
+    monkeypatch.setattr(PackedCorrectionTable, 'build_chunk_size', 1000)
+    parallel = PackedCorrectionTable.from_barcodes(barcodes, n_jobs=2)
+
+    assert np.all(parallel.keys == expected.keys)
+    assert np.all(parallel.values == expected.values)
@@ -3,9 +3,22 @@ Generated with cursor/claude-3.5-sonnet and then fixed to actually work
 """
 
 
+import random
+
+import parasail
 import pytest
 import regex
-from nanopore_10x_multiome.utils import get_barcode_parasail, RC
+from nanopore_10x_multiome.utils import (
+    get_barcode_parasail,
+    align_barcode_parasail,
+    align_barcodes_parasail,
+    AlignmentCache,
+    ALIGNMENT_CACHE,
+    RC
+)
+from nanopore_10x_multiome.utils._parasail_barcode import PARASAIL_MATRIX
+from nanopore_10x_multiome.atac import TENX_ATAC_ADAPTER
+from nanopore_10x_multiome.gex import TENX_GEX_ADAPTER
 
 @pytest.fixture
 def setup_regex_and_comparison():
@@ -120,3 +133,209 @@ def test_quality_string_slicing(setup_regex_and_comparison):
 
     assert len(quality) == bc_len
     assert quality == qual[position:position + bc_len]
+
+
+def test_align_barcode_offset():
+    # Alignment starts partway into the adapter and has a
+    # deletion in the read after the barcode
+    seq = 'ACGCGAGATCTACACATGCATGCATGCATGCCGCGTCTTCGTCGGCAGCGTT'
+    qual = 'F' * len(seq)
+
+    barcode, quality, position = align_barcode_parasail(
+        seq, qual, TENX_ATAC_ADAPTER, 16, offset=100
+    )
+
+    assert barcode == 'ATGCATGCATGCATGC'
+    assert quality == 'F' * 16
+    assert position == 115
+
+
+def test_align_barcodes_batch(setup_regex_and_comparison):
+    _, comparison_seq = setup_regex_and_comparison
+
+    seqs = [
+        'ACGTACGTACGTATCGATCGATCGATCGTGCATGCATGCA',
+        'ACGTACGTACGTATCGAATCGATCGATCGTGCATGCATGCA',
+        'GGGGCCCCAAAATTTT',
+        'ACGTACGTACGTATCGATCGTCGATCGTGCATGCATGCA'
+    ]
+    quals = ['ABCDEFGHIJKLMNOPQRSTUVWXYZ' * 2 for _ in seqs]
+
+    assert align_barcodes_parasail(
+        seqs,
+        quals,
+        comparison_seq,
+        16,
+        offsets=[0, 1, 2, 3]
+    ) == [
+        align_barcode_parasail(s, q, comparison_seq, 16, offset=i)
+        for i, (s, q) in enumerate(zip(seqs, quals))
+    ]
+
+    assert align_barcodes_parasail([], [], comparison_seq, 16) == []
+
+
+@pytest.fixture
+def alignment_cache():
+    _maxsize = ALIGNMENT_CACHE.maxsize
+    ALIGNMENT_CACHE.clear()
+    yield ALIGNMENT_CACHE
+    ALIGNMENT_CACHE.resize(_maxsize)
+    ALIGNMENT_CACHE.clear()
+
+
+def test_alignment_cache(setup_regex_and_comparison, alignment_cache):
+    _, comparison_seq = setup_regex_and_comparison
+    seq = 'ACGTACGTACGTATCGATCGATCGATCGTGCATGCATGCA'
+
+    first = align_barcode_parasail(seq, 'F' * len(seq), comparison_seq, 16, offset=5)
+    assert alignment_cache.counts == {'hits': 0, 'misses': 1, 'evictions': 0}
+
+    # Qualities and offsets come from each read, not the cached alignment
+    qual = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ' * 2
+    second = align_barcode_parasail(seq, qual, comparison_seq, 16, offset=10)
+    assert alignment_cache.counts['hits'] == 1
+
+    assert first == ('ATCGATCGATCGATCG', 'F' * 16, 17)
+    assert second == ('ATCGATCGATCGATCG', qual[12:28], 22)
+
+    # Different barcode lengths are cached separately
+    align_barcode_parasail(seq, qual, comparison_seq, 15)
+    assert alignment_cache.counts['misses'] == 2
+
+    # Repeats in a batch are cached
+    first, second = align_barcodes_parasail(
+        ['GGGGCCCCAAAATTTT'] * 2, ['F' * 16] * 2, comparison_seq, 16
+    )
+    assert first == second
+    assert alignment_cache.counts['hits'] == 2
+
+    assert alignment_cache.pop_counts() == {'hits': 2, 'misses': 3, 'evictions': 0}
+    assert alignment_cache.counts == {'hits': 0, 'misses': 0, 'evictions': 0}
+    assert len(alignment_cache) == 3
+
+
+def test_alignment_cache_eviction(setup_regex_and_comparison, alignment_cache):
+    _, comparison_seq = setup_regex_and_comparison
+    seqs = [
+        'ACGTACGTACGTATCGATCGATCGATCGTGCATGCATGCA',
+        'ACGTACGTACGTATCGAATCGATCGATCGTGCATGCATGCA',
+        'ACGTACGTACGTATCGATCGTCGATCGTGCATGCATGCA'
+    ]
+
+    alignment_cache.resize(2)
+
+    for seq in seqs + seqs[2:] + seqs[:1]:
+        align_barcode_parasail(seq, 'F' * len(seq), comparison_seq, 16)
+
+    # The first window was evicted by the third, then aligned again
+    assert alignment_cache.counts == {'hits': 1, 'misses': 4, 'evictions': 2}
+    assert len(alignment_cache) == 2
+
+    alignment_cache.resize(0)
+    assert len(alignment_cache) == 0
+
+    align_barcode_parasail(seqs[0], 'F' * len(seqs[0]), comparison_seq, 16)
+    assert len(alignment_cache) == 0
+
+    with pytest.raises(ValueError):
+        AlignmentCache(-1)
+
+
+def _reference_barcode(seq, qual, comparison_sequence, bc_len):
+    # Alignment of the read window (query) to the comparison
+    # sequence (reference) with the scalar parasail implementation
+
+    result = parasail.sw_trace(seq, comparison_sequence, 2, 1, PARASAIL_MATRIX)
+    _query, _ref = result.traceback.query, result.traceback.ref
+    _position = _ref.find('N')
+
+    if _position == -1:
+        return None, None, None
+
+    if _position > 0 and _ref[_position - 1] == '-':
+        _position -= 1
+        bc_len += 1
+    elif _ref[_position + 1] == '-':
+        bc_len += 1
+
+    _barcode = _query[_position:_position + bc_len].replace('-', '')
+
+    if len(_barcode) < bc_len - 1:
+        return None, None, None
+
+    _loc = seq.find(_barcode)
+
+    return (
+        _barcode,
+        qual[_loc:_loc + len(_barcode)],
+        _position - _query.count('-', 0, _position)
+    )
+
+
+# Windows where aligning the comparison sequence as the query breaks
+# ties between equally scoring alignments differently
+@pytest.mark.parametrize("seq, comparison_sequence, bc_len, barcode, position", [
+    (
+        'AATGATACGGCGACCACCGAGATCTAACAGAGATCTATTTTCTTGCGCGCTGTCGTCGGCAGCGTCA',
+        TENX_ATAC_ADAPTER, 16, 'AGAGATCTATTTTCTTG', 28
+    ),
+    (
+        'AATGATACGGCGACCACCGAGATCTACACCCGTCTGTTATATACAGCCGTCTGTCGTCGGCAGCGTCA',
+        TENX_ATAC_ADAPTER, 16, 'CCGTCTGTTATATACA', 29
+    ),
+    (
+        'ACACTCTTTCCCTACACGACGCTCTTCCGATTCACCCAATGGCATTCGTCTACGACGCTCGTTT',
+        TENX_GEX_ADAPTER, 28, 'CACCCAATGGCATTCGTCTACGACGCTCG', 32
+    ),
+    (
+        'CACATCTTTCCCTACACGACGCTCTTCCGATCTGGGGCGGGGTTTAATCAACGAAGACACGTT',
+        TENX_GEX_ADAPTER, 28, 'GGGGCGGGGTTTAATCAACGAAGACACG', 33
+    )
+])
+def test_align_barcode_ties(seq, comparison_sequence, bc_len, barcode, position, alignment_cache):
+
+    qual = 'I' * len(seq)
+
+    assert align_barcode_parasail(seq, qual, comparison_sequence, bc_len) == (
+        barcode, 'I' * len(barcode), position
+    )
+    assert _reference_barcode(seq, qual, comparison_sequence, bc_len) == (
+        barcode, 'I' * len(barcode), position
+    )
+
+
+@pytest.mark.parametrize("comparison_sequence, bc_len", [
+    (TENX_ATAC_ADAPTER, 16),
+    (TENX_GEX_ADAPTER, 28)
+])
+def test_align_barcode_reference(comparison_sequence, bc_len, alignment_cache):
+
+    rng = random.Random(bc_len)
+
+    def _mutate(seq):
+        seq = list(seq)
+
+        for _ in range(rng.randrange(6)):
+            i = rng.randrange(len(seq))
+            _op = rng.randrange(3)
+
+            if _op == 0:
+                seq[i] = rng.choice('ACGT')
+            elif _op == 1:
+                del seq[i]
+            else:
+                seq.insert(i, rng.choice('ACGT'))
+
+        return ''.join(seq)
+
+    for _ in range(2000):
+        seq = _mutate(comparison_sequence.replace(
+            'N' * bc_len,
+            ''.join(rng.choice('ACGT') for _ in range(bc_len))
+        ))
+        qual = ''.join(chr(33 + rng.randrange(40)) for _ in seq)
+
+        assert align_barcode_parasail(seq, qual, comparison_sequence, bc_len) == (
+            _reference_barcode(seq, qual, comparison_sequence, bc_len)
+        )
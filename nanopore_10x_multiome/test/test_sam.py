@@ -2,9 +2,17 @@
 Generated with cursor/claude-3.5-sonnet and then fixed to actually work
 """
 
+import array
 import pytest
 import os
-from nanopore_10x_multiome.utils._sam import sam_comment_to_tag
+import pysam
+from nanopore_10x_multiome.utils import _sam
+from nanopore_10x_multiome.utils._sam import (
+    sam_comment_to_tag,
+    bam_comment_to_tag,
+    comment_tags
+)
+from nanopore_10x_multiome.utils._bam import write_bam_record
 from tempfile import NamedTemporaryFile
 
 def test_sam_comment_to_tag_basic():
@@ -110,4 +118,87 @@ def test_sam_comment_to_tag_invalid_input():
             "output.sam",
             comment_prefix=['CB='],
             tag_prefix=['CB:Z:', 'extra']  # Mismatched lengths
-        )
\ No newline at end of file
+        )
+
+def test_sam_comment_to_tag_chunks(tmp_path, monkeypatch):
+    in_file = str(tmp_path / "in.sam")
+
+    with open(in_file, 'w') as fh:
+        fh.write("@HD\tVN:1.6\n")
+        for i in range(50):
+            fh.write(f"read{i}\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\t####\tATAC CB=ACG{i} XCB=TT UB=\n")
+
+    sam_comment_to_tag(in_file, str(tmp_path / "single.sam"))
+
+    monkeypatch.setattr(_sam, 'SAM_CHUNK_SIZE', 100)
+    sam_comment_to_tag(in_file, str(tmp_path / "chunks.sam"), n_jobs=2)
+
+    with open(tmp_path / "single.sam") as fh:
+        lines = fh.readlines()
+
+    with open(tmp_path / "chunks.sam") as fh:
+        assert fh.readlines() == lines
+
+    assert len(lines) == 51
+    assert lines[1] == "read0\t4\t*\t0\t0\t*\t*\t0\t0\tACGT\t####\tCB:Z:ACG0\tUB:Z:\tATAC CB=ACG0 XCB=TT UB=\n"
+
+
+def test_comment_tags():
+    tags, rest = comment_tags("ATAC CB=ACGT-1 CR=ACGT XI:i:5 XF:f:0.5 XB:B:S,1,2 CB=TTTT XX:i:bad")
+
+    assert tags == {
+        'CB': ('ACGT-1', 'Z'),
+        'CR': ('ACGT', 'Z'),
+        'XI': (5, 'i'),
+        'XF': (0.5, 'f'),
+        'XB': (array.array('H', [1, 2]), 'B')
+    }
+    assert rest == ['ATAC', 'CB=TTTT', 'XX:i:bad']
+
+    tags, rest = comment_tags("CB=ACGT XI:i:5", keys={'CB', 'XI'}, sam_tags=False)
+    assert tags == {'CB': ('ACGT', 'Z')}
+    assert rest == ['XI:i:5']
+
+    # Keys which aren't SAM tags, and bad types or array subtypes,
+    # are left in the comment
+    tags, rest = comment_tags(
+        "runid=abc 1X=a CBB=a CB=ACGT XX:B:q,1 XQ:Q:1 XA:A:c"
+    )
+    assert tags == {'CB': ('ACGT', 'Z'), 'XA': ('c', 'A')}
+    assert rest == ['runid=abc', '1X=a', 'CBB=a', 'XX:B:q,1', 'XQ:Q:1']
+
+
+@pytest.mark.parametrize("out_name", ["out.bam", "out.sam", "out.cram"])
+def test_bam_comment_to_tag(tmp_path, out_name):
+    in_file = str(tmp_path / "in.bam")
+    out_file = str(tmp_path / out_name)
+
+    with pysam.AlignmentFile(in_file, "wb", header={'HD': {'VN': '1.6'}}) as out:
+        write_bam_record(out, "read1", "ACGT", "####", flag=4, CO="ATAC CB=ACGT-1 CR=ACGT CY=#### XI:i:5 runid=abc")
+        write_bam_record(out, "read2", "ACGT", "####", flag=4, CO="CB=TTTT-1 UB=AAAA")
+        write_bam_record(out, "read3", "ACGT", "####", flag=4, ch=2)
+
+    assert bam_comment_to_tag(in_file, out_file, threads=2, write_threads=2) == (3, 2)
+
+    with pysam.AlignmentFile(out_file, check_sq=False) as fh:
+        records = list(fh.fetch(until_eof=True))
+
+    assert [r.query_name for r in records] == ['read1', 'read2', 'read3']
+    assert dict(records[0].get_tags()) == {
+        'CO': 'ATAC XI:i:5 runid=abc',
+        'CB': 'ACGT-1',
+        'CR': 'ACGT',
+        'CY': '####'
+    }
+    assert dict(records[1].get_tags()) == {'CB': 'TTTT-1', 'UB': 'AAAA'}
+    assert dict(records[2].get_tags()) == {'ch': 2}
+
+    # All keys, keeping the comment
+    bam_comment_to_tag(in_file, out_file, keys=None, remove_comment=False)
+
+    with pysam.AlignmentFile(out_file, check_sq=False) as fh:
+        record = next(fh.fetch(until_eof=True))
+
+    assert record.get_tag('XI') == 5
+    assert not record.has_tag('ru')
+    assert record.get_tag('CO') == "ATAC CB=ACGT-1 CR=ACGT CY=#### XI:i:5 runid=abc"
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from nanopore_10x_multiome.utils import SeedPrefilter, pigeonhole_seeds
+from nanopore_10x_multiome.atac import tenx_re, tenx_prefilter, TENX_ATAC_ADAPTER
+from nanopore_10x_multiome.gex import gex_re, gex_prefilter, TENX_GEX_ADAPTER
+
+
+def test_pigeonhole_seeds():
+
+    assert pigeonhole_seeds('ACGTACGTAC', 2) == ['ACGTA', 'CGTAC']
+    assert pigeonhole_seeds('ACGTACGTAC', 3) == ['ACG', 'TAC', 'GTAC']
+    assert ''.join(pigeonhole_seeds('CGCGTCTGTCGTCGGCAGCG', 4)) == 'CGCGTCTGTCGTCGGCAGCG'
+
+    with pytest.raises(ValueError):
+        pigeonhole_seeds('ACG', 4)
+
+
+def test_prefilter_windows():
+
+    prefilter = SeedPrefilter('AAAACCCC', 1, 10)
+
+    assert prefilter.seeds == ['AAAA', 'CCCC']
+    assert prefilter.windows('G' * 100) == []
+    assert not prefilter.has_seed('G' * 100)
+
+    seq = 'G' * 50 + 'CCCC' + 'G' * 50 + 'aaaa' + 'G' * 50
+    assert prefilter.has_seed(seq)
+    assert prefilter.windows(seq) == [(40, 64), (94, 118)]
+
+    # Overlapping windows are merged
+    seq = 'G' * 50 + 'CCCC' + 'G' * 5 + 'AAAA' + 'G' * 50
+    assert prefilter.windows(seq) == [(40, 73)]
+
+    assert prefilter.windows(seq, 45, 60) == [(45, 60)]
+
+
+def _random_seq(rng, n):
+    return ''.join(rng.choice('ACGT') for _ in range(n))
+
+
+def _mutate(rng, seq, n):
+
+    seq = list(seq)
+
+    for _ in range(n):
+        i = rng.randrange(len(seq))
+        op = rng.randrange(3)
+
+        if op == 0:
+            seq[i] = rng.choice('ACGT')
+        elif op == 1:
+            seq.insert(i, rng.choice('ACGT'))
+        else:
+            del seq[i]
+
+    return ''.join(seq)
+
+
+@pytest.mark.parametrize("compiled_regex, prefilter, adapter", [
+    (tenx_re, tenx_prefilter, TENX_ATAC_ADAPTER),
+    (gex_re, gex_prefilter, TENX_GEX_ADAPTER)
+])
+def test_prefilter_same_matches(compiled_regex, prefilter, adapter):
+
+    rng = random.Random(10)
+
+    for _ in range(300):
+        seq = _random_seq(rng, rng.randrange(50, 300))
+
+        # Insert adapters with random barcodes and errors
+        for _ in range(rng.randrange(3)):
+            _adapter = ''.join(
+                rng.choice('ACGT') if c == 'N' else c
+                for c in adapter
+            )
+            i = rng.randrange(len(seq))
+            seq = seq[:i] + _mutate(rng, _adapter, rng.randrange(7)) + seq[i:]
+
+        expected = compiled_regex.search(seq)
+        result = prefilter.search(compiled_regex, seq)
+
+        if expected is None:
+            assert result is None
+        else:
+            assert result.span() == expected.span()
+            assert result.groups() == expected.groups()
@@ -1,9 +1,20 @@
+import array
 import tempfile
 import pysam
+import pytest
 import os
+from io import BytesIO, StringIO
 from pathlib import Path
 
-from nanopore_10x_multiome.utils import get_file_writer, fastqProcessor
+from nanopore_10x_multiome.utils import (
+    get_file_writer,
+    fastqProcessor,
+    ReadBatch,
+    format_fastq_record,
+    format_fastq_batch,
+    get_batch_writer,
+    sam_tag
+)
 
 
 TEST_FILE = os.path.join(Path(__file__).parent.absolute(), 'TEST_READS.fastq')
@@ -110,4 +121,137 @@ def test_fastq_writer_tags():
 
                     assert ' CB=ATGC' in line1[0][0]
                     assert ' CR=ATTC' in line1[0][0]
-                    assert ' CY=II4I' in line1[0][0]
\ No newline at end of file
+                    assert ' CY=II4I' in line1[0][0]
+
+def _print_fastq_record(out_fh, header, seq, qual, **tags):
+
+    # Reference implementation with four print calls
+    for k, v in tags.items():
+        if v is not None:
+            header = f"{header} {k}={v}"
+
+    print(header, file=out_fh)
+    print(seq, file=out_fh)
+    print("+", file=out_fh)
+    print(qual, file=out_fh)
+
+
+def _test_records():
+
+    processor = fastqProcessor(
+        verify_ids=False,
+        phred_type='raw'
+    )
+
+    with open(TEST_FILE, mode='r') as fastqfile:
+        return [x[0] for x in processor.fastq_gen(fastqfile)]
+
+
+TEST_TAGS = [
+    {},
+    {'CB': 'ATGC', 'CR': 'ATTC', 'CY': 'II4I'},
+    {'CB': None, 'CR': 'ATTC', 'CY': 'II4I'},
+    {'CB': None}
+]
+
+
+def test_fastq_writer_identical():
+
+    records = _test_records()
+    tags = [TEST_TAGS[i % len(TEST_TAGS)] for i in range(len(records))]
+
+    expected = StringIO()
+    for (c, s, q), t in zip(records, tags):
+        _print_fastq_record(expected, c, s, q, **t)
+
+    # One record per call
+    written = StringIO()
+    writer = get_file_writer('out.fastq')
+    for (c, s, q), t in zip(records, tags):
+        writer(written, c, s, q, **t)
+
+    assert written.getvalue() == expected.getvalue()
+
+    # Whole batches on a binary handle
+    written = BytesIO()
+    writer = get_batch_writer('out.fastq')
+    writer(
+        written,
+        ReadBatch.from_lists(*[list(x) for x in zip(*records[:20])]),
+        tags[:20]
+    )
+    writer(
+        written,
+        ReadBatch.from_lists(*[list(x) for x in zip(*records[20:])]),
+        tags[20:]
+    )
+    writer(written, ReadBatch.empty())
+
+    assert written.getvalue() == expected.getvalue().encode()
+
+
+def test_sam_tag():
+
+    assert sam_tag('CB', 'ACGT') == 'CB:Z:ACGT'
+    assert sam_tag('ch', 12) == 'ch:i:12'
+    assert sam_tag('du', 1.5) == 'du:f:1.5'
+    assert sam_tag('mv', array.array('B', [5, 1, 0])) == 'mv:B:C,5,1,0'
+    assert sam_tag('ts', [1, 2]) == 'ts:B:i,1,2'
+
+
+def test_fastq_array_comments():
+
+    header = format_fastq_record(
+        '@read1',
+        'ACGT',
+        'IIII',
+        {'ML': array.array('B', [10, 200]), 'ts': [1, 2], 'ch': 7}
+    ).split('\n')[0]
+
+    assert header == '@read1 ML=10,200 ts=1,2 ch=7'
+
+
+def test_fastq_writer_sam_comments():
+
+    records = _test_records()
+    tags = [TEST_TAGS[i % len(TEST_TAGS)] for i in range(len(records))]
+
+    written = StringIO()
+    writer = get_file_writer('out.fastq', comment_format='sam')
+    for (c, s, q), t in zip(records, tags):
+        writer(written, c, s, q, **t)
+
+    # Same records with tab separated SAM tags in the header
+    batch = ReadBatch.from_lists(*[list(x) for x in zip(*records)])
+    assert written.getvalue() == format_fastq_batch(batch, tags, 'sam')
+
+    header = format_fastq_record(
+        '@read1',
+        'ACGT',
+        'IIII',
+        {'CB': 'ACGT', 'CR': 'ACTT', 'CY': 'II I', 'UB': None},
+        'sam'
+    ).split('\n')[0]
+
+    assert header == '@read1\tCB:Z:ACGT\tCR:Z:ACTT\tCY:Z:II I'
+
+    # Only comment fields that are SAM tags are kept, and tags set
+    # here replace them
+    header = format_fastq_record(
+        '@read1 runid=abc ch:i:5\tRG:Z:run 1\tCB:Z:TTTT\tXX:i:x ML:B:C,1,2',
+        'ACGT',
+        'IIII',
+        {'CB': 'ACGT'},
+        'sam'
+    ).split('\n')[0]
+
+    assert header == '@read1\tch:i:5\tRG:Z:run 1\tML:B:C,1,2\tCB:Z:ACGT'
+    assert format_fastq_record('@read1 OTHER', 'A', 'I', None, 'sam') == (
+        '@read1\nA\n+\nI\n'
+    )
+
+    with pytest.raises(ValueError):
+        get_file_writer('out.fastq', comment_format='nope')
+
+    with pytest.raises(ValueError):
+        get_batch_writer('out.fastq', comment_format='nope')
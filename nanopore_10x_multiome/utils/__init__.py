@@ -1,3 +1,5 @@
+import functools
+import io
 import pysam
 import gzip as gz
 
@@ -6,16 +8,74 @@ from ._fastq import (
     fastq_gen,
     fastqProcessor,
     convert_qual_illumina,
-    write_fastq_record
+    fastq_batch_gen,
+    fastq_read_batches,
+    write_fastq_record,
+    write_fastq_batch,
+    format_fastq_record,
+    format_fastq_batch,
+    COMMENT_FORMATS,
+    check_comment_format,
+    sam_tag
+)
+
+from ._batch import (
+    ReadBatch
+)
+
+from ._fastq_index import (
+    FastqIndex,
+    build_fastq_index,
+    load_fastq_index,
+    fastq_shards,
+    open_fastq_shard
+)
+
+from ._threads import (
+    BatchWriterThread,
+    ThreadedGzipReader
+)
+
+from ._bgzf import (
+    BgzfReader,
+    BgzfWriter,
+    BGZF_COMPRESS_LEVEL,
+    is_bgzf,
+    open_bgzf_writer,
+    open_gzip_reader
 )
 
 from ._bam import (
     write_bam_record,
-    split_bam_by_barcode
+    write_bam_batch,
+    split_bam_by_barcode,
+    bam_read_batches,
+    open_bam_reader,
+    open_ubam_writer,
+    write_ubam_batch,
+    encode_ubam_batch,
+    ubam_header,
+    bam_tag,
+    BAM_READ_THREADS,
+    BAM_WRITE_THREADS,
+    POSITIONAL_TAGS
 )
 
 from ._sam import (
-    sam_comment_to_tag
+    sam_comment_to_tag,
+    bam_comment_to_tag,
+    comment_tags,
+    BARCODE_COMMENT_KEYS,
+    COMMENT_TAG
+)
+
+from ._barcode_sidecar import (
+    BarcodeSidecar,
+    BarcodeSidecarWriter,
+    merge_sidecars,
+    tag_bam_from_sidecar,
+    read_id_hashes,
+    SIDECAR_KEYS
 )
 
 from ._sequence import (
@@ -24,11 +84,49 @@ from ._sequence import (
 )
 
 from ._parasail_barcode import (
-    get_barcode_parasail
+    get_barcode_parasail,
+    get_barcode_parasail_span,
+    align_barcode_parasail,
+    align_barcodes_parasail,
+    AlignmentCache,
+    ALIGNMENT_CACHE,
+    ALIGNMENT_CACHE_SIZE
 )
 
+from ._myers import (
+    FlankedPattern,
+    MyersBatch,
+    PatternScanner,
+    SEARCH_BACKENDS,
+    check_search_backend,
+    myers_distances,
+    approximate_matches,
+    fuzzy_match_end
+)
 
-def file_opener(file_name, mode='r', file_format=None, gzip=False, header=None):
+from ._end_windows import (
+    END_WINDOW_COUNTERS,
+    EndWindowSearch,
+    end_windows
+)
+
+from ._seed_prefilter import (
+    SeedPrefilter,
+    pigeonhole_seeds,
+    search_windows
+)
+
+
+def file_opener(
+    file_name,
+    mode='r',
+    file_format=None,
+    gzip=False,
+    header=None,
+    shard=None,
+    threads=1,
+    compresslevel=BGZF_COMPRESS_LEVEL
+):
 
     if file_format is None:
         if file_name.endswith('.bam'):
@@ -41,12 +139,54 @@ def file_opener(file_name, mode='r', file_format=None, gzip=False, header=None):
         else:
             raise ValueError(f"Unknown file format: {file_name}")
 
+    # Open one (start, stop) shard of an indexed FASTQ file
+    # as a binary handle
+    if shard is not None:
+        if file_format != 'fastq' or 'r' not in mode:
+            raise ValueError("Shards can only be opened from FASTQ files for reading")
+
+        return open_fastq_shard(file_name, *shard, threads=threads)
+
     if file_format == 'bam':
         if 'b' not in mode:
             mode = mode + 'b'
 
+        # Unaligned BAM has no reference sequences to check
+        if 'r' in mode:
+            return open_bam_reader(file_name, threads=threads)
+
+        # Without a header template, write unaligned BAM
+        # for write_ubam_batch, compressed on separate threads
+        elif header is None and 'w' in mode:
+            return open_ubam_writer(
+                file_name,
+                threads=threads,
+                compresslevel=compresslevel
+            )
+
         return pysam.AlignmentFile(file_name, mode, header=header)
     
+    # Decompress gzipped input on separate threads
+    # Text mode if 't' is in mode, like gzip.open
+    elif gzip and 'r' in mode and threads > 0:
+        if 't' in mode:
+            return io.TextIOWrapper(
+                open_gzip_reader(file_name, threads=threads),
+                encoding='utf-8'
+            )
+
+        return open_gzip_reader(file_name, threads=threads)
+
+    # Write gzipped output as BGZF, compressed on separate threads
+    # Text mode unless 'b' is in mode
+    elif gzip and ('w' in mode or 'a' in mode):
+        return open_bgzf_writer(
+            file_name,
+            mode=mode,
+            compresslevel=compresslevel,
+            threads=threads
+        )
+
     elif gzip:
         return gz.open(file_name, mode=mode)
     
@@ -54,7 +194,7 @@ def file_opener(file_name, mode='r', file_format=None, gzip=False, header=None):
         return open(file_name, mode)
 
 
-def get_file_writer(file_name=None, file_format=None):
+def get_file_writer(file_name=None, file_format=None, comment_format=None):
 
     if file_format is None:
         if file_name.endswith('.bam'):
@@ -66,9 +206,45 @@ def get_file_writer(file_name=None, file_format=None):
         else:
             raise ValueError(f"Unknown file format: {file_name}")
 
+    # Writes one record per call; batches of records are written
+    # with one write each by the writers from get_batch_writer
     if file_format == 'fastq':
+        if comment_format is not None:
+            check_comment_format(comment_format)
+            return functools.partial(
+                write_fastq_record,
+                comment_format=comment_format
+            )
+
         return write_fastq_record
     elif file_format == 'bam':
         return write_bam_record
     else:
         raise ValueError(f"Unknown file format: {file_format}")
+
+
+def get_batch_writer(file_name=None, file_format=None, comment_format=None):
+
+    if file_format is None:
+        if file_name.endswith('.bam'):
+            file_format = 'bam'
+        elif file_name.endswith('.fastq.gz'):
+            file_format = 'fastq'
+        elif file_name.endswith('.fastq'):
+            file_format = 'fastq'
+        else:
+            raise ValueError(f"Unknown file format: {file_name}")
+
+    if file_format == 'fastq':
+        if comment_format is not None:
+            check_comment_format(comment_format)
+            return functools.partial(
+                write_fastq_batch,
+                comment_format=comment_format
+            )
+
+        return write_fastq_batch
+    elif file_format == 'bam':
+        return write_ubam_batch
+    else:
+        raise ValueError(f"Unknown file format: {file_format}")
@@ -1,10 +1,381 @@
+import array
+import importlib.metadata
+import itertools
 import os
+import struct
+import sys
 from collections import Counter
 
+import numpy as np
 import pysam
 import tqdm
 import pandas as pd
 
+from ._batch import ReadBatch
+from ._bgzf import BGZF_COMPRESS_LEVEL, open_bgzf_writer
+from ._fastq import FASTQ_BLOCK_SIZE
+
+# BGZF decompression threads for reading BAM input
+BAM_READ_THREADS = 4
+
+# BGZF compression threads for writing unaligned BAM output
+BAM_WRITE_THREADS = 4
+
+# Tags that refer to positions in the read sequence (base modifications
+# and the basecaller move table), which are wrong for a trimmed read
+POSITIONAL_TAGS = ('MM', 'ML', 'MN', 'Mm', 'Ml', 'mv')
+
+### Unaligned BAM records ###
+# Records are packed straight from ReadBatch buffers: fixed fields
+# for an unmapped read (refID -1, pos -1, bin 4680, flag 4), the read
+# name, 4-bit sequence codes, qualities without the +33 offset, then tags
+_BAM_MAGIC = b'BAM\x01'
+_BAM_RECORD = struct.Struct('<iiiBBHHHiiii')
+_BAM_UNMAPPED = 0x4
+_BAM_UNMAPPED_BIN = 4680
+
+# =ACMGRSVTWYHKDBN to 0-15, anything else to N
+_BAM_SEQ_CODES = np.full(256, 15, dtype=np.uint8)
+
+for _i, _base in enumerate('=ACMGRSVTWYHKDBN'):
+    _BAM_SEQ_CODES[ord(_base)] = _i
+    _BAM_SEQ_CODES[ord(_base.lower())] = _i
+
+# array.array typecodes to BAM B array subtypes
+_BAM_ARRAY_TYPES = {
+    'b': 'c', 'B': 'C', 'h': 's', 'H': 'S',
+    'i': 'i', 'I': 'I', 'l': 'i', 'L': 'I', 'f': 'f'
+}
+
+# BAM B array subtypes to struct formats
+_BAM_ARRAY_FORMATS = {
+    'c': 'b', 'C': 'B', 's': 'h', 'S': 'H', 'i': 'i', 'I': 'I', 'f': 'f'
+}
+
+# Secondary and supplementary records repeat a read
+_BAM_SKIP_FLAGS = 0x100 | 0x800
+
+
+def open_bam_reader(file_name, threads=BAM_READ_THREADS):
+    """
+    Open a BAM file (aligned or unaligned) for reading, decompressing
+    BGZF blocks on separate threads
+
+    :param file_name: BAM file path
+    :type file_name: str
+    :param threads: Number of decompression threads,
+        defaults to BAM_READ_THREADS
+    :type threads: int
+
+    :return: Open BAM file
+    :rtype: pysam.AlignmentFile
+    """
+
+    return pysam.AlignmentFile(
+        file_name,
+        'rb',
+        check_sq=False,
+        threads=threads
+    )
+
+
+def bam_read_batches(handle, block_size=None, keep_tags=False):
+    """
+    Read a BAM file in batches of reads, taking sequences and qualities
+    straight from the records. Reads are returned in their original
+    orientation, and secondary and supplementary records are skipped.
+
+    :param handle: Open BAM file
+    :type handle: pysam.AlignmentFile
+    :param block_size: Approximate number of bytes of header, sequence
+        and quality in each batch, defaults to FASTQ_BLOCK_SIZE
+    :type block_size: int, optional
+    :param keep_tags: Keep each record's tags in the batch ``tags``,
+        defaults to False
+    :type keep_tags: bool
+
+    :return: Batches of reads, with headers formatted as FASTQ headers
+    :rtype: Iterator[ReadBatch]
+    """
+
+    if block_size is None:
+        block_size = FASTQ_BLOCK_SIZE
+
+    headers, sequences, qualities = [], [], []
+    tags = [] if keep_tags else None
+    _size = 0
+
+    for r in handle.fetch(until_eof=True):
+
+        if r.flag & _BAM_SKIP_FLAGS:
+            continue
+
+        if r.is_reverse:
+            _seq = r.get_forward_sequence()
+            _qual = r.query_qualities_str
+            _qual = _qual[::-1] if _qual is not None else None
+        else:
+            _seq = r.query_sequence
+            _qual = r.query_qualities_str
+
+        if _seq is None:
+            _seq = ''
+
+        # Records without qualities get the lowest quality score
+        if _qual is None:
+            _qual = '!' * len(_seq)
+
+        headers.append('@' + r.query_name)
+        sequences.append(_seq)
+        qualities.append(_qual)
+
+        if keep_tags:
+            tags.append(dict(r.get_tags()))
+
+        _size += len(r.query_name) + 2 * len(_seq)
+
+        if _size >= block_size:
+            yield ReadBatch.from_lists(headers, sequences, qualities, tags=tags)
+
+            headers, sequences, qualities = [], [], []
+            tags = [] if keep_tags else None
+            _size = 0
+
+    if len(headers) > 0:
+        yield ReadBatch.from_lists(headers, sequences, qualities, tags=tags)
+
+def ubam_header(command_line=None):
+    """
+    Build the header of an unaligned BAM file, with an @HD line and
+    an @PG line for this package
+
+    :param command_line: Command line for the @PG CL field,
+        defaults to the running command
+    :type command_line: str, optional
+
+    :return: Encoded BAM header
+    :rtype: bytes
+    """
+
+    if command_line is None:
+        command_line = ' '.join(sys.argv)
+
+    _pg = ['@PG', 'ID:nanopore_10x_multiome', 'PN:nanopore_10x_multiome']
+
+    try:
+        _pg.append(
+            'VN:' + importlib.metadata.version('nanopore_10x_multiome')
+        )
+    except importlib.metadata.PackageNotFoundError:
+        pass
+
+    # Header fields can't have tabs or newlines
+    if command_line:
+        _pg.append('CL:' + ' '.join(command_line.split()))
+
+    _text = (
+        '@HD\tVN:1.6\tSO:unknown\n' + '\t'.join(_pg) + '\n'
+    ).encode('utf-8')
+
+    return b''.join([
+        _BAM_MAGIC,
+        struct.pack('<i', len(_text)),
+        _text,
+        # No reference sequences
+        struct.pack('<i', 0)
+    ])
+
+
+def open_ubam_writer(
+    file_name,
+    threads=BAM_WRITE_THREADS,
+    compresslevel=BGZF_COMPRESS_LEVEL,
+    command_line=None
+):
+    """
+    Open an unaligned BAM file for writing with ``write_ubam_batch``,
+    compressing BGZF blocks on separate threads. The header is
+    written when the file is opened.
+
+    :param file_name: BAM file path
+    :type file_name: str
+    :param threads: Number of compression threads,
+        defaults to BAM_WRITE_THREADS
+    :type threads: int
+    :param compresslevel: zlib compression level (0-9), defaults to 6
+    :type compresslevel: int
+    :param command_line: Command line for the @PG header line,
+        defaults to the running command
+    :type command_line: str, optional
+
+    :return: Binary file handle
+    :rtype: io.BufferedWriter
+    """
+
+    handle = open_bgzf_writer(
+        file_name,
+        mode='wb',
+        compresslevel=compresslevel,
+        threads=threads
+    )
+
+    handle.write(ubam_header(command_line))
+
+    return handle
+
+
+def bam_tag(key, value):
+    """
+    Encode a tag as a BAM auxiliary field, with the type from the value
+    the same way as ``sam_tag``: i for integers, f for floats, B for
+    arrays and Z for anything else
+
+    :param key: Two character tag
+    :type key: str
+    :param value: Tag value
+    :type value: str, int, float, array.array, list
+
+    :return: Encoded tag
+    :rtype: bytes
+    """
+
+    _key = key.encode('ascii')
+
+    if isinstance(value, (bool, int)):
+        return _key + b'i' + struct.pack('<i', int(value))
+
+    elif isinstance(value, float):
+        return _key + b'f' + struct.pack('<f', value)
+
+    elif isinstance(value, (array.array, list, tuple)):
+
+        if isinstance(value, array.array):
+            _type = _BAM_ARRAY_TYPES.get(value.typecode, 'f')
+        else:
+            _type = 'f' if any(isinstance(x, float) for x in value) else 'i'
+
+        return b''.join([
+            _key,
+            b'B',
+            _type.encode('ascii'),
+            struct.pack(
+                f'<i{len(value)}{_BAM_ARRAY_FORMATS[_type]}',
+                len(value),
+                *value
+            )
+        ])
+
+    return _key + b'Z' + str(value).encode('utf-8') + b'\x00'
+
+
+def encode_ubam_batch(batch, tags=None):
+    """
+    Encode a batch of reads as unaligned BAM records. Sequences and
+    qualities are converted for the whole batch at once, and read names
+    are headers without the leading @ and without any comment.
+
+    :param batch: Reads
+    :type batch: ReadBatch
+    :param tags: Tags for each read, None values are skipped,
+        defaults to None
+    :type tags: list(dict), optional
+
+    :return: Encoded records
+    :rtype: bytes
+    """
+
+    n = len(batch)
+
+    if n == 0:
+        return b''
+
+    lengths = batch.lengths
+    _offsets = batch.offsets - batch.offsets[0]
+
+    # Sequence codes laid out with one padding code after
+    # each odd length read, then packed two to a byte
+    _packed_offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum((lengths + 1) // 2, out=_packed_offsets[1:])
+
+    _codes = np.zeros(2 * _packed_offsets[-1], dtype=np.uint8)
+    _codes[
+        np.arange(_offsets[-1]) +
+        np.repeat(2 * _packed_offsets[:-1] - _offsets[:-1], lengths)
+    ] = _BAM_SEQ_CODES[batch.sequence_array()]
+
+    packed = ((_codes[0::2] << 4) | _codes[1::2]).tobytes()
+    quals = (batch.quality_array() - 33).tobytes()
+
+    if tags is None:
+        tags = itertools.repeat(None)
+
+    records = []
+
+    for i, (header, _tags) in enumerate(zip(batch.headers(), tags)):
+
+        # Read name is the header up to the first whitespace
+        _name = header[1:] if header.startswith('@') else header
+        _name = _name.split(maxsplit=1)[0] if _name.strip() else '*'
+        _name = _name.encode('utf-8') + b'\x00'
+
+        if _tags:
+            _tags = b''.join([
+                bam_tag(k, v)
+                for k, v in _tags.items()
+                if v is not None
+            ])
+        else:
+            _tags = b''
+
+        _len = int(lengths[i])
+        _seq = slice(int(_packed_offsets[i]), int(_packed_offsets[i + 1]))
+        _qual = slice(int(_offsets[i]), int(_offsets[i + 1]))
+
+        records.extend((
+            _BAM_RECORD.pack(
+                32 + len(_name) + (_seq.stop - _seq.start) + _len + len(_tags),
+                -1,
+                -1,
+                len(_name),
+                0,
+                _BAM_UNMAPPED_BIN,
+                0,
+                _BAM_UNMAPPED,
+                _len,
+                -1,
+                -1,
+                0
+            ),
+            _name,
+            packed[_seq],
+            quals[_qual],
+            _tags
+        ))
+
+    return b''.join(records)
+
+
+def write_ubam_batch(
+    handle,
+    batch,
+    tags=None
+):
+    """
+    Write a batch of reads to an unaligned BAM file opened with
+    ``open_ubam_writer``
+
+    :param handle: Open unaligned BAM file
+    :type handle: io.BufferedWriter
+    :param batch: Reads
+    :type batch: ReadBatch
+    :param tags: Tags for each read, None values are skipped,
+        defaults to None
+    :type tags: list(dict), optional
+    """
+
+    handle.write(encode_ubam_batch(batch, tags))
+
+
 def write_bam_record(
     handle,
     header,
@@ -28,6 +399,25 @@ def write_bam_record(
     handle.write(a)
 
 
+def write_bam_batch(
+    handle,
+    batch,
+    tags=None
+):
+
+    if tags is None:
+        tags = itertools.repeat({})
+
+    for (header, sequence, qual), _tags in zip(batch, tags):
+        write_bam_record(
+            handle,
+            header,
+            sequence,
+            qual,
+            **_tags
+        )
+
+
 def bam_summarize_barcodes(
     bam_file,
     pbar=False,
@@ -0,0 +1,551 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pysam
+
+from ._bam import BAM_READ_THREADS, BAM_WRITE_THREADS
+
+### Read ID -> barcode sidecar store ###
+# Barcode tags of split reads are kept out of FASTQ headers and written
+# to a directory of .npy arrays instead: sorted 64-bit hashes of read IDs,
+# and one fixed-width bytes array per tag in the same order
+# Aligned files are tagged afterwards by looking up each record's name
+
+# Tags stored in a sidecar
+SIDECAR_KEYS = ('CB', 'CR', 'CY', 'UB', 'UR', 'UY')
+
+SIDECAR_IDS = 'ids'
+
+# Number of records looked up at once when tagging a BAM file
+SIDECAR_LOOKUP_BATCH = 10000
+
+# Number of reads a BarcodeSidecarWriter keeps in memory before writing
+# them to a sorted chunk on disk, and about the number of reads merged
+# at once when the chunks are combined
+SIDECAR_CHUNK_SIZE = 1 << 20
+
+
+def read_id(header):
+    """
+    Get the read ID from a FASTQ header or BAM query name
+    (without the leading @ and anything after the first whitespace)
+
+    :param header: Read header
+    :type header: str
+
+    :return: Read ID
+    :rtype: str
+    """
+
+    if header.startswith('@'):
+        header = header[1:]
+
+    _id = header.split(maxsplit=1)
+
+    return _id[0] if len(_id) > 0 else ''
+
+
+def read_id_hashes(names):
+    """
+    Hash read IDs to 64-bit integers
+
+    :param names: FASTQ headers or BAM query names
+    :type names: list(str)
+
+    :return: Read ID hashes
+    :rtype: np.ndarray
+    """
+
+    return np.fromiter(
+        (
+            int.from_bytes(
+                hashlib.blake2b(
+                    read_id(x).encode('utf-8'),
+                    digest_size=8
+                ).digest(),
+                'little'
+            )
+            for x in names
+        ),
+        dtype=np.uint64,
+        count=len(names)
+    )
+
+
+class BarcodeSidecar:
+    """
+    Read-only read ID -> barcode tag store backed by sorted numpy arrays.
+
+    ``ids`` is a sorted array of read ID hashes (``read_id_hashes``) and
+    ``columns`` has a fixed-width bytes array for each tag, with an
+    empty value for reads that don't have that tag. The arrays can be
+    written to a directory and memory-mapped.
+
+    :param ids: Sorted read ID hashes
+    :type ids: np.ndarray
+    :param columns: Tag values for each read ID
+    :type columns: dict(str, np.ndarray)
+    """
+
+    def __init__(self, ids, columns):
+        self.ids = ids
+        self.columns = columns
+
+    @classmethod
+    def from_chunks(cls, ids, columns):
+        """
+        Build a sidecar from unsorted chunks of read IDs and tag values.
+        If a read ID is in the chunks more than once, its first tags
+        are kept.
+
+        :param ids: Chunks of read ID hashes
+        :type ids: list(np.ndarray)
+        :param columns: Chunks of tag values for each tag
+        :type columns: dict(str, list(np.ndarray))
+
+        :return: Sidecar
+        :rtype: BarcodeSidecar
+        """
+
+        if len(ids) == 0:
+            return cls(
+                np.zeros(0, dtype=np.uint64),
+                {k: np.zeros(0, dtype='S1') for k in columns}
+            )
+
+        ids = np.concatenate(ids)
+        ids, first = np.unique(ids, return_index=True)
+
+        return cls(
+            ids,
+            {k: np.concatenate(v)[first] for k, v in columns.items()}
+        )
+
+    def save(self, path):
+        """
+        Write the arrays to a directory as ``.npy`` files
+
+        :param path: Directory to write into (created if needed)
+        :type path: str
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        np.save(os.path.join(path, f'{SIDECAR_IDS}.npy'), self.ids)
+
+        for k, v in self.columns.items():
+            np.save(os.path.join(path, f'{k}.npy'), v)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r', keys=SIDECAR_KEYS):
+        """
+        Load a sidecar written with ``save``
+
+        :param path: Directory to read from
+        :type path: str
+        :param mmap_mode: Memory-map mode for ``np.load``, defaults to 'r'
+        :type mmap_mode: str, optional
+        :param keys: Tags to load if they are in the sidecar,
+            defaults to SIDECAR_KEYS
+        :type keys: tuple(str)
+
+        :return: Sidecar
+        :rtype: BarcodeSidecar
+        """
+
+        return cls(
+            np.load(
+                os.path.join(path, f'{SIDECAR_IDS}.npy'),
+                mmap_mode=mmap_mode
+            ),
+            {
+                k: np.load(os.path.join(path, f'{k}.npy'), mmap_mode=mmap_mode)
+                for k in keys
+                if os.path.exists(os.path.join(path, f'{k}.npy'))
+            }
+        )
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def find(self, names):
+        """
+        Find reads in the sidecar
+
+        :param names: FASTQ headers or BAM query names
+        :type names: list(str)
+
+        :return: Position of each read in the sidecar, -1 if it's missing
+        :rtype: np.ndarray
+        """
+
+        _hashes = read_id_hashes(names)
+
+        if len(self) == 0:
+            return np.full(len(names), -1, dtype=np.int64)
+
+        idx = np.minimum(np.searchsorted(self.ids, _hashes), len(self) - 1)
+
+        return np.where(self.ids[idx] == _hashes, idx, -1)
+
+    def tags(self, names, keys=None):
+        """
+        Look up the tags of reads
+
+        :param names: FASTQ headers or BAM query names
+        :type names: list(str)
+        :param keys: Tags to get, defaults to None (all tags in the sidecar)
+        :type keys: list(str), optional
+
+        :return: Dict of tags for each read (empty values are left out),
+            None for reads that aren't in the sidecar
+        :rtype: list(dict or None)
+        """
+
+        if keys is None:
+            keys = list(self.columns.keys())
+
+        idx = self.find(names)
+        _found = np.flatnonzero(idx >= 0)
+
+        _values = {
+            k: self.columns[k][idx[_found]].tolist()
+            for k in keys
+            if k in self.columns
+        }
+
+        tags = [None] * len(names)
+
+        for j, i in enumerate(_found):
+            tags[i] = {
+                k: v[j].decode('utf-8')
+                for k, v in _values.items()
+                if len(v[j]) > 0
+            }
+
+        return tags
+
+
+class BarcodeSidecarWriter:
+    """
+    Collect the barcode tags of split reads and write them to a
+    sidecar directory when closed. Tags are kept as fixed-width arrays
+    for each batch until ``chunk_size`` reads are collected, and are then
+    written to a sorted chunk in a scratch directory in the sidecar.
+    Closing merges the chunks a range of read IDs at a time, so memory
+    use doesn't grow with the number of reads.
+
+    :param path: Sidecar directory
+    :type path: str
+    :param keys: Tags to store, defaults to SIDECAR_KEYS
+    :type keys: tuple(str)
+    :param chunk_size: Reads kept in memory before they are written to
+        a chunk, defaults to SIDECAR_CHUNK_SIZE
+    :type chunk_size: int, optional
+    """
+
+    def __init__(self, path, keys=SIDECAR_KEYS, chunk_size=None):
+        self.path = path
+        self.keys = keys
+        self.chunk_size = (
+            chunk_size if chunk_size is not None else SIDECAR_CHUNK_SIZE
+        )
+
+        self._scratch = None
+        self._chunks = []
+        self._reset()
+
+    def _reset(self):
+        self._ids = []
+        self._columns = {k: [] for k in self.keys}
+        self._n = 0
+
+    def add(self, batch, tags):
+        """
+        Add the tags of a batch of reads
+
+        :param batch: Reads
+        :type batch: ReadBatch
+        :param tags: Tags of each read
+        :type tags: list(dict)
+        """
+
+        if len(batch) == 0:
+            return
+
+        self._ids.append(read_id_hashes(batch.headers()))
+
+        for k in self.keys:
+            self._columns[k].append(np.array(
+                [
+                    str(t[k]).encode('utf-8')
+                    if t.get(k) is not None else b''
+                    for t in tags
+                ],
+                dtype=bytes
+            ))
+
+        self._n += len(batch)
+
+        if self._n >= self.chunk_size:
+            self._write_chunk()
+
+    def strip(self, tags):
+        """
+        Remove the stored tags from tag dicts, so they aren't also
+        written to read headers
+
+        :param tags: Tags of each read
+        :type tags: list(dict) or None
+
+        :return: Tags of each read without the stored tags
+        :rtype: list(dict) or None
+        """
+
+        if tags is None:
+            return None
+
+        return [
+            {k: v for k, v in t.items() if k not in self.keys}
+            for t in tags
+        ]
+
+    def _write_chunk(self):
+
+        if self._n == 0:
+            return
+
+        if self._scratch is None:
+            os.makedirs(self.path, exist_ok=True)
+            self._scratch = tempfile.mkdtemp(dir=self.path, prefix='.chunks-')
+
+        _chunk = os.path.join(self._scratch, str(len(self._chunks)))
+        BarcodeSidecar.from_chunks(self._ids, self._columns).save(_chunk)
+
+        self._chunks.append(_chunk)
+        self._reset()
+
+    def close(self):
+
+        # Everything fit in memory
+        if self._scratch is None:
+            BarcodeSidecar.from_chunks(self._ids, self._columns).save(self.path)
+            self._reset()
+            return
+
+        self._write_chunk()
+
+        merge_sidecars(
+            [BarcodeSidecar.load(x, keys=self.keys) for x in self._chunks],
+            self.path,
+            keys=self.keys,
+            window_size=self.chunk_size
+        )
+
+        self._discard()
+
+    def _discard(self):
+
+        if self._scratch is not None:
+            shutil.rmtree(self._scratch)
+
+        self._scratch = None
+        self._chunks = []
+        self._reset()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        # Only write complete sidecars
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+
+def merge_sidecars(sidecars, path, keys=SIDECAR_KEYS, window_size=None):
+    """
+    Merge sidecars into one sidecar directory, one range of read ID
+    hashes at a time. If a read ID is in more than one sidecar, its tags
+    from the first sidecar are kept.
+
+    :param sidecars: Sidecars to merge
+    :type sidecars: list(BarcodeSidecar)
+    :param path: Directory to write into (created if needed)
+    :type path: str
+    :param keys: Tags to write, defaults to SIDECAR_KEYS
+    :type keys: tuple(str)
+    :param window_size: Approximate number of reads merged at once,
+        defaults to SIDECAR_CHUNK_SIZE
+    :type window_size: int, optional
+    """
+
+    if window_size is None:
+        window_size = SIDECAR_CHUNK_SIZE
+
+    # Hashes are uniform, so equal ranges hold about as many reads
+    _n_windows = max(-(-sum(len(x) for x in sidecars) // window_size), 1)
+    _bounds = [np.uint64((w << 64) // _n_windows) for w in range(_n_windows)]
+
+    def _windows():
+        for w in range(_n_windows):
+            _slices = [
+                (
+                    x,
+                    np.searchsorted(x.ids, _bounds[w]),
+                    np.searchsorted(x.ids, _bounds[w + 1])
+                    if w + 1 < _n_windows else len(x)
+                )
+                for x in sidecars
+            ]
+
+            ids, first = np.unique(
+                np.concatenate(
+                    [np.zeros(0, dtype=np.uint64)] +
+                    [x.ids[a:b] for x, a, b in _slices]
+                ),
+                return_index=True
+            )
+
+            yield _slices, ids, first
+
+    # The first pass counts the reads in the merged sidecar,
+    # the second writes them
+    _n = sum(len(ids) for _, ids, _ in _windows())
+
+    os.makedirs(path, exist_ok=True)
+
+    def _open(name, dtype):
+        return np.lib.format.open_memmap(
+            os.path.join(path, f'{name}.npy'),
+            mode='w+',
+            dtype=dtype,
+            shape=(_n, )
+        )
+
+    out_ids = _open(SIDECAR_IDS, np.uint64)
+    out_columns = {
+        k: _open(
+            k,
+            f"S{max([1] + [x.columns[k].dtype.itemsize for x in sidecars])}"
+        )
+        for k in keys
+    }
+
+    i = 0
+
+    for _slices, ids, first in _windows():
+        out_ids[i:i + len(ids)] = ids
+
+        for k, v in out_columns.items():
+            v[i:i + len(ids)] = np.concatenate(
+                [np.zeros(0, dtype='S1')] +
+                [x.columns[k][a:b] for x, a, b in _slices]
+            )[first]
+
+        i += len(ids)
+
+    out_ids.flush()
+
+    for v in out_columns.values():
+        v.flush()
+
+
+def tag_bam_from_sidecar(
+    bam_file,
+    sidecar_path,
+    output_file,
+    keys=None,
+    threads=BAM_READ_THREADS,
+    write_threads=BAM_WRITE_THREADS,
+    reference_filename=None
+):
+    """
+    Tag the records of a BAM or CRAM file with the barcodes of their
+    reads from a sidecar written by the splitter. Records are looked
+    up in batches by the hash of their query name.
+
+    Output format is from the output file extension (.cram, .sam or BAM).
+
+    :param bam_file: Path to input BAM or CRAM file
+    :type bam_file: str
+    :param sidecar_path: Sidecar directory
+    :type sidecar_path: str
+    :param output_file: Path to output file
+    :type output_file: str
+    :param keys: Tags to set, defaults to None (all tags in the sidecar)
+    :type keys: list(str), optional
+    :param threads: Number of decompression threads, defaults to
+        BAM_READ_THREADS
+    :type threads: int
+    :param write_threads: Number of compression threads, defaults to
+        BAM_WRITE_THREADS
+    :type write_threads: int
+    :param reference_filename: Reference FASTA for CRAM files,
+        defaults to None
+    :type reference_filename: str, optional
+
+    :return: Number of records written and number of records tagged
+    :rtype: int, int
+    """
+
+    sidecar = BarcodeSidecar.load(sidecar_path)
+
+    if output_file.endswith('.cram'):
+        _mode = 'wc'
+    elif output_file.endswith('.sam'):
+        _mode = 'w'
+    else:
+        _mode = 'wb'
+
+    n, n_tagged = 0, 0
+
+    with (
+        pysam.AlignmentFile(
+            bam_file,
+            'rc' if bam_file.endswith('.cram') else 'rb',
+            check_sq=False,
+            threads=threads,
+            reference_filename=reference_filename
+        ) as in_fh,
+        pysam.AlignmentFile(
+            output_file,
+            _mode,
+            template=in_fh,
+            threads=write_threads,
+            reference_filename=reference_filename
+        ) as out_fh
+    ):
+
+        def _tag(records):
+
+            tags = sidecar.tags([r.query_name for r in records], keys=keys)
+
+            for r, _tags in zip(records, tags):
+                if _tags:
+                    for k, v in _tags.items():
+                        r.set_tag(k, v, value_type='Z')
+
+                out_fh.write(r)
+
+            return sum(t is not None for t in tags)
+
+        records = []
+
+        for r in in_fh.fetch(until_eof=True):
+            records.append(r)
+
+            if len(records) >= SIDECAR_LOOKUP_BATCH:
+                n_tagged += _tag(records)
+                n += len(records)
+                records = []
+
+        n_tagged += _tag(records)
+        n += len(records)
+
+    return n, n_tagged
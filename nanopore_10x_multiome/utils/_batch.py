@@ -0,0 +1,351 @@
+import numpy as np
+
+
+class ReadBatch:
+    """
+    Columnar batch of reads.
+
+    Headers, sequences and qualities are each stored in one contiguous
+    bytes buffer, with offset arrays marking where each read starts and
+    stops. Sequences and qualities are the same length for every read,
+    so they share one offset array. Offsets are absolute positions in
+    the buffers, so slicing a batch only slices the offset arrays and
+    returns a view on the same buffers without copying any read data.
+
+    Sequences and qualities are encoded as latin-1 (one byte per
+    character), headers as UTF-8.
+
+    Reads from BAM files can also carry their input tags, as a list
+    with a dict of tags for each read (``tags``, None if there are none).
+    """
+
+    def __init__(
+        self,
+        headers,
+        header_offsets,
+        sequences,
+        qualities,
+        offsets,
+        tags=None
+    ):
+        self._headers = headers
+        self._sequences = sequences
+        self._qualities = qualities
+        self.header_offsets = header_offsets
+        self.offsets = offsets
+        self.tags = tags
+
+    @classmethod
+    def from_lists(cls, headers, sequences, qualities, tags=None):
+        """
+        Create a batch from lists of strings
+
+        :param headers: Read headers
+        :type headers: list(str)
+        :param sequences: Read sequences
+        :type sequences: list(str)
+        :param qualities: Read quality strings
+        :type qualities: list(str)
+        :param tags: Input tags of each read, defaults to None
+        :type tags: list(dict), optional
+
+        :return: Read batch
+        :rtype: ReadBatch
+        """
+
+        n = len(headers)
+
+        if (
+            len(sequences) != n or
+            len(qualities) != n or
+            (tags is not None and len(tags) != n)
+        ):
+            raise ValueError(
+                f"Batch fields have different numbers of reads: "
+                f"{n}, {len(sequences)}, {len(qualities)}"
+            )
+
+        offsets = _offsets(sequences)
+
+        if not np.array_equal(offsets, _offsets(qualities)):
+            raise ValueError(
+                "Sequence and quality lengths differ"
+            )
+
+        _headers = ''.join(headers).encode('utf-8')
+        header_offsets = _offsets(headers)
+
+        # Multi-byte characters in headers need byte offsets
+        if len(_headers) != header_offsets[-1]:
+            header_offsets = _offsets([h.encode('utf-8') for h in headers])
+
+        return cls(
+            _headers,
+            header_offsets,
+            ''.join(sequences).encode('latin-1'),
+            ''.join(qualities).encode('latin-1'),
+            offsets,
+            tags=tags
+        )
+
+    @classmethod
+    def empty(cls):
+        """
+        Create a batch with no reads
+
+        :return: Read batch
+        :rtype: ReadBatch
+        """
+
+        return cls.from_lists([], [], [])
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __reduce__(self):
+
+        # Only pickle the part of the buffers this batch covers,
+        # so slices sent to worker processes don't carry whole blocks
+        _h0, _h1 = int(self.header_offsets[0]), int(self.header_offsets[-1])
+        _s0, _s1 = int(self.offsets[0]), int(self.offsets[-1])
+
+        return ReadBatch, (
+            self._headers[_h0:_h1],
+            self.header_offsets - _h0,
+            self._sequences[_s0:_s1],
+            self._qualities[_s0:_s1],
+            self.offsets - _s0,
+            self.tags
+        )
+
+    def __iter__(self):
+        return zip(
+            self.headers(),
+            self.sequences(),
+            self.qualities()
+        )
+
+    def __getitem__(self, key):
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+
+            if step != 1:
+                raise ValueError(
+                    "ReadBatch slices must be contiguous; use take()"
+                )
+
+            stop = max(start, stop)
+
+            return ReadBatch(
+                self._headers,
+                self.header_offsets[start:stop + 1],
+                self._sequences,
+                self._qualities,
+                self.offsets[start:stop + 1],
+                self.tags[start:stop] if self.tags is not None else None
+            )
+
+        return self.header(key), self.sequence(key), self.quality(key)
+
+    def _index(self, i):
+        n = len(self)
+
+        if i < 0:
+            i += n
+
+        if i < 0 or i >= n:
+            raise IndexError(f"Read {i} out of range for batch of {n}")
+
+        return i
+
+    def header(self, i):
+        i = self._index(i)
+        return self._headers[
+            self.header_offsets[i]:self.header_offsets[i + 1]
+        ].decode('utf-8')
+
+    def sequence(self, i):
+        i = self._index(i)
+        return self._sequences[
+            self.offsets[i]:self.offsets[i + 1]
+        ].decode('latin-1')
+
+    def quality(self, i):
+        i = self._index(i)
+        return self._qualities[
+            self.offsets[i]:self.offsets[i + 1]
+        ].decode('latin-1')
+
+    def headers(self):
+        """
+        Decode all headers
+
+        :return: Read headers
+        :rtype: list(str)
+        """
+
+        _text = _decode_range(self._headers, self.header_offsets, 'utf-8')
+
+        # Offsets are byte positions, which only match
+        # string positions if every header is ASCII
+        if len(_text) != self.header_offsets[-1] - self.header_offsets[0]:
+            return [
+                self._headers[a:b].decode('utf-8')
+                for a, b in _pairs(self.header_offsets)
+            ]
+
+        return _split_range(_text, self.header_offsets)
+
+    def sequences(self):
+        """
+        Decode all sequences
+
+        :return: Read sequences
+        :rtype: list(str)
+        """
+
+        return _split_range(
+            _decode_range(self._sequences, self.offsets, 'latin-1'),
+            self.offsets
+        )
+
+    def qualities(self):
+        """
+        Decode all quality strings
+
+        :return: Read quality strings
+        :rtype: list(str)
+        """
+
+        return _split_range(
+            _decode_range(self._qualities, self.offsets, 'latin-1'),
+            self.offsets
+        )
+
+    def sequence_array(self):
+        """
+        Get the sequences of all reads, concatenated, without copying
+
+        :return: Sequence bytes
+        :rtype: np.ndarray
+        """
+
+        return _view(self._sequences, self.offsets)
+
+    def quality_array(self):
+        """
+        Get the quality strings of all reads, concatenated,
+        without copying
+
+        :return: Quality bytes (with the +33 offset)
+        :rtype: np.ndarray
+        """
+
+        return _view(self._qualities, self.offsets)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        return (
+            int(self.header_offsets[-1] - self.header_offsets[0]) +
+            2 * int(self.offsets[-1] - self.offsets[0])
+        )
+
+    def take(self, indices, starts=None, stops=None):
+        """
+        Copy a subset of reads into a new batch, optionally keeping
+        only part of each read. Read parts are given as positions
+        within each read, and are clipped to the read length.
+
+        :param indices: Reads to take
+        :type indices: np.ndarray, list(int)
+        :param starts: Start position of the part of each read to keep,
+            defaults to None (the start of the read)
+        :type starts: np.ndarray, list(int), optional
+        :param stops: Stop position of the part of each read to keep,
+            defaults to None (the end of the read)
+        :type stops: np.ndarray, list(int), optional
+
+        :return: Read batch
+        :rtype: ReadBatch
+        """
+
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        indices = np.where(indices < 0, indices + len(self), indices)
+
+        _h_starts = self.header_offsets[indices]
+        _h_stops = self.header_offsets[indices + 1]
+
+        _starts = self.offsets[indices]
+        _stops = self.offsets[indices + 1]
+
+        if stops is not None:
+            _stops = np.minimum(
+                _starts + np.asarray(stops, dtype=np.int64),
+                _stops
+            )
+
+        if starts is not None:
+            _starts = np.minimum(
+                _starts + np.asarray(starts, dtype=np.int64),
+                _stops
+            )
+
+        offsets = _lengths_to_offsets(_stops - _starts)
+        _starts, _stops = _starts.tolist(), _stops.tolist()
+
+        return ReadBatch(
+            _gather(self._headers, _h_starts.tolist(), _h_stops.tolist()),
+            _lengths_to_offsets(_h_stops - _h_starts),
+            _gather(self._sequences, _starts, _stops),
+            _gather(self._qualities, _starts, _stops),
+            offsets,
+            [self.tags[i] for i in indices] if self.tags is not None else None
+        )
+
+
+def _offsets(values):
+    return _lengths_to_offsets(
+        np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    )
+
+
+def _lengths_to_offsets(lengths):
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _pairs(offsets):
+    _offsets = offsets.tolist()
+    return zip(_offsets[:-1], _offsets[1:])
+
+
+def _view(buffer, offsets):
+    return np.frombuffer(
+        buffer,
+        dtype=np.uint8,
+        count=int(offsets[-1] - offsets[0]),
+        offset=int(offsets[0])
+    )
+
+
+def _decode_range(buffer, offsets, encoding):
+    return buffer[offsets[0]:offsets[-1]].decode(encoding)
+
+
+def _split_range(text, offsets):
+    _base = int(offsets[0])
+    return [
+        text[a - _base:b - _base]
+        for a, b in _pairs(offsets)
+    ]
+
+
+def _gather(buffer, starts, stops):
+    _view = memoryview(buffer)
+    return b''.join([_view[a:b] for a, b in zip(starts, stops)])
@@ -0,0 +1,452 @@
+import collections
+import io
+import itertools
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from ._threads import ThreadedGzipReader, READER_CHUNK_SIZE
+
+### BGZF (blocked gzip) reading ###
+# BGZF files are concatenated gzip members of at most 64KB of data,
+# with the compressed member size stored in a BC extra subfield
+# Positions are virtual offsets: compressed block start << 16 | offset
+# in the decompressed block
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+# Empty block that marks the end of a BGZF file
+BGZF_EOF = bytes.fromhex(
+    '1f8b08040000000000ff0600424302001b0003000000000000000000'
+)
+
+_HEADER_SIZE = 12
+
+# Maximum uncompressed data in a written block (same as htslib)
+BGZF_BLOCK_SIZE = 0xff00
+
+# Default compression level (zlib's default, also used by htslib)
+BGZF_COMPRESS_LEVEL = 6
+
+
+def make_virtual_offset(block_offset, within_block_offset):
+    return (block_offset << 16) | within_block_offset
+
+
+def split_virtual_offset(virtual_offset):
+    return virtual_offset >> 16, virtual_offset & 0xFFFF
+
+
+def is_bgzf(file_name):
+    """
+    Check if a file is BGZF compressed from the first block header
+
+    :param file_name: File path
+    :type file_name: str
+
+    :return: True if the file starts with a BGZF block
+    :rtype: bool
+    """
+
+    with open(file_name, mode='rb') as fh:
+        try:
+            _bsize(fh.read(_HEADER_SIZE), fh.read)
+        except ValueError:
+            return False
+
+    return True
+
+
+def _bsize(header, read):
+
+    if len(header) < _HEADER_SIZE or header[:4] != BGZF_MAGIC:
+        raise ValueError("Not a BGZF block")
+
+    xlen, = struct.unpack('<H', header[10:12])
+    extra = read(xlen)
+
+    # Find the BC subfield with the block size
+    i = 0
+    while i + 4 <= len(extra):
+        _slen, = struct.unpack('<H', extra[i + 2:i + 4])
+
+        if extra[i:i + 2] == b'BC' and _slen == 2:
+            return struct.unpack('<H', extra[i + 4:i + 6])[0], extra
+
+        i += 4 + _slen
+
+    raise ValueError("BGZF block has no BC subfield")
+
+
+def read_bgzf_block(fh):
+    """
+    Read one compressed BGZF block from a binary file handle
+
+    :param fh: Binary file handle positioned at the start of a block
+    :type fh: io.BufferedIOBase
+
+    :return: Compressed block bytes, or None at end of file
+    :rtype: bytes or None
+    """
+
+    header = fh.read(_HEADER_SIZE)
+
+    if len(header) == 0:
+        return None
+
+    bsize, extra = _bsize(header, fh.read)
+    rest = fh.read(bsize + 1 - _HEADER_SIZE - len(extra))
+
+    if len(rest) != bsize + 1 - _HEADER_SIZE - len(extra):
+        raise ValueError("Truncated BGZF block")
+
+    return header + extra + rest
+
+
+def inflate_bgzf_block(block):
+    """
+    Decompress one BGZF block
+
+    :param block: Compressed block from ``read_bgzf_block``
+    :type block: bytes
+
+    :return: Decompressed data
+    :rtype: bytes
+    """
+
+    xlen, = struct.unpack('<H', block[10:12])
+    isize, = struct.unpack('<I', block[-4:])
+
+    data = zlib.decompress(
+        block[_HEADER_SIZE + xlen:-8],
+        wbits=-15
+    )
+
+    if len(data) != isize:
+        raise ValueError(
+            f"BGZF block decompressed to {len(data)} bytes, expected {isize}"
+        )
+
+    return data
+
+
+def deflate_bgzf_block(data, compresslevel=BGZF_COMPRESS_LEVEL):
+    """
+    Compress data into one BGZF block
+
+    :param data: Data to compress, at most ``BGZF_BLOCK_SIZE`` bytes
+    :type data: bytes
+    :param compresslevel: zlib compression level (0-9)
+    :type compresslevel: int
+
+    :return: Compressed block
+    :rtype: bytes
+    """
+
+    _compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    cdata = _compressor.compress(data) + _compressor.flush()
+
+    # Gzip header with a BC extra subfield holding the block size - 1
+    header = struct.pack(
+        '<4sIBBHBBHH',
+        BGZF_MAGIC,
+        0,
+        0,
+        255,
+        6,
+        ord('B'),
+        ord('C'),
+        2,
+        _HEADER_SIZE + 6 + len(cdata) + 8 - 1
+    )
+
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def bgzf_blocks(fh):
+    """
+    Iterate over compressed BGZF blocks
+
+    :param fh: Binary file handle positioned at the start of a block
+    :type fh: io.BufferedIOBase
+
+    :return: Generator of (block file offset, compressed block)
+    :rtype: generator((int, bytes))
+    """
+
+    while True:
+        _offset = fh.tell()
+        block = read_bgzf_block(fh)
+
+        if block is None:
+            return
+
+        yield _offset, block
+
+
+def open_gzip_reader(file_name, threads=1):
+    """
+    Open a gzip file for reading with decompression on separate threads.
+    BGZF files are inflated block by block in a pool of ``threads``
+    threads, other gzip files are inflated by one background thread.
+
+    :param file_name: Gzip file path
+    :type file_name: str
+    :param threads: Number of decompression threads, defaults to 1
+    :type threads: int
+
+    :return: Binary file handle
+    :rtype: io.BufferedReader
+    """
+
+    if is_bgzf(file_name):
+        raw = BgzfReader(open(file_name, mode='rb'), threads=threads)
+    else:
+        raw = ThreadedGzipReader(open(file_name, mode='rb'))
+
+    return io.BufferedReader(raw, buffer_size=READER_CHUNK_SIZE)
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    Raw binary reader for decompressed BGZF data between two virtual
+    offsets. Wrap in ``io.BufferedReader`` for efficient reads.
+
+    Blocks are independent, so with ``threads`` set they are inflated
+    in a thread pool (zlib releases the GIL) while the caller parses
+    data that was already decompressed.
+
+    :param fh: Binary file handle of a BGZF file
+    :type fh: io.BufferedIOBase
+    :param start: Virtual offset to start reading from, defaults to 0
+    :type start: int
+    :param stop: Virtual offset to stop reading at, defaults to None
+        (end of file)
+    :type stop: int or None
+    :param close_fh: Close the file handle when this reader is closed
+    :type close_fh: bool
+    :param threads: Number of decompression threads, defaults to 0
+        (decompress in the calling thread)
+    :type threads: int
+    """
+
+    def __init__(self, fh, start=0, stop=None, close_fh=True, threads=0):
+        self._fh = fh
+        self._close_fh = close_fh
+        self._stop = split_virtual_offset(stop) if stop is not None else None
+
+        _block_offset, _within = split_virtual_offset(start)
+        self._fh.seek(_block_offset)
+        self._blocks = self._compressed_blocks()
+
+        # Blocks submitted for decompression and not read yet
+        self._pool = ThreadPoolExecutor(threads) if threads > 0 else None
+        self._pending = collections.deque()
+        self._max_pending = 4 * threads
+
+        self._data = b''
+        self._pos = 0
+
+        self._next_block()
+        self._pos = min(_within, len(self._data))
+
+    def _compressed_blocks(self):
+
+        for _offset, block in bgzf_blocks(self._fh):
+
+            if self._stop is None or _offset < self._stop[0]:
+                yield block, None
+
+            else:
+                if _offset == self._stop[0]:
+                    yield block, self._stop[1]
+
+                return
+
+    def _next_block(self):
+
+        if self._pool is None:
+            try:
+                block, limit = next(self._blocks)
+            except StopIteration:
+                self._data = b''
+                return False
+
+            self._data = inflate_bgzf_block(block)[:limit]
+
+        else:
+            for block, limit in itertools.islice(
+                self._blocks,
+                self._max_pending - len(self._pending)
+            ):
+                self._pending.append(
+                    (self._pool.submit(inflate_bgzf_block, block), limit)
+                )
+
+            if len(self._pending) == 0:
+                self._data = b''
+                return False
+
+            future, limit = self._pending.popleft()
+            self._data = future.result()[:limit]
+
+        self._pos = 0
+        return True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+
+        # Skip over empty blocks (including the EOF marker)
+        while self._pos >= len(self._data):
+            if not self._next_block():
+                return 0
+
+        n = min(len(b), len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+
+        return n
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+
+        if self._close_fh and not self.closed:
+            self._fh.close()
+
+        super().close()
+
+
+def open_bgzf_writer(
+    file_name,
+    mode='w',
+    compresslevel=BGZF_COMPRESS_LEVEL,
+    threads=1
+):
+    """
+    Open a BGZF file for writing with compression on separate threads
+
+    :param file_name: Output file path
+    :type file_name: str
+    :param mode: File mode; 'w' or 'a' for text, 'wb' or 'ab' for binary
+    :type mode: str
+    :param compresslevel: zlib compression level (0-9), defaults to 6
+    :type compresslevel: int
+    :param threads: Number of compression threads, defaults to 1
+    :type threads: int
+
+    :return: Text or binary file handle
+    :rtype: io.TextIOWrapper or io.BufferedWriter
+    """
+
+    fh = open(file_name, mode='ab' if 'a' in mode else 'wb')
+
+    handle = io.BufferedWriter(
+        BgzfWriter(fh, compresslevel=compresslevel, threads=threads),
+        buffer_size=READER_CHUNK_SIZE
+    )
+
+    if 'b' in mode:
+        return handle
+    else:
+        return io.TextIOWrapper(handle, encoding='utf-8', newline='\n')
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Raw binary writer that compresses data into BGZF blocks.
+
+    With ``threads`` set, blocks are deflated in a thread pool
+    (zlib releases the GIL) and written in order, with a bounded number
+    of blocks in flight. An empty EOF block is written on close.
+    The output is a standard multi-member gzip file and can be indexed
+    for random access.
+
+    :param fh: Binary file handle to write to
+    :type fh: io.BufferedIOBase
+    :param compresslevel: zlib compression level (0-9), defaults to 6
+    :type compresslevel: int
+    :param threads: Number of compression threads, defaults to 1
+        (0 compresses in the calling thread)
+    :type threads: int
+    :param close_fh: Close the file handle when this writer is closed
+    :type close_fh: bool
+    """
+
+    def __init__(
+        self,
+        fh,
+        compresslevel=BGZF_COMPRESS_LEVEL,
+        threads=1,
+        close_fh=True
+    ):
+        self._fh = fh
+        self._close_fh = close_fh
+        self.compresslevel = compresslevel
+
+        self._buffer = bytearray()
+
+        # Blocks submitted for compression and not written yet
+        self._pool = ThreadPoolExecutor(threads) if threads > 0 else None
+        self._pending = collections.deque()
+        self._max_pending = 4 * threads
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+
+        self._buffer += b
+
+        # Compress all full blocks
+        n = len(self._buffer) // BGZF_BLOCK_SIZE * BGZF_BLOCK_SIZE
+
+        if n > 0:
+            with memoryview(self._buffer) as _view:
+                for i in range(0, n, BGZF_BLOCK_SIZE):
+                    self._submit(bytes(_view[i:i + BGZF_BLOCK_SIZE]))
+
+            del self._buffer[:n]
+
+        return len(b)
+
+    def _submit(self, data):
+
+        if self._pool is None:
+            self._fh.write(deflate_bgzf_block(data, self.compresslevel))
+            return
+
+        self._pending.append(
+            self._pool.submit(deflate_bgzf_block, data, self.compresslevel)
+        )
+
+        while len(self._pending) > self._max_pending:
+            self._fh.write(self._pending.popleft().result())
+
+    def close(self):
+
+        if self.closed:
+            return
+
+        try:
+            if len(self._buffer) > 0:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+
+            while len(self._pending) > 0:
+                self._fh.write(self._pending.popleft().result())
+
+            self._fh.write(BGZF_EOF)
+
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+
+            if self._close_fh:
+                self._fh.close()
+            else:
+                self._fh.flush()
+
+            super().close()
@@ -0,0 +1,136 @@
+import collections
+
+### End window adapter search ###
+# Adapters of 10x preamp libraries sit near read ends, so on long reads only
+# the first and last bases are searched. Reads where the end windows miss are
+# searched in full, unless they are longer than a per-read length budget
+
+# Counters kept by EndWindowSearch
+END_WINDOW_COUNTERS = (
+    'end_window_reads',
+    'end_window_hits',
+    'fallback_reads',
+    'fallback_hits',
+    'over_budget_reads'
+)
+
+
+def end_windows(n, window):
+    """
+    Get the windows at both ends of a read
+
+    :param n: Read length
+    :type n: int
+    :param window: Number of bases to search at each end
+    :type window: int
+
+    :return: (start, end) windows, or None if the windows would cover
+        the whole read
+    :rtype: list((int, int)) or None
+    """
+
+    if n <= 2 * window:
+        return None
+
+    return [(0, window), (n - window, n)]
+
+
+class EndWindowSearch:
+    """
+    Adapter search strategy that first searches the first and last
+    ``window`` bases of each read, and only searches the whole read if
+    the end windows have no match.
+
+    Reads longer than ``max_search_length`` are never searched in full.
+    How often each case happens is kept in ``counts``.
+
+    The windows are the same on both strands, so they can be used on
+    the reverse complement of a read as well.
+
+    :param window: Number of bases to search at each end of a read
+    :type window: int
+    :param max_search_length: Longest read that is searched in full if
+        its end windows have no match, defaults to None (no limit)
+    :type max_search_length: int, optional
+    """
+
+    def __init__(self, window, max_search_length=None):
+
+        if window < 1:
+            raise ValueError(
+                f"End window must be at least 1 base; {window} provided"
+            )
+
+        self.window = window
+        self.max_search_length = max_search_length
+        self.counts = collections.Counter(
+            {k: 0 for k in END_WINDOW_COUNTERS}
+        )
+
+    def windows(self, seqs):
+        """
+        Get end windows for a list of reads
+
+        :param seqs: Read sequences
+        :type seqs: list(str)
+
+        :return: End windows of each read, None for reads that are
+            short enough to search in full
+        :rtype: list(list((int, int)) or None)
+        """
+
+        _windows = [end_windows(len(seq), self.window) for seq in seqs]
+
+        self.counts['end_window_reads'] += sum(
+            x is not None for x in _windows
+        )
+
+        return _windows
+
+    def fallback(self, seqs, windows, found):
+        """
+        Get the reads to search in full after an end window search
+
+        :param seqs: Read sequences
+        :type seqs: list(str)
+        :param windows: End windows from ``windows``
+        :type windows: list(list((int, int)) or None)
+        :param found: Adapters were found in each read
+        :type found: list(bool)
+
+        :return: Indices of reads to search in full
+        :rtype: list(int)
+        """
+
+        _fallback = []
+
+        for i, (seq, _windows, _found) in enumerate(zip(seqs, windows, found)):
+
+            if _windows is None:
+                continue
+
+            if _found:
+                self.counts['end_window_hits'] += 1
+
+            elif (
+                self.max_search_length is not None and
+                len(seq) > self.max_search_length
+            ):
+                self.counts['over_budget_reads'] += 1
+
+            else:
+                _fallback.append(i)
+
+        self.counts['fallback_reads'] += len(_fallback)
+
+        return _fallback
+
+    def fallback_found(self, found):
+        """
+        Count reads that had adapters in the full search
+
+        :param found: Adapters were found in each fallback read
+        :type found: list(bool)
+        """
+
+        self.counts['fallback_hits'] += sum(found)
@@ -1,5 +1,41 @@
 ### Pure python FASTQ parser ###
 
+import array
+import codecs
+import io
+import itertools
+import re
+
+from ._batch import ReadBatch
+
+# Number of characters to read from a file handle at once
+FASTQ_BLOCK_SIZE = 1 << 22
+
+# Formats for tags in FASTQ header comments
+# 'key=value' - space separated CB=ACGT comments
+# 'sam' - tab separated CB:Z:ACGT SAM tags, which minimap2 -y copies
+#   into alignments as they are. Comments that aren't SAM tags are dropped
+COMMENT_FORMATS = ('key=value', 'sam')
+
+# A SAM optional field (TAG:TYPE:VALUE) with a value of the right type
+_SAM_NUMBER = r'[-+]?[0-9]*\.?[0-9]+(?:[eE][-+]?[0-9]+)?'
+_SAM_FIELD_RE = re.compile(
+    r'[A-Za-z][A-Za-z0-9]:(?:'
+    r'A:[!-~]|'
+    r'i:[-+]?[0-9]+|'
+    rf'f:{_SAM_NUMBER}|'
+    r'Z:[ !-~]*|'
+    r'H:(?:[0-9A-F][0-9A-F])*|'
+    rf'B:[cCsSiIf](?:,{_SAM_NUMBER})*'
+    r')'
+)
+
+# SAM B array subtypes for array.array typecodes
+_SAM_ARRAY_TYPES = {
+    'b': 'c', 'B': 'C', 'h': 's', 'H': 'S',
+    'i': 'i', 'I': 'I', 'l': 'i', 'L': 'I', 'f': 'f'
+}
+
 # Converts a quality ASCII string to a list of qualities
 # This is the 33-offset illumina quality scoring
 def convert_qual_illumina(qstr):
@@ -19,6 +55,100 @@ def fastq_gen(fh, phred_type='illumina'):
         yield rec[0]
 
 
+# Reads large blocks from a file handle and splits them into records
+# Yields batches as three lists of (headers, sequences, qualities)
+# Works on text or binary handles, binary data is decoded as UTF-8
+def fastq_batch_gen(fh, block_size=None):
+
+    if block_size is None:
+        block_size = FASTQ_BLOCK_SIZE
+
+    decoder = None
+
+    # Complete lines of an unfinished record and the partial
+    # line at the end of the last block
+    leftover_lines = []
+    partial = ''
+
+    while True:
+        block = fh.read(block_size)
+        _eof = len(block) == 0
+
+        if isinstance(block, bytes):
+            # Incremental decoder handles characters split between blocks
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            block = decoder.decode(block, final=_eof)
+
+        if _eof:
+            break
+
+        if partial.endswith('\r'):
+            block = partial + block
+            partial = ''
+
+        if '\r' in block:
+            block = block.replace('\r\n', '\n')
+
+        lines = block.split('\n')
+        lines[0] = partial + lines[0]
+
+        if len(leftover_lines) > 0:
+            lines = leftover_lines + lines
+
+        # The last line is incomplete (or empty if the block ended
+        # with a newline), so only complete records are used
+        n = (len(lines) - 1) // 4 * 4
+
+        leftover_lines = lines[n:-1]
+        partial = lines[-1]
+
+        if n == 0:
+            continue
+
+        yield _split_fastq_lines(lines, n)
+
+    # Last record may not end with a newline
+    lines = leftover_lines + [partial.rstrip('\r')]
+
+    while len(lines) > 0 and len(lines[-1]) == 0:
+        lines.pop()
+
+    n = len(lines) // 4 * 4
+
+    if n > 0:
+        yield _split_fastq_lines(lines, n)
+
+
+# Wrapper for fastq_batch_gen that yields ReadBatch objects
+def fastq_read_batches(fh, block_size=None):
+    for batch in fastq_batch_gen(fh, block_size=block_size):
+        yield ReadBatch.from_lists(*batch)
+
+
+def _split_fastq_lines(lines, n):
+
+    headers = lines[0:n:4]
+    separators = lines[2:n:4]
+
+    # Every record is checked, so a record with extra or missing lines
+    # raises instead of shifting the rest of the block
+    if not (
+        all(h.startswith('@') for h in headers) and
+        all(x.startswith('+') for x in separators)
+    ):
+        i = next(
+            i for i, (h, x) in enumerate(zip(headers, separators))
+            if not (h.startswith('@') and x.startswith('+'))
+        )
+
+        raise ValueError(
+            f"Malformed FASTQ record: {headers[i]} / {separators[i]}"
+        )
+
+    return headers, lines[1:n:4], lines[3:n:4]
+
+
 # The fastqProcessor class takes an arbitrary number of linked reads and
 # yields a list of tuples for each sequence
 # The list is in the same order as the files that were given as arguments
@@ -46,38 +176,44 @@ class fastqProcessor:
 
     def fastq_gen(self, *fhs):
 
-        i = 0
-        while True:
+        # Flatten batches from the block reader into records
+        readers = [
+            itertools.chain.from_iterable(
+                zip(*batch)
+                for batch in fastq_batch_gen(fh)
+            )
+            for fh in fhs
+        ]
 
-            try:
-                record = []
-                cid = None
-                for fh in fhs:
-                    (c, s, q) = self.fastq_process_file(fh, self.phred)
+        i = 0
+        for records in zip(*readers):
 
-                    # If verify_ids was set, assert that the sequence IDs
-                    # all match
-                    if self.verify and cid is not None:
-                        try:
-                            assert c.startswith(cid)
-                        except AssertionError:
-                            print(f"ID mismatch (Record {i}): {cid} != {c}")
-                            raise
+            record = []
+            cid = None
+            for (c, s, q) in records:
 
-                    if self.verify:
-                        cid = self.extract_control_id(c)
+                # If verify_ids was set, assert that the sequence IDs
+                # all match
+                if self.verify and cid is not None:
+                    try:
+                        assert c.startswith(cid)
+                    except AssertionError:
+                        print(f"ID mismatch (Record {i}): {cid} != {c}")
+                        raise
 
-                    record.append((c, s, q))
+                if self.verify:
+                    cid = self.extract_control_id(c)
 
-                i += 1
-                yield record
+                record.append((c, s, self.phred(q)))
 
-                if self.n_records is not None and (i >= self.n_records):
-                    break
+            i += 1
+            yield record
 
-            except StopIteration:
+            if self.n_records is not None and (i >= self.n_records):
                 break
 
+    # Line-by-line parser for a single record
+    # Kept for API compatibility, fastq_gen uses fastq_batch_gen
     @staticmethod
     def fastq_process_file(fh, phred):
         cont, seq, qual = None, None, None
@@ -105,19 +241,188 @@ class fastqProcessor:
             return None
 
 
+# Writes one record with a single write call
+# Works on text or binary handles
 def write_fastq_record(
     out_fh,
     header,
     seq,
     qual,
+    comment_format='key=value',
     **tags
 ):
 
-    for k, v in tags.items():
-        if v is not None:
-            header = f"{header} {k}={v}"
+    _write(
+        out_fh,
+        format_fastq_record(header, seq, qual, tags, comment_format)
+    )
+
+
+# Writes a whole ReadBatch with a single write call
+# Tags are a list of dicts (one per read) or None
+# Output is identical to calling write_fastq_record on each read
+def write_fastq_batch(
+    out_fh,
+    batch,
+    tags=None,
+    comment_format='key=value'
+):
+
+    _write(out_fh, format_fastq_batch(batch, tags, comment_format))
+
+
+# Formats one record as a string, tags are added to the header
+# as key=value (or SAM tags) for any tags that aren't None
+def format_fastq_record(header, seq, qual, tags=None, comment_format='key=value'):
+
+    if tags or comment_format == 'sam':
+        header = _tag_header(header, tags or {}, comment_format)
+
+    return f"{header}\n{seq}\n+\n{qual}\n"
+
+
+# Formats a whole ReadBatch as one string
+def format_fastq_batch(batch, tags=None, comment_format='key=value'):
+
+    n = len(batch)
+
+    if n == 0:
+        return ''
+
+    headers = batch.headers()
+
+    # Comments that aren't SAM tags are removed from every header
+    if comment_format == 'sam':
+        headers = [
+            _tag_header(h, t or {}, comment_format)
+            for h, t in zip(
+                headers,
+                tags if tags is not None else itertools.repeat(None)
+            )
+        ]
+
+    elif tags is not None:
+        headers = [
+            _tag_header(h, t, comment_format) if t else h
+            for h, t in zip(headers, tags)
+        ]
+
+    # Interleave the four lines of each record and join them once
+    lines = [None] * (4 * n)
+    lines[0::4] = headers
+    lines[1::4] = batch.sequences()
+    lines[2::4] = ['+'] * n
+    lines[3::4] = batch.qualities()
+    lines.append('')
+
+    return '\n'.join(lines)
+
+
+def _tag_header(header, tags, comment_format='key=value'):
+
+    # minimap2 -y copies the whole comment into alignments, so only
+    # the read ID and comment fields that are SAM tags are kept
+    if comment_format == 'sam':
+        _id, *_comment = header.split(maxsplit=1)
+
+        return '\t'.join([_id] + [
+            x for x in _sam_comment_fields(*_comment)
+            if x[:2] not in tags
+        ] + [
+            sam_tag(k, v)
+            for k, v in tags.items()
+            if v is not None
+        ])
+
+    return ''.join([f"{header}"] + [
+        f" {k}={_comment_value(v)}"
+        for k, v in tags.items()
+        if v is not None
+    ])
+
+
+# Fields of a header comment that are SAM tags; tab separated fields,
+# or space separated tokens of fields that aren't SAM tags
+def _sam_comment_fields(comment=''):
+
+    fields = []
+
+    for field in comment.split('\t'):
+        if _SAM_FIELD_RE.fullmatch(field):
+            fields.append(field)
+        else:
+            fields.extend(
+                x for x in field.split()
+                if _SAM_FIELD_RE.fullmatch(x)
+            )
+
+    return fields
+
+
+# Arrays (from BAM B tags) are written as comma-separated values,
+# so there are no spaces in a key=value comment
+def _comment_value(value):
+
+    if isinstance(value, (array.array, list, tuple)):
+        return ','.join([str(x) for x in value])
+
+    return value
+
+
+def sam_tag(key, value):
+    """
+    Format a tag as a SAM optional field (TAG:TYPE:VALUE), with the
+    type from the value: i for integers, f for floats, B for arrays
+    and Z for anything else
+
+    :param key: Two character tag
+    :type key: str
+    :param value: Tag value
+    :type value: str, int, float, array.array, list
+
+    :return: SAM tag
+    :rtype: str
+    """
+
+    if isinstance(value, (bool, int)):
+        return f"{key}:i:{int(value)}"
+
+    elif isinstance(value, float):
+        return f"{key}:f:{value}"
+
+    elif isinstance(value, array.array):
+        return f"{key}:B:" + ','.join(
+            [_SAM_ARRAY_TYPES.get(value.typecode, 'f')] +
+            [str(x) for x in value]
+        )
+
+    elif isinstance(value, (list, tuple)):
+        _type = 'f' if any(isinstance(x, float) for x in value) else 'i'
+        return f"{key}:B:" + ','.join([_type] + [str(x) for x in value])
+
+    return f"{key}:Z:{value}"
+
+
+def check_comment_format(comment_format):
+    """
+    Check that a comment format is supported
+
+    :param comment_format: Comment format
+    :type comment_format: str
+
+    :raises ValueError: The comment format isn't in COMMENT_FORMATS
+    """
+
+    if comment_format not in COMMENT_FORMATS:
+        raise ValueError(
+            f"comment_format must be one of {COMMENT_FORMATS}; "
+            f"{comment_format} provided"
+        )
+
+
+def _write(out_fh, text):
 
-    print(header, file=out_fh)
-    print(seq, file=out_fh)
-    print("+", file=out_fh)
-    print(qual, file=out_fh)
+    if isinstance(out_fh, io.TextIOBase):
+        out_fh.write(text)
+    else:
+        out_fh.write(text.encode('utf-8'))
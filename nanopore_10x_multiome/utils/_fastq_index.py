@@ -0,0 +1,396 @@
+import io
+import logging
+import os
+
+import numpy as np
+
+from ._bgzf import (
+    BgzfReader,
+    bgzf_blocks,
+    inflate_bgzf_block,
+    is_bgzf,
+    make_virtual_offset
+)
+
+### Record-aligned byte offset index for FASTQ files ###
+# Stores the offset of every N-th record start, so a file can be split
+# into shards of whole records without reading it first
+# Offsets are virtual offsets for BGZF files
+
+# Records between indexed offsets
+FASTQ_INDEX_INTERVAL = 10000
+
+FASTQ_INDEX_SUFFIX = '.fqi'
+
+_INDEX_BLOCK_SIZE = 1 << 22
+
+logger = logging.getLogger(__name__)
+
+
+class FastqIndex:
+    """
+    Offsets of every ``interval``-th record start in a FASTQ file.
+    ``offsets[i]`` is the start of record ``i * interval``; for BGZF
+    files it is a virtual offset.
+
+    :param offsets: Record start offsets
+    :type offsets: np.ndarray
+    :param interval: Number of records between offsets
+    :type interval: int
+    :param n_records: Total number of records in the file
+    :type n_records: int
+    :param file_size: Size of the indexed file in bytes
+    :type file_size: int
+    :param bgzf: Offsets are BGZF virtual offsets
+    :type bgzf: bool
+    :param file_mtime: Modification time of the indexed file in
+        nanoseconds, defaults to None (unknown)
+    :type file_mtime: int, optional
+    """
+
+    def __init__(
+        self,
+        offsets,
+        interval,
+        n_records,
+        file_size,
+        bgzf=False,
+        file_mtime=None
+    ):
+        self.offsets = offsets
+        self.interval = interval
+        self.n_records = n_records
+        self.file_size = file_size
+        self.bgzf = bgzf
+        self.file_mtime = file_mtime
+
+    def __len__(self):
+        return self.offsets.shape[0]
+
+    def save(self, index_file):
+        """
+        Write the index as a numpy ``.npz`` archive
+
+        :param index_file: Index file path
+        :type index_file: str
+        """
+
+        # Write through a handle so numpy doesn't add a .npz suffix
+        with open(index_file, mode='wb') as fh:
+            np.savez(
+                fh,
+                offsets=self.offsets,
+                interval=self.interval,
+                n_records=self.n_records,
+                file_size=self.file_size,
+                bgzf=self.bgzf,
+                file_mtime=-1 if self.file_mtime is None else self.file_mtime
+            )
+
+    @classmethod
+    def load(cls, index_file):
+        """
+        Read an index written by ``save``
+
+        :param index_file: Index file path
+        :type index_file: str
+
+        :return: FASTQ index
+        :rtype: FastqIndex
+        """
+
+        with np.load(index_file) as data:
+
+            # Indexes written without a modification time are never current
+            if 'file_mtime' in data.files and int(data['file_mtime']) >= 0:
+                _mtime = int(data['file_mtime'])
+            else:
+                _mtime = None
+
+            return cls(
+                data['offsets'],
+                int(data['interval']),
+                int(data['n_records']),
+                int(data['file_size']),
+                bool(data['bgzf']),
+                file_mtime=_mtime
+            )
+
+    def is_current(self, file_name):
+        """
+        Check that the index was built for the current version of a
+        file, by its size and modification time
+
+        :param file_name: FASTQ file path
+        :type file_name: str
+
+        :return: True if the size and modification time match
+        :rtype: bool
+        """
+
+        _stat = os.stat(file_name)
+
+        return (
+            self.file_size == _stat.st_size and
+            self.file_mtime == _stat.st_mtime_ns
+        )
+
+    def shards(self, records_per_shard=None, n_shards=None):
+        """
+        Split the indexed file into shards of whole records. Shard
+        boundaries are always indexed offsets, so shard sizes are
+        rounded to a multiple of the index interval.
+
+        :param records_per_shard: Number of records in each shard
+        :type records_per_shard: int, optional
+        :param n_shards: Number of (approximately equal) shards,
+            used if records_per_shard is not set
+        :type n_shards: int, optional
+
+        :return: List of (start, stop) offsets, where stop is None
+            for the last shard
+        :rtype: list((int, int or None))
+        """
+
+        if records_per_shard is not None:
+            _step = max(records_per_shard // self.interval, 1)
+        elif n_shards is not None:
+            _step = max(int(np.ceil(len(self) / n_shards)), 1)
+        else:
+            raise ValueError("Set records_per_shard or n_shards")
+
+        _starts = [int(x) for x in self.offsets[::_step]]
+
+        return list(zip(_starts, _starts[1:] + [None]))
+
+
+def fastq_index_file(file_name):
+    return file_name + FASTQ_INDEX_SUFFIX
+
+
+def build_fastq_index(
+    file_name,
+    interval=FASTQ_INDEX_INTERVAL,
+    index_file=None,
+    save=True
+):
+    """
+    Index record start offsets in a FASTQ or BGZF FASTQ file in one
+    pass. Records are expected to be four lines each.
+
+    :param file_name: FASTQ file path (``.fastq`` or BGZF ``.fastq.gz``)
+    :type file_name: str
+    :param interval: Number of records between indexed offsets
+    :type interval: int
+    :param index_file: Index file path, defaults to ``{file_name}.fqi``
+    :type index_file: str, optional
+    :param save: Write the index to index_file, keeping it in memory
+        only if index_file can't be written
+    :type save: bool
+
+    :return: FASTQ index
+    :rtype: FastqIndex
+    """
+
+    _bgzf = file_name.endswith('.gz')
+
+    if _bgzf and not is_bgzf(file_name):
+        raise ValueError(
+            f"{file_name} is gzip compressed but not BGZF; "
+            "only uncompressed or BGZF files can be indexed"
+        )
+
+    _line_step = 4 * interval
+    _mtime = os.stat(file_name).st_mtime_ns
+
+    offsets = [0]
+    n_lines = 0
+
+    with open(file_name, mode='rb') as fh:
+        for block_offset, data in _index_blocks(fh, _bgzf):
+
+            _newlines = np.flatnonzero(
+                np.frombuffer(data, dtype=np.uint8) == 10
+            )
+
+            # Record starts are the positions after every
+            # (4 * interval)-th newline
+            _first = _line_step - (n_lines % _line_step) - 1
+            _starts = _newlines[_first::_line_step] + 1
+
+            if _bgzf:
+                offsets.extend(
+                    make_virtual_offset(block_offset, int(x))
+                    for x in _starts
+                )
+            else:
+                offsets.extend((_starts + block_offset).tolist())
+
+            n_lines += _newlines.shape[0]
+
+        _file_size = fh.tell()
+
+    # Drop an offset at the very end of the file
+    # (the file has an exact multiple of interval records)
+    if n_lines > 0 and n_lines % _line_step == 0:
+        offsets.pop()
+
+    # Count a last record without a trailing newline
+    if n_lines % 4 == 3:
+        n_lines += 1
+
+    index = FastqIndex(
+        np.array(offsets, dtype=np.uint64),
+        interval,
+        n_lines // 4,
+        _file_size,
+        bgzf=_bgzf,
+        file_mtime=_mtime
+    )
+
+    if index_file is None:
+        index_file = fastq_index_file(file_name)
+
+    # Input directories can be read-only
+    if save:
+        try:
+            index.save(index_file)
+        except OSError as err:
+            logger.warning(
+                "Could not write FASTQ index %s, keeping it in memory: %s",
+                index_file,
+                err
+            )
+
+    return index
+
+
+def _index_blocks(fh, bgzf):
+
+    if bgzf:
+        for block_offset, block in bgzf_blocks(fh):
+            yield block_offset, inflate_bgzf_block(block)
+
+    else:
+        while True:
+            block_offset = fh.tell()
+            data = fh.read(_INDEX_BLOCK_SIZE)
+
+            if len(data) == 0:
+                return
+
+            yield block_offset, data
+
+
+def load_fastq_index(file_name, index_file=None, build=True, **kwargs):
+    """
+    Load the index for a FASTQ file, building (and saving) it if
+    it doesn't exist or was built for a different version of the file
+    (a different size or modification time)
+
+    :param file_name: FASTQ file path
+    :type file_name: str
+    :param index_file: Index file path, defaults to ``{file_name}.fqi``
+    :type index_file: str, optional
+    :param build: Build a missing or stale index, otherwise raise
+        FileNotFoundError
+    :type build: bool
+
+    :return: FASTQ index
+    :rtype: FastqIndex
+    """
+
+    if index_file is None:
+        index_file = fastq_index_file(file_name)
+
+    if os.path.exists(index_file):
+        index = FastqIndex.load(index_file)
+
+        if index.is_current(file_name):
+            return index
+
+    if not build:
+        raise FileNotFoundError(f"No current FASTQ index for {file_name}")
+
+    return build_fastq_index(file_name, index_file=index_file, **kwargs)
+
+
+def fastq_shards(file_name, records_per_shard=None, n_shards=None):
+    """
+    Split a FASTQ file into shards of whole records using its index,
+    which is built if needed
+
+    :param file_name: FASTQ file path
+    :type file_name: str
+    :param records_per_shard: Number of records in each shard
+    :type records_per_shard: int, optional
+    :param n_shards: Number of (approximately equal) shards
+    :type n_shards: int, optional
+
+    :return: List of (start, stop) offsets to pass as ``shard``
+        to ``open_fastq_shard`` or ``file_opener``
+    :rtype: list((int, int or None))
+    """
+
+    return load_fastq_index(file_name).shards(
+        records_per_shard=records_per_shard,
+        n_shards=n_shards
+    )
+
+
+def open_fastq_shard(file_name, start=0, stop=None, threads=0):
+    """
+    Open part of a FASTQ file as a binary file handle
+
+    :param file_name: FASTQ file path (``.fastq`` or BGZF ``.fastq.gz``)
+    :type file_name: str
+    :param start: Offset to start reading from (a virtual offset for BGZF)
+    :type start: int
+    :param stop: Offset to stop reading at (a virtual offset for BGZF),
+        defaults to None (end of file)
+    :type stop: int or None
+    :param threads: Number of BGZF decompression threads, defaults to 0
+        (decompress in the calling thread)
+    :type threads: int
+
+    :return: Binary file handle
+    :rtype: io.BufferedReader
+    """
+
+    fh = open(file_name, mode='rb')
+
+    if file_name.endswith('.gz'):
+        raw = BgzfReader(fh, start=start, stop=stop, threads=threads)
+    else:
+        raw = _FileRangeReader(fh, start=start, stop=stop)
+
+    return io.BufferedReader(raw, buffer_size=_INDEX_BLOCK_SIZE)
+
+
+class _FileRangeReader(io.RawIOBase):
+
+    def __init__(self, fh, start=0, stop=None):
+        self._fh = fh
+        self._fh.seek(start)
+        self._remaining = stop - start if stop is not None else None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+
+        if self._remaining is not None:
+            b = memoryview(b)[:self._remaining]
+
+        n = self._fh.readinto(b)
+
+        if self._remaining is not None:
+            self._remaining -= n
+
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._fh.close()
+
+        super().close()
@@ -0,0 +1,776 @@
+import numpy as np
+
+from ._sequence import RC
+
+### Myers bit-parallel approximate matching ###
+# For a pattern of m <= 63 bases, the edit distance between the pattern and
+# the best substring of a read ending at each read position is computed with
+# one column of bit vector operations per read base (Myers 1999, Hyyro 2001).
+# Reads are processed in lockstep, so every operation works on a numpy array
+# with one lane per read and pattern, instead of one read at a time
+
+# Maximum number of (base x pattern x read) distances computed at once
+MYERS_MAX_CELLS = 1 << 24
+
+# Read bases in each chunk of a PatternScanner
+SCAN_CHUNK_SIZE = 128
+
+# Adapter search backends; fuzzy regular expressions or Myers distances
+SEARCH_BACKENDS = ('regex', 'myers')
+
+_ONE = np.uint64(1)
+
+
+def myers_distances(seqs, patterns, reverse=False):
+    """
+    Compute approximate match edit distances of several patterns
+    for a list of reads, with reads processed in lockstep
+
+    :param seqs: Uppercase read sequences
+    :type seqs: list(str)
+    :param patterns: Uppercase patterns, at most 63 bases each
+    :type patterns: list(str)
+    :param reverse: Compute distances for substrings starting at each
+        position instead of ending at each position, defaults to False
+    :type reverse: bool
+
+    :return: One array of shape (len(patterns), len(seq)) for each read,
+        where [p, j] is the smallest edit distance between pattern p and
+        a read substring ending at position j (inclusive), or starting
+        at position j if reverse is set
+    :rtype: list(np.ndarray)
+    """
+
+    if any(len(p) == 0 or len(p) > 63 for p in patterns):
+        raise ValueError("Patterns must be 1 to 63 bases long")
+
+    if reverse:
+        seqs = [seq[::-1] for seq in seqs]
+        patterns = [p[::-1] for p in patterns]
+
+    _peq = _pattern_bitmasks(patterns)
+    _lengths = np.array([len(p) for p in patterns], dtype=np.uint64)
+
+    results = [None] * len(seqs)
+
+    for group in _length_groups(seqs, len(patterns)):
+        _distances = _myers_group(
+            [seqs[i] for i in group],
+            _peq,
+            _lengths
+        )
+
+        for r, i in enumerate(group):
+            _d = _distances[:len(seqs[i]), :, r].T
+
+            results[i] = _d[:, ::-1] if reverse else _d
+
+    return results
+
+
+def _pattern_bitmasks(patterns):
+
+    # Bit i of peq[p, c] is set if base i of pattern p is character c
+    # Padding (0) and characters not in a pattern (including N)
+    # match nothing
+    peq = np.zeros((len(patterns), 256), dtype=np.uint64)
+
+    for p, pattern in enumerate(patterns):
+        for i, c in enumerate(pattern.encode('latin-1')):
+            peq[p, c] |= _ONE << np.uint64(i)
+
+    return peq
+
+
+def _length_groups(seqs, n_patterns):
+
+    # Sort reads by length so padding to the longest read in a group
+    # is small, and keep each group under MYERS_MAX_CELLS distances
+    _order = sorted(range(len(seqs)), key=lambda i: len(seqs[i]))
+
+    group, _max_len = [], 0
+
+    for i in _order:
+        _max_len = max(_max_len, len(seqs[i]))
+
+        if len(group) > 0 and (
+            _max_len * (len(group) + 1) * n_patterns > MYERS_MAX_CELLS
+        ):
+            yield group
+            group, _max_len = [], len(seqs[i])
+
+        group.append(i)
+
+    if len(group) > 0:
+        yield group
+
+
+def _myers_group(seqs, peq, lengths):
+
+    n_reads = len(seqs)
+    max_len = max(len(seq) for seq in seqs)
+
+    codes = np.zeros((max_len, n_reads), dtype=np.uint8)
+
+    for r, seq in enumerate(seqs):
+        codes[:len(seq), r] = np.frombuffer(seq.encode('latin-1'), dtype=np.uint8)
+
+    # One lane per pattern (rows) and read (columns)
+    _mask = ((_ONE << lengths) - _ONE)[:, None]
+    _high = _ONE << (lengths - _ONE)[:, None]
+    _shift = (lengths - _ONE)[:, None]
+
+    pv = np.broadcast_to(_mask, (len(lengths), n_reads)).copy()
+    mv = np.zeros_like(pv)
+    score = np.broadcast_to(
+        lengths.astype(np.int16)[:, None],
+        (len(lengths), n_reads)
+    ).copy()
+
+    distances = np.empty((max_len, len(lengths), n_reads), dtype=np.int16)
+
+    for j in range(max_len):
+        eq = peq[:, codes[j]]
+
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+
+        score += ((ph & _high) >> _shift).astype(np.int16)
+        score -= ((mh & _high) >> _shift).astype(np.int16)
+
+        # The first pattern row is all zeros (a match can start anywhere),
+        # so nothing is shifted into the low bit
+        ph <<= _ONE
+        mh <<= _ONE
+
+        pv = (mh | ~(xv | ph)) & _mask
+        mv = ph & xv
+
+        distances[j] = score
+
+    return distances
+
+
+def anchored_distances(pattern, text):
+    """
+    Edit distances between a pattern and every prefix of a text
+
+    :param pattern: Pattern
+    :type pattern: str
+    :param text: Text
+    :type text: str
+
+    :return: List where element j is the edit distance between
+        the pattern and text[:j]
+    :rtype: list(int)
+    """
+
+    m = len(pattern)
+    column = list(range(m + 1))
+    distances = [m]
+
+    for c in text:
+        _next = [column[0] + 1]
+
+        for i in range(1, m + 1):
+            _next.append(min(
+                column[i] + 1,
+                _next[i - 1] + 1,
+                column[i - 1] + (pattern[i - 1] != c)
+            ))
+
+        column = _next
+        distances.append(column[m])
+
+    return distances
+
+
+def approximate_matches(
+    seq,
+    end_distances,
+    pattern,
+    max_errors,
+    max_matches=None
+):
+    """
+    Find non-overlapping approximate matches of a pattern the way
+    ``regex.finditer`` does with the BESTMATCH flag; the match with the
+    fewest edits in the rest of the read is taken, starting as far left
+    as possible, and the search continues after it
+
+    :param seq: Uppercase read sequence
+    :type seq: str
+    :param end_distances: Distances for substrings ending at each
+        position, from myers_distances. Only distances up to max_errors
+        have to be exact.
+    :type end_distances: np.ndarray
+    :param pattern: Pattern
+    :type pattern: str
+    :param max_errors: Maximum number of edits
+    :type max_errors: int
+    :param max_matches: Stop after this many matches, defaults to None
+    :type max_matches: int, optional
+
+    :return: List of (start, end) spans in the order they are found
+    :rtype: list((int, int))
+    """
+
+    spans = []
+    pos = 0
+
+    while max_matches is None or len(spans) < max_matches:
+
+        _match = None
+
+        # Fewest edits first, then the leftmost start
+        for d in range(max_errors + 1):
+            _starts = [
+                flank_start(seq, j + 1, pattern, d, extend=True, pos=pos)
+                for j in (np.flatnonzero(end_distances[pos:] <= d) + pos).tolist()
+                if j + 1 - pos >= len(pattern) - d
+            ]
+            _starts = [x for x in _starts if x is not None]
+
+            if len(_starts) > 0:
+                _start = min(_starts)
+                _match = _start, _regex_end(seq, _start, pattern, 0, 0, d)
+                break
+
+        if _match is None:
+            break
+
+        spans.append(_match)
+        pos = max(_match[1], _match[0] + 1)
+
+    return spans
+
+
+def _regex_end(seq, i, pattern, p, errors, max_errors):
+
+    # End of a match starting at i, in the order the regex module
+    # backtracks: a matching base, then a substitution, an insertion
+    # and a deletion
+    if p == len(pattern):
+        return i
+
+    if i < len(seq) and seq[i] == pattern[p]:
+        _end = _regex_end(seq, i + 1, pattern, p + 1, errors, max_errors)
+
+        if _end is not None:
+            return _end
+
+    if errors == max_errors:
+        return None
+
+    if i < len(seq) and seq[i] != pattern[p]:
+        _end = _regex_end(seq, i + 1, pattern, p + 1, errors + 1, max_errors)
+
+        if _end is not None:
+            return _end
+
+    if i < len(seq):
+        _end = _regex_end(seq, i + 1, pattern, p, errors + 1, max_errors)
+
+        if _end is not None:
+            return _end
+
+    return _regex_end(seq, i, pattern, p + 1, errors + 1, max_errors)
+
+
+def flank_start(seq, end, pattern, max_errors, extend=True, pos=0):
+    """
+    Find the start of an approximate match of a pattern which ends
+    at a known position
+
+    :param seq: Read sequence
+    :type seq: str
+    :param end: Match end position
+    :type end: int
+    :param pattern: Pattern
+    :type pattern: str
+    :param max_errors: Maximum number of edits
+    :type max_errors: int
+    :param extend: Take the leftmost start within max_errors, otherwise
+        take the start with the fewest edits (then the shortest match)
+    :type extend: bool
+    :param pos: Leftmost possible start, defaults to 0
+    :type pos: int
+
+    :return: Match start, or None if there is no match
+    :rtype: int or None
+    """
+
+    _first = max(end - len(pattern) - max_errors, pos)
+
+    # Distances for seq[end - j:end]
+    distances = anchored_distances(pattern[::-1], seq[_first:end][::-1])
+
+    _j = _pick(distances, max_errors, extend)
+
+    return None if _j is None else end - _j
+
+
+def fuzzy_match_end(seq, start, items, anchor=0):
+    """
+    Find the end of a match of fuzzy literals and gaps which starts
+    at a known position, the way the regex module matches a pattern
+    like ``(left){e<=k}([ATGCN]{gap})(right){e<=k}`` without the
+    BESTMATCH or ENHANCEMATCH flags.
+
+    The regex module only tries edits where a base doesn't match
+    (a substitution, then an insertion, then a deletion), and after
+    the end of a fuzzy literal if the rest of the pattern doesn't match
+    (an insertion). Insertions aren't allowed at the position the
+    search started at.
+
+    :param seq: Uppercase read sequence
+    :type seq: str
+    :param start: Match start position
+    :type start: int
+    :param items: Pattern as a list of (literal, max_errors) tuples for
+        fuzzy literals and (None, length) tuples for gaps of any
+        A, C, G, T or N bases
+    :type items: list((str, int))
+    :param anchor: Position the search started at, defaults to 0
+    :type anchor: int
+
+    :return: Match end, or None if there is no match from start
+    :rtype: int or None
+    """
+
+    n = len(seq)
+
+    def _item(k, i):
+
+        if k == len(items):
+            return i
+
+        literal, length = items[k]
+
+        if literal is not None:
+            return _literal(k, 0, i, 0)
+
+        if i + length > n or any(c not in 'ACGTN' for c in seq[i:i + length]):
+            return None
+
+        return _item(k + 1, i + length)
+
+    def _literal(k, p, i, errors):
+
+        literal, max_errors = items[k]
+
+        if p == len(literal):
+            _end = _item(k + 1, i)
+
+            if _end is None and errors < max_errors and i < n:
+                _end = _literal(k, p, i + 1, errors + 1)
+
+            return _end
+
+        if i < n and seq[i] == literal[p]:
+            return _literal(k, p + 1, i + 1, errors)
+
+        if errors == max_errors:
+            return None
+
+        _end = None
+
+        if i < n:
+            _end = _literal(k, p + 1, i + 1, errors + 1)
+
+            if _end is None and i != anchor:
+                _end = _literal(k, p, i + 1, errors + 1)
+
+        if _end is None:
+            _end = _literal(k, p + 1, i, errors + 1)
+
+        return _end
+
+    return _item(0, start)
+
+
+def _pick(distances, max_errors, extend):
+
+    _matches = [j for j, d in enumerate(distances) if d <= max_errors]
+
+    if len(_matches) == 0:
+        return None
+
+    if extend:
+        return _matches[-1]
+
+    return min(_matches, key=lambda j: (distances[j], j))
+
+
+class FlankedPattern:
+    """
+    Adapter pattern of an approximate left flank, a gap of any
+    ``gap`` bases (A, C, G, T or N), and an approximate right flank,
+    like the regular expression
+    ``(left){e<=left_errors}([ATGCN]{gap})(right){e<=right_errors}``.
+
+    Myers distances of the left flank ending at each position and the
+    right flank starting at each position give the gaps a match can
+    have, and the match is found around them with ``fuzzy_match_end``,
+    so it is the same match the regular expression finds.
+
+    :param left: Left flank
+    :type left: str
+    :param left_errors: Maximum edits in the left flank
+    :type left_errors: int
+    :param gap: Number of bases between flanks
+    :type gap: int
+    :param right: Right flank
+    :type right: str
+    :param right_errors: Maximum edits in the right flank
+    :type right_errors: int
+    :param last: Find the rightmost match instead of the leftmost,
+        defaults to False
+    :type last: bool
+    """
+
+    def __init__(self, left, left_errors, gap, right, right_errors, last=False):
+        self.left = left.upper()
+        self.left_errors = left_errors
+        self.gap = gap
+        self.right = right.upper()
+        self.right_errors = right_errors
+        self.last = last
+
+        self._items = [
+            (self.left, left_errors),
+            (None, gap),
+            (self.right, right_errors)
+        ]
+
+    def reverse_complement(self):
+        """
+        Pattern that matches the reverse complement of this pattern
+        on the forward strand. The first match on the reverse strand is
+        the last match on the forward strand.
+
+        :return: Reverse complement pattern
+        :rtype: FlankedPattern
+        """
+
+        return FlankedPattern(
+            RC(self.right),
+            self.right_errors,
+            self.gap,
+            RC(self.left),
+            self.left_errors,
+            last=not self.last
+        )
+
+    def find(self, seq, left_end_distances, right_start_distances):
+        """
+        Find the first (or last) match of the pattern
+
+        :param seq: Uppercase read sequence
+        :type seq: str
+        :param left_end_distances: Myers distances of the left flank
+            for substrings ending at each position
+        :type left_end_distances: np.ndarray
+        :param right_start_distances: Myers distances of the right flank
+            for substrings starting at each position
+        :type right_start_distances: np.ndarray
+
+        :return: (start, end) span of the match, or None
+        :rtype: (int, int) or None
+        """
+
+        n = len(seq)
+
+        if n < self.gap + 2:
+            return None
+
+        # Candidate gap starts b, where the left flank ends at b
+        # and the right flank starts at b + gap
+        _candidates = (
+            (left_end_distances[0:n - self.gap - 1] <= self.left_errors) &
+            (right_start_distances[self.gap + 1:n] <= self.right_errors)
+        )
+
+        _gaps = np.flatnonzero(_candidates) + 1
+
+        if len(_gaps) == 0:
+            return None
+
+        # Gap bases must all be A, C, G, T or N
+        _invalid = np.cumsum(
+            ~np.isin(
+                np.frombuffer(seq.encode('latin-1'), dtype=np.uint8),
+                np.frombuffer(b'ACGTN', dtype=np.uint8)
+            )
+        )
+        _invalid = np.concatenate(([0], _invalid))
+
+        _gaps = _gaps[_invalid[_gaps + self.gap] == _invalid[_gaps]]
+
+        if len(_gaps) == 0:
+            return None
+
+        # The regular expression takes the first start that it finds a
+        # match from, so the starts the left flank could have for each
+        # gap are tried in order. The last match is found by searching
+        # the reverse complement read, as the regex backend does
+        if self.last:
+            seq = RC(seq)
+            _gaps = n - self.gap - _gaps[::-1]
+            _items = self.reverse_complement()._items
+        else:
+            _items = self._items
+
+        _left, _left_errors = _items[0]
+
+        _starts = sorted({
+            _start
+            for b in _gaps.tolist()
+            for _start in range(
+                max(b - len(_left) - _left_errors, 0),
+                b - len(_left) + _left_errors + 1
+            )
+        })
+
+        for _start in _starts:
+            _end = fuzzy_match_end(seq, _start, _items)
+
+            if _end is not None:
+                return (n - _end, n - _start) if self.last else (_start, _end)
+
+        return None
+
+
+class MyersBatch:
+    """
+    Myers distances for a list of reads, computed in lockstep for the
+    flanks of several FlankedPatterns and for plain patterns
+
+    :param seqs: Uppercase read sequences
+    :type seqs: list(str)
+    :param flanked_patterns: Adapter patterns, defaults to ()
+    :type flanked_patterns: list(FlankedPattern)
+    :param patterns: Plain patterns as (pattern, max_errors) tuples,
+        defaults to ()
+    :type patterns: list((str, int))
+    :param windows: Only search these (start, end) windows of each read,
+        None for a read (or for all reads) searches the whole read,
+        defaults to None
+    :type windows: list(list((int, int)) or None), optional
+    """
+
+    def __init__(self, seqs, flanked_patterns=(), patterns=(), windows=None):
+        self.seqs = seqs
+        self.flanked_patterns = list(flanked_patterns)
+        self.patterns = list(patterns)
+
+        if windows is None:
+            windows = [None] * len(seqs)
+
+        # Windows of each read are searched as separate sequences
+        self._windows = []
+        _subseqs = []
+
+        for seq, _read_windows in zip(seqs, windows):
+            if _read_windows is None:
+                _read_windows = [(0, len(seq))]
+
+            self._windows.append([
+                (len(_subseqs) + w, a, b)
+                for w, (a, b) in enumerate(_read_windows)
+            ])
+
+            _subseqs.extend(seq[a:b] for a, b in _read_windows)
+
+        self._subseqs = _subseqs
+
+        self._end = myers_distances(
+            _subseqs,
+            [x.left for x in self.flanked_patterns] +
+            [x[0] for x in self.patterns]
+        )
+
+        self._start = myers_distances(
+            _subseqs,
+            [x.right for x in self.flanked_patterns],
+            reverse=True
+        )
+
+    def find(self, i, k):
+        """
+        Find the first (or last) match of a FlankedPattern in a read
+
+        :param i: Read index
+        :type i: int
+        :param k: FlankedPattern index
+        :type k: int
+
+        :return: (start, end) span of the match, or None
+        :rtype: (int, int) or None
+        """
+
+        pattern = self.flanked_patterns[k]
+        _windows = self._windows[i]
+
+        # Windows are searched from the end the pattern is looked for at
+        for s, a, _ in (_windows[::-1] if pattern.last else _windows):
+            _span = pattern.find(
+                self._subseqs[s],
+                self._end[s][k],
+                self._start[s][k]
+            )
+
+            if _span is not None:
+                return _span[0] + a, _span[1] + a
+
+        return None
+
+    def matches(self, i, k):
+        """
+        Find non-overlapping matches of a plain pattern in a read
+
+        :param i: Read index
+        :type i: int
+        :param k: Plain pattern index
+        :type k: int
+
+        :return: List of (start, end) spans
+        :rtype: list((int, int))
+        """
+
+        pattern, max_errors = self.patterns[k]
+
+        return [
+            (_start + a, _end + a)
+            for s, a, _ in self._windows[i]
+            for _start, _end in approximate_matches(
+                self._subseqs[s],
+                self._end[s][len(self.flanked_patterns) + k],
+                pattern,
+                max_errors
+            )
+        ]
+
+
+class PatternScanner:
+    """
+    Scan reads for approximate matches of several plain patterns at once.
+
+    Reads are split into overlapping chunks, and the Myers distances of
+    all patterns are computed for every chunk of every read in one
+    lockstep traversal, so even a single long read fills many lanes.
+    Matches are found like ``regex.finditer`` with the BESTMATCH flag,
+    one pattern after another, stopping once ``max_matches`` matches
+    of any pattern are found.
+
+    :param patterns: Patterns as (pattern, max_errors) tuples
+    :type patterns: list((str, int))
+    :param max_matches: Stop looking for matches in a read once this many
+        are found
+    :type max_matches: int
+    :param chunk_size: Read bases in each chunk, not counting the overlap
+        with the previous chunk, defaults to SCAN_CHUNK_SIZE
+    :type chunk_size: int, optional
+    """
+
+    def __init__(self, patterns, max_matches, chunk_size=None):
+        self.patterns = [(x.upper(), k) for x, k in patterns]
+        self.max_matches = max_matches
+        self.chunk_size = chunk_size if chunk_size is not None else SCAN_CHUNK_SIZE
+
+        # Any match with up to max_errors edits that ends in a chunk
+        # starts in it or in the overlap
+        self._overlap = max(len(x) + k for x, k in self.patterns)
+
+    def scan(self, seqs, windows=None):
+        """
+        Find matches in a list of reads
+
+        :param seqs: Uppercase read sequences
+        :type seqs: list(str)
+        :param windows: Only search these (start, end) windows of each read,
+            None for a read (or for all reads) searches the whole read,
+            defaults to None
+        :type windows: list(list((int, int)) or None), optional
+
+        :return: Match spans as an array of shape (len(seqs), max_matches, 2)
+            and the number of matches in each read. Matches are in the
+            order of the patterns, then the windows.
+        :rtype: np.ndarray, np.ndarray
+        """
+
+        if windows is None:
+            windows = [None] * len(seqs)
+
+        _max = self.max_matches
+
+        spans = np.zeros((len(seqs), _max, 2), dtype=np.int64)
+        counts = np.zeros(len(seqs), dtype=np.int64)
+
+        _regions = [
+            [(0, len(seq))] if _windows is None else _windows
+            for seq, _windows in zip(seqs, windows)
+        ]
+
+        # Chunks of each window, and the offset into each chunk where
+        # its own bases start
+        _chunks, _keep = [], []
+
+        for seq, _read_regions in zip(seqs, _regions):
+            for a, b in _read_regions:
+                for c in range(a, b, self.chunk_size):
+                    _c0 = max(a, c - self._overlap)
+                    _chunks.append(seq[_c0:min(b, c + self.chunk_size)])
+                    _keep.append(c - _c0)
+
+        _distances = iter(myers_distances(
+            _chunks,
+            [x for x, _ in self.patterns]
+        ))
+        _keep = iter(_keep)
+
+        for i, (seq, _read_regions) in enumerate(zip(seqs, _regions)):
+
+            # Stitch distances of each window back together
+            _window_distances = [
+                np.concatenate(
+                    [next(_distances)[:, next(_keep):] for _ in range(a, b, self.chunk_size)] +
+                    [np.zeros((len(self.patterns), 0), dtype=np.int16)],
+                    axis=1
+                )
+                for a, b in _read_regions
+            ]
+
+            n = 0
+
+            for k, (pattern, max_errors) in enumerate(self.patterns):
+                for (a, b), _d in zip(_read_regions, _window_distances):
+
+                    if n >= _max:
+                        break
+
+                    for _start, _end in approximate_matches(
+                        seq[a:b],
+                        _d[k],
+                        pattern,
+                        max_errors,
+                        max_matches=_max - n
+                    ):
+                        spans[i, n] = _start + a, _end + a
+                        n += 1
+
+            counts[i] = n
+
+        return spans, counts
+
+
+def check_search_backend(search_backend):
+
+    if search_backend not in SEARCH_BACKENDS:
+        raise ValueError(
+            f"search_backend must be one of {SEARCH_BACKENDS}; "
+            f"{search_backend} provided"
+        )
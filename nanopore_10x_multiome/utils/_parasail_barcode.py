@@ -1,17 +1,28 @@
+import collections
+
 import parasail
 
+from ._sequence import RC
+
 # Substitution matrix where N isn't penalized for any match
 PARASAIL_MATRIX = parasail.matrix_create("ACGTN", 5, -1)
 for i in [4, 10, 16, 22, 24, 25, 26, 27]:
     PARASAIL_MATRIX.pointer[0].matrix[i] = 4
 
+PARASAIL_OPEN = 2
+PARASAIL_EXTEND = 1
+
+# Default number of adapter windows kept in the alignment cache
+ALIGNMENT_CACHE_SIZE = 2 ** 16
+
 def get_barcode_parasail(
     seq,
     qual,
     compiled_regex,
     comparison_sequence,
     bc_len,
-    split_barcode=None
+    split_barcode=None,
+    prefilter=None
 ):
     """
     Find an barcode by:
@@ -30,6 +41,9 @@ def get_barcode_parasail(
     :comparison_sequecne: str
     :param bc_len: Barcode length
     :type bc_len: int
+    :param prefilter: Exact seed prefilter for the regular expression,
+        which limits the fuzzy search to windows around seed hits
+    :type prefilter: SeedPrefilter, optional
 
     :return: Tuple of (
         Barcode sequence string,
@@ -39,51 +53,365 @@ def get_barcode_parasail(
     :rtype: (str, str, int)
     """
     
-    _bc = compiled_regex.search(seq)
+    if prefilter is not None:
+        _bc = prefilter.search(compiled_regex, seq)
+    else:
+        _bc = compiled_regex.search(seq)
 
     if _bc is None:
         return None, None, None
 
     _span = _bc.span()
-    seq = seq[_span[0]:_span[1]]
-    qual = qual[_span[0]:_span[1]]
-
-    result = parasail.sw_trace(
-        s1=seq,
-        s2=comparison_sequence,
-        open=2,
-        extend=1,
-        matrix=PARASAIL_MATRIX,
+
+    return align_barcode_parasail(
+        seq[_span[0]:_span[1]],
+        qual[_span[0]:_span[1]],
+        comparison_sequence,
+        bc_len,
+        offset=_span[0]
     )
 
+
+def get_barcode_parasail_span(
+    seq,
+    qual,
+    span,
+    comparison_sequence,
+    bc_len,
+    reverse_complement=False
+):
+    """
+    Find a barcode in a known adapter match span by
+    smith-waterman local sequence alignment
+
+    :param seq: Read sequence
+    :type seq: str
+    :param qual: Read quality string
+    :type qual: str
+    :param span: (start, end) of the adapter match in the read
+    :type span: (int, int)
+    :comparison_sequence: Sequence for S-W alignment, with barcode
+        masked using Ns
+    :type comparison_sequence: str
+    :param bc_len: Barcode length
+    :type bc_len: int
+    :param reverse_complement: The match is a reverse complement adapter,
+        so the barcode is returned from the reverse complement read,
+        defaults to False
+    :type reverse_complement: bool
+
+    :return: Tuple of (
+        Barcode sequence string,
+        Barcode quality string,
+        Barcode start position (in the reverse complement read if
+        reverse_complement is set)
+    )
+    :rtype: (str, str, int)
+    """
+
+    _start, _end = span
+
+    if reverse_complement:
+        # Quality is sliced from the end of the quality string,
+        # the same as slicing REV(qual)
+        _q = len(qual) - len(seq)
+
+        return align_barcode_parasail(
+            RC(seq[_start:_end]),
+            qual[_start + _q:_end + _q][::-1],
+            comparison_sequence,
+            bc_len,
+            offset=len(seq) - _end
+        )
+
+    return align_barcode_parasail(
+        seq[_start:_end],
+        qual[_start:_end],
+        comparison_sequence,
+        bc_len,
+        offset=_start
+    )
+
+
+def align_barcode_parasail(
+    seq,
+    qual,
+    comparison_sequence,
+    bc_len,
+    offset=0
+):
+    """
+    Find a barcode in an adapter regex match by smith-waterman
+    local sequence alignment
+
+    :param seq: Sequence of the regex match
+    :type seq: str
+    :param qual: Quality string of the regex match
+    :type qual: str
+    :param comparison_sequence: Sequence for S-W alignment, with barcode
+        masked using Ns
+    :type comparison_sequence: str
+    :param bc_len: Barcode length
+    :type bc_len: int
+    :param offset: Position of the match in the read, added to the
+        barcode start position
+    :type offset: int
+
+    :return: Tuple of (
+        Barcode sequence string,
+        Barcode quality string,
+        Barcode start position
+    )
+    :rtype: (str, str, int)
+    """
+
+    return _barcode_result(
+        seq,
+        qual,
+        offset,
+        _align_window(seq, comparison_sequence, bc_len)
+    )
+
+
+def align_barcodes_parasail(
+    seqs,
+    quals,
+    comparison_sequence,
+    bc_len,
+    offsets=None
+):
+    """
+    Find barcodes in a batch of adapter regex matches. parasail has no
+    call that aligns many sequences at once, so each match is aligned
+    separately, and matches already in ALIGNMENT_CACHE are not aligned
+    again
+
+    :param seqs: Sequences of the regex matches
+    :type seqs: list(str)
+    :param quals: Quality strings of the regex matches
+    :type quals: list(str)
+    :param comparison_sequence: Sequence for S-W alignment, with barcode
+        masked using Ns
+    :type comparison_sequence: str
+    :param bc_len: Barcode length
+    :type bc_len: int
+    :param offsets: Positions of the matches in their reads,
+        defaults to None (all 0)
+    :type offsets: list(int), optional
+
+    :return: List of align_barcode_parasail results, one for each match
+    :rtype: list((str, str, int))
+    """
+
+    if offsets is None:
+        offsets = [0] * len(seqs)
+
+    return [
+        _barcode_result(
+            seq,
+            qual,
+            offset,
+            _align_window(seq, comparison_sequence, bc_len)
+        )
+        for seq, qual, offset in zip(seqs, quals, offsets)
+    ]
+
+
+class AlignmentCache:
+    """
+    Bounded least-recently-used cache of barcode alignments, keyed on the
+    adapter window sequence, the comparison sequence and the barcode
+    length.
+
+    Many reads have byte-identical adapter windows (barcode included),
+    so repeats skip the alignment and traceback parsing. Only the
+    barcode location in the window is kept; qualities and read offsets
+    are applied to each read separately.
+
+    Hits, misses and evictions are kept in ``counts``.
+
+    :param maxsize: Most windows to keep, 0 disables the cache,
+        defaults to ALIGNMENT_CACHE_SIZE
+    :type maxsize: int, optional
+    """
+
+    def __init__(self, maxsize=ALIGNMENT_CACHE_SIZE):
+
+        if maxsize < 0:
+            raise ValueError(
+                f"Alignment cache size must not be negative; {maxsize} provided"
+            )
+
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self.counts = collections.Counter(
+            {'hits': 0, 'misses': 0, 'evictions': 0}
+        )
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key):
+        """
+        Get a cached alignment and mark it as recently used
+
+        :param key: (window, comparison sequence, barcode length)
+        :type key: tuple
+
+        :return: Cached alignment, or None if it isn't cached
+        :rtype: tuple or None
+        """
+
+        try:
+            value = self._cache[key]
+        except KeyError:
+            self.counts['misses'] += 1
+            return None
+
+        self._cache.move_to_end(key)
+        self.counts['hits'] += 1
+
+        return value
+
+    def put(self, key, value):
+        """
+        Cache an alignment, evicting the least recently used alignments
+        if the cache is full
+
+        :param key: (window, comparison sequence, barcode length)
+        :type key: tuple
+        :param value: Alignment
+        :type value: tuple
+        """
+
+        if self.maxsize == 0:
+            return
+
+        self._cache[key] = value
+
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.counts['evictions'] += 1
+
+    def resize(self, maxsize):
+        """
+        Change the cache size, evicting alignments if it shrinks
+
+        :param maxsize: Most windows to keep, 0 disables the cache
+        :type maxsize: int
+        """
+
+        if maxsize < 0:
+            raise ValueError(
+                f"Alignment cache size must not be negative; {maxsize} provided"
+            )
+
+        self.maxsize = maxsize
+
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.counts['evictions'] += 1
+
+    def clear(self):
+        """
+        Remove all cached alignments and reset the counters
+        """
+
+        self._cache.clear()
+
+        for k in self.counts:
+            self.counts[k] = 0
+
+    def pop_counts(self):
+        """
+        Get the counters since the last call, and reset them
+
+        :return: Hits, misses and evictions
+        :rtype: collections.Counter
+        """
+
+        counts = self.counts.copy()
+
+        for k in self.counts:
+            self.counts[k] = 0
+
+        return counts
+
+
+# Alignments are cached separately in each process
+# Forked workers start with a copy of the parent's cache
+ALIGNMENT_CACHE = AlignmentCache()
+
+
+def _align_window(seq, comparison_sequence, bc_len):
+
+    _key = (seq, comparison_sequence, bc_len)
+    _alignment = ALIGNMENT_CACHE.get(_key)
+
+    if _alignment is None:
+
+        # The read window is the query and the comparison sequence the
+        # reference, as alignments with equal scores are broken by
+        # which sequence is which. This rules out a precomputed profile
+        # of the comparison sequence, which parasail can only use as
+        # the query. The scan implementation gives the same alignments
+        # as parasail.sw_trace, faster on short windows
+        _alignment = _barcode_from_traceback(
+            seq,
+            bc_len,
+            parasail.sw_trace_scan_16(
+                seq,
+                comparison_sequence,
+                PARASAIL_OPEN,
+                PARASAIL_EXTEND,
+                PARASAIL_MATRIX
+            )
+        )
+
+        ALIGNMENT_CACHE.put(_key, _alignment)
+
+    return _alignment
+
+
+def _barcode_result(seq, qual, offset, alignment):
+
+    _barcode, _loc, _before = alignment
+
+    if _barcode is None:
+        return None, None, None
+
+    return _barcode, qual[_loc:_loc + len(_barcode)], offset + _before
+
+
+def _barcode_from_traceback(seq, bc_len, result):
+
+    _query = result.traceback.query
+    _ref = result.traceback.ref
+
     # Get the barcode start position
-    _position = result.traceback.ref.find('N')
+    _position = _ref.find('N')
 
     if _position == -1:
         return None, None, None
-    
+
     # Fix gaps right next to barcode as they're probably insertions
-    if (_position > 0) and (result.traceback.ref[_position - 1] == '-'):
+    if (_position > 0) and (_ref[_position - 1] == '-'):
         _position = _position - 1
         bc_len = bc_len + 1
-    elif (_position < len(result.traceback.ref)) and (result.traceback.ref[_position + 1] == '-'):
+    elif (_position + 1 < len(_ref)) and (_ref[_position + 1] == '-'):
         bc_len = bc_len + 1
 
-    _barcode = result.traceback.query[
-        _position:_position+bc_len
-    ].replace('-', '')
-
-    # Find any padding in the query before the barcode
-    # so the output position can be fixed
-    _extra_offset = result.traceback.query.count(
-        '-', 0, _position
-    )
+    _barcode = _query[_position:_position + bc_len].replace('-', '')
 
     # Allow at most one deletion
     if len(_barcode) < (bc_len - 1):
         return None, None, None
 
-    _loc = seq.find(_barcode)
-    _bcq = qual[_loc:_loc + len(_barcode)]
-
-    return _barcode, _bcq, _span[0] + _position - _extra_offset
+    # Barcode, its location in the window (for the quality string),
+    # and its position relative to the window start, without any
+    # padding in the query before the barcode
+    return (
+        _barcode,
+        seq.find(_barcode),
+        _position - _query.count('-', 0, _position)
+    )
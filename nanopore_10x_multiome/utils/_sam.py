@@ -1,13 +1,125 @@
+import array
+import collections
+import concurrent.futures
+import functools
+import re
+
+import pysam
+
+from ._bam import BAM_READ_THREADS, BAM_WRITE_THREADS
+
+# Keys written into FASTQ header comments by the splitter
+BARCODE_COMMENT_KEYS = ('CB', 'CR', 'CY', 'UB', 'UR', 'UY')
+
+# Tag that holds the FASTQ header comment in BAM or CRAM records
+COMMENT_TAG = 'CO'
+
+# Approximate number of bytes of text SAM in each chunk
+# sent to a worker process
+SAM_CHUNK_SIZE = 2 ** 22
+
+# SAM tag keys and value types
+_TAG_KEY_RE = re.compile('[A-Za-z][A-Za-z0-9]')
+_TAG_TYPES = frozenset('AifZHB')
+
+# SAM B array subtypes to array.array typecodes
+_ARRAY_TYPECODES = {
+    'c': 'b', 'C': 'B', 's': 'h', 'S': 'H', 'i': 'i', 'I': 'I', 'f': 'f'
+}
+
+
+def comment_tags(comment, keys=None, sam_tags=True):
+    """
+    Parse a read comment into typed tags in one pass over its
+    whitespace separated tokens. Tokens can be key=value (a string tag)
+    or SAM tags (TAG:TYPE:VALUE). The first token with a key is used.
+
+    :param comment: Read comment
+    :type comment: str
+    :param keys: Only parse these keys, defaults to None (all keys which
+        are valid SAM tags, two characters matching [A-Za-z][A-Za-z0-9])
+    :type keys: set(str), optional
+    :param sam_tags: Parse SAM tag tokens as well as key=value tokens,
+        defaults to True
+    :type sam_tags: bool
+
+    :return: Dict of key to (value, SAM type), and the tokens that
+        weren't parsed
+    :rtype: dict, list(str)
+    """
+
+    tags = {}
+    rest = []
+
+    for token in comment.split():
+
+        key, sep, value = token.partition('=')
+
+        if sep:
+            _type = 'Z'
+        elif (
+            sam_tags and len(token) > 4 and token[2] == ':' and
+            token[4] == ':' and token[3] in _TAG_TYPES
+        ):
+            key, _type, value = token[:2], token[3], token[5:]
+        else:
+            rest.append(token)
+            continue
+
+        if keys is None:
+            _wanted = _TAG_KEY_RE.fullmatch(key) is not None
+        else:
+            _wanted = key in keys
+
+        if not _wanted or key in tags:
+            rest.append(token)
+            continue
+
+        try:
+            tags[key] = (_typed_value(value, _type), _type)
+        except ValueError:
+            rest.append(token)
+
+    return tags, rest
+
+
+def _typed_value(value, value_type):
+
+    if value_type == 'i':
+        return int(value)
+
+    elif value_type == 'f':
+        return float(value)
+
+    elif value_type == 'B':
+        _subtype, *_values = value.split(',')
+
+        if _subtype not in _ARRAY_TYPECODES:
+            raise ValueError(f"Invalid B array subtype {_subtype}")
+
+        _cast = float if _subtype == 'f' else int
+
+        return array.array(
+            _ARRAY_TYPECODES[_subtype],
+            [_cast(x) for x in _values]
+        )
+
+    return value
+
+
 def sam_comment_to_tag(
     sam_file,
     output_file,
     comment_prefix=['CB=', 'CR=', 'CY=', 'UB=', 'UR=', 'UY='],
-    tag_prefix=['CB:Z:', 'CR:Z:', 'CY:Z:', 'UB:Z:', 'UR:Z:', 'UY:Z:']
+    tag_prefix=['CB:Z:', 'CR:Z:', 'CY:Z:', 'UB:Z:', 'UR:Z:', 'UY:Z:'],
+    n_jobs=None
 ):
     """Convert SAM comment fields to standard SAM tags.
 
     Takes comment entries like 'CB=ACGT' and converts them to SAM format tags in the correct
-    positions.
+    positions. Comments are parsed with ``comment_tags``. With ``n_jobs``,
+    the file is converted in chunks of lines by separate processes.
+    For BAM or CRAM files, use ``bam_comment_to_tag``.
 
     :param sam_file: Path to input SAM file
     :type sam_file: str
@@ -17,6 +129,9 @@ def sam_comment_to_tag(
     :type comment_prefix: list[str] or str
     :param tag_prefix: List of SAM tag formats to convert to (e.g. ['CB:Z:', 'CR:Z:'])
     :type tag_prefix: list[str] or str
+    :param n_jobs: Number of worker processes, defaults to None (convert
+        in this process)
+    :type n_jobs: int, optional
     """
     
     # Convert single strings to lists for consistent handling
@@ -28,57 +143,194 @@ def sam_comment_to_tag(
     # Validate matching prefix lengths
     assert len(comment_prefix) == len(tag_prefix)
     
-    # Pre-calculate prefix lengths for efficiency
-    _prelen = [len(x) for x in comment_prefix]
+    # Comment keys to their tag prefixes, in output order
+    _prefixes = {
+        c_pref[:-1] if c_pref.endswith('=') else c_pref: tag_pref
+        for c_pref, tag_pref in zip(comment_prefix, tag_prefix)
+    }
+
+    _convert = functools.partial(_convert_sam_lines, prefixes=_prefixes)
 
     with open(sam_file, mode='r') as sam_fh:
         with open(output_file, mode='w') as out_fh:
-            for line in sam_fh:
-                line = line.strip()
-                # Pass through header lines unchanged
-                if line.startswith("@"):
-                    print(line, file=out_fh)
-                    continue
-                            
-                # Split line into fields and get comments section
-                _header = line.split('\t')
-                _comments = _header[-1]
-
-                # Store converted tags
-                _new_tag = []
-
-                # Process each prefix pair
-                for (
-                    c_pref,
-                    tag_pref,
-                    c_len
-                ) in zip(
-                    comment_prefix,
-                    tag_prefix,
-                    _prelen
-                ):
-                    # Look for comment prefix in comments section
-                    _tag_loc = _comments.find(c_pref)
-
-                    if _tag_loc == -1:
-                        continue
-
-                    trailing_comment = _comments[_tag_loc + c_len:]
-
-                    if len(trailing_comment) == 0:
-                        extracted_tag = ''
-                    elif trailing_comment[0] == ' ':
-                        extracted_tag = ''
-                    else:
-                        extracted_tag = trailing_comment.split()[0]
-
-                    # Extract value and convert to SAM tag format
-                    _new_tag.append(tag_pref + extracted_tag)
-
-                # Output original line if no tags converted
-                if len(_new_tag) == 0:
-                    print(line, file=out_fh)
-                else:
-                    # Insert new tags before comments field
-                    _header = _header[:-1] + _new_tag + [_comments]
-                    print("\t".join(_header), file=out_fh)
\ No newline at end of file
+
+            chunks = iter(lambda: sam_fh.readlines(SAM_CHUNK_SIZE), [])
+
+            if n_jobs is not None and n_jobs > 1:
+                chunks = _process_map(_convert, chunks, n_jobs)
+            else:
+                chunks = map(_convert, chunks)
+
+            for chunk in chunks:
+                out_fh.write(chunk)
+
+
+def _convert_sam_lines(lines, prefixes):
+
+    _out = []
+
+    for line in lines:
+        line = line.strip()
+
+        # Pass through header lines unchanged
+        if line.startswith("@"):
+            _out.append(line)
+            continue
+
+        # Comments are the last field
+        _fields, _, _comments = line.rpartition('\t')
+        _tags, _ = comment_tags(_comments, prefixes, sam_tags=False)
+
+        # Output original line if no tags converted
+        if len(_tags) == 0:
+            _out.append(line)
+            continue
+
+        # Insert new tags before comments field
+        _out.append('\t'.join(
+            ([_fields] if _fields else []) +
+            [
+                tag_pref + str(_tags[key][0])
+                for key, tag_pref in prefixes.items()
+                if key in _tags
+            ] +
+            [_comments]
+        ))
+
+    _out.append('')
+
+    return '\n'.join(_out)
+
+
+def _process_map(func, chunks, n_jobs, max_in_flight=None):
+    """
+    Map a function over chunks in a pool of worker processes,
+    yielding results in order with at most ``max_in_flight``
+    (default ``2 * n_jobs``) chunks submitted at once
+    """
+
+    if max_in_flight is None:
+        max_in_flight = 2 * n_jobs
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs) as pool:
+
+        in_flight = collections.deque()
+
+        try:
+            for chunk in chunks:
+                in_flight.append(pool.submit(func, chunk))
+
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().result()
+
+            while len(in_flight) > 0:
+                yield in_flight.popleft().result()
+
+        finally:
+            for f in in_flight:
+                f.cancel()
+
+
+def bam_comment_to_tag(
+    bam_file,
+    output_file,
+    comment_tag=COMMENT_TAG,
+    keys=BARCODE_COMMENT_KEYS,
+    remove_comment=True,
+    threads=BAM_READ_THREADS,
+    write_threads=BAM_WRITE_THREADS,
+    reference_filename=None
+):
+    """
+    Convert read comments stored in a tag of a BAM or CRAM file into
+    typed tags, streaming records from the input to the output.
+    Comment tokens are key=value (string tags) or SAM tags (TAG:TYPE:VALUE)
+    and are parsed once per record with ``comment_tags``.
+
+    Output format is from the output file extension (.cram, .sam or BAM).
+
+    :param bam_file: Path to input BAM or CRAM file
+    :type bam_file: str
+    :param output_file: Path to output file
+    :type output_file: str
+    :param comment_tag: Tag with the read comment, defaults to 'CO'
+    :type comment_tag: str
+    :param keys: Comment keys to convert, defaults to the barcode keys
+        CB, CR, CY, UB, UR and UY (None converts all keys that are
+        valid SAM tags)
+    :type keys: tuple(str), optional
+    :param remove_comment: Remove converted tokens from the comment tag,
+        and the tag itself once it's empty, defaults to True
+    :type remove_comment: bool
+    :param threads: Number of decompression threads, defaults to
+        BAM_READ_THREADS
+    :type threads: int
+    :param write_threads: Number of compression threads, defaults to
+        BAM_WRITE_THREADS
+    :type write_threads: int
+    :param reference_filename: Reference FASTA for CRAM files,
+        defaults to None
+    :type reference_filename: str, optional
+
+    :return: Number of records written and number of records with
+        converted tags
+    :rtype: int, int
+    """
+
+    if keys is not None:
+        keys = set(keys)
+
+    if output_file.endswith('.cram'):
+        _mode = 'wc'
+    elif output_file.endswith('.sam'):
+        _mode = 'w'
+    else:
+        _mode = 'wb'
+
+    n, n_tagged = 0, 0
+
+    with (
+        pysam.AlignmentFile(
+            bam_file,
+            'rc' if bam_file.endswith('.cram') else 'rb',
+            check_sq=False,
+            threads=threads,
+            reference_filename=reference_filename
+        ) as in_fh,
+        pysam.AlignmentFile(
+            output_file,
+            _mode,
+            template=in_fh,
+            threads=write_threads,
+            reference_filename=reference_filename
+        ) as out_fh
+    ):
+
+        for r in in_fh.fetch(until_eof=True):
+
+            n += 1
+
+            if r.has_tag(comment_tag):
+                _tags, _rest = comment_tags(str(r.get_tag(comment_tag)), keys)
+            else:
+                _tags = None
+
+            if _tags:
+                n_tagged += 1
+
+                for key, (value, value_type) in _tags.items():
+                    r.set_tag(
+                        key,
+                        value,
+                        value_type=value_type if value_type != 'B' else None
+                    )
+
+                if remove_comment:
+                    r.set_tag(
+                        comment_tag,
+                        ' '.join(_rest) if len(_rest) > 0 else None
+                    )
+
+            out_fh.write(r)
+
+    return n, n_tagged
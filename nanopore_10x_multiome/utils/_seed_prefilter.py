@@ -0,0 +1,180 @@
+import re
+
+
+class SeedPrefilter:
+    """
+    Exact k-mer seed prefilter for a fuzzy regular expression.
+
+    A constant part of the pattern that may match with up to ``max_errors``
+    edits is split into ``max_errors + 1`` non-overlapping seeds. Edits can
+    change at most ``max_errors`` of them, so at least one seed occurs
+    exactly inside any match (pigeonhole principle). Seeds are found with
+    a plain (non-fuzzy) regular expression in linear time, and the fuzzy
+    expression is only searched in windows around seed hits.
+
+    Searching the windows in order returns the same match as searching
+    the whole sequence, because every match contains a seed hit and lies
+    inside the window around it.
+
+    :param constant: Constant sequence from the pattern
+    :type constant: str
+    :param max_errors: Maximum number of edits allowed in the constant
+    :type max_errors: int
+    :param max_match_length: Longest possible match of the fuzzy pattern,
+        including any insertions
+    :type max_match_length: int
+    """
+
+    def __init__(self, constant, max_errors, max_match_length):
+        self.constant = constant.upper()
+        self.max_errors = max_errors
+        self.max_match_length = max_match_length
+
+        self.seeds = pigeonhole_seeds(self.constant, max_errors + 1)
+
+        # Lookahead so overlapping seed hits are all found
+        self._seed_re = re.compile(
+            '(?=' + '|'.join(self.seeds) + ')',
+            flags=re.IGNORECASE
+        )
+
+        self._pad = max_match_length + max(len(x) for x in self.seeds)
+
+    def windows(self, seq, pos=0, endpos=None):
+        """
+        Find merged windows around seed hits which can contain a match
+
+        :param seq: Sequence to search
+        :type seq: str
+        :param pos: Start position to search from
+        :type pos: int
+        :param endpos: End position to search to, defaults to the
+            end of the sequence
+        :type endpos: int, optional
+
+        :return: List of (start, end) windows in increasing order
+        :rtype: list((int, int))
+        """
+
+        if endpos is None:
+            endpos = len(seq)
+
+        return self.hit_windows(
+            [hit.start() for hit in self._seed_re.finditer(seq, pos, endpos)],
+            endpos,
+            pos=pos
+        )
+
+    def hit_windows(self, hits, endpos, pos=0):
+        """
+        Merge windows around seed hit positions
+
+        :param hits: Seed hit start positions in increasing order
+        :type hits: list(int)
+        :param endpos: End of the sequence (or search range)
+        :type endpos: int
+        :param pos: Start of the search range
+        :type pos: int
+
+        :return: List of (start, end) windows in increasing order
+        :rtype: list((int, int))
+        """
+
+        windows = []
+
+        for hit in hits:
+            _start = max(hit - self.max_match_length, pos)
+            _end = min(hit + self._pad, endpos)
+
+            if len(windows) > 0 and _start <= windows[-1][1]:
+                windows[-1][1] = _end
+            else:
+                windows.append([_start, _end])
+
+        return [tuple(x) for x in windows]
+
+    def search(self, compiled_regex, seq, pos=0, endpos=None):
+        """
+        Search for the first match of a fuzzy regular expression,
+        only looking in windows around seed hits
+
+        :param compiled_regex: Precompiled fuzzy regular expression
+        :type compiled_regex: regex.Regex
+        :param seq: Sequence to search
+        :type seq: str
+
+        :return: First match, or None
+        :rtype: regex.Match or None
+        """
+
+        return search_windows(
+            compiled_regex,
+            seq,
+            self.windows(seq, pos, endpos)
+        )
+
+    def has_seed(self, seq, pos=0, endpos=None):
+        """
+        Check if a sequence has any seed hit
+
+        :param seq: Sequence to search
+        :type seq: str
+
+        :return: True if any seed occurs exactly
+        :rtype: bool
+        """
+
+        if endpos is None:
+            endpos = len(seq)
+
+        return self._seed_re.search(seq, pos, endpos) is not None
+
+
+def search_windows(compiled_regex, seq, windows):
+    """
+    Search windows of a sequence in order and return the first match
+
+    :param compiled_regex: Precompiled regular expression
+    :type compiled_regex: regex.Regex
+    :param seq: Sequence to search
+    :type seq: str
+    :param windows: List of (start, end) windows
+    :type windows: list((int, int))
+
+    :return: First match, or None
+    :rtype: regex.Match or None
+    """
+
+    for _start, _end in windows:
+        match = compiled_regex.search(seq, _start, _end)
+
+        if match is not None:
+            return match
+
+    return None
+
+
+def pigeonhole_seeds(constant, n):
+    """
+    Split a sequence into n non-overlapping seeds of (nearly) equal length
+
+    :param constant: Sequence to split
+    :type constant: str
+    :param n: Number of seeds
+    :type n: int
+
+    :return: Seeds
+    :rtype: list(str)
+    """
+
+    if n > len(constant):
+        raise ValueError(
+            f"Can't split {constant} into {n} seeds"
+        )
+
+    _bounds = [i * len(constant) // n for i in range(n + 1)]
+
+    return [
+        constant[a:b]
+        for a, b in zip(_bounds[:-1], _bounds[1:])
+    ]
@@ -0,0 +1,200 @@
+import io
+import queue
+import threading
+import zlib
+
+# Number of batches that can wait for a writer thread
+# before the producer blocks
+WRITER_QUEUE_SIZE = 8
+
+# Number of decompressed chunks a reader thread can get ahead by
+READER_QUEUE_SIZE = 16
+
+# Compressed bytes read at once by a reader thread
+READER_CHUNK_SIZE = 1 << 20
+
+
+class BatchWriterThread:
+    """
+    Write batches to a file handle from a background thread.
+
+    Batches are passed through a bounded queue, so a slow output blocks
+    the producer instead of buffering an unbounded number of batches in
+    memory. Errors raised while writing are re-raised from ``write``
+    or ``close`` in the producer thread.
+
+    :param handle: Open output file handle
+    :param writer: Batch writer function, called as
+        ``writer(handle, *args)``
+    :type writer: callable
+    :param queue_size: Maximum number of queued batches
+    :type queue_size: int
+    """
+
+    def __init__(self, handle, writer, queue_size=WRITER_QUEUE_SIZE):
+        self.handle = handle
+        self.writer = writer
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+
+        while True:
+            args = self._queue.get()
+
+            if args is None:
+                return
+
+            # Keep draining the queue after an error
+            # so the producer never blocks on put()
+            if self.error is not None:
+                continue
+
+            try:
+                self.writer(self.handle, *args)
+            except BaseException as err:
+                self.error = err
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, *args):
+        self._raise()
+        self._queue.put(args)
+
+    def close(self):
+        """
+        Wait for all queued batches to be written.
+        Does not close the file handle.
+        """
+
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ThreadedGzipReader(io.RawIOBase):
+    """
+    Raw binary reader that decompresses a gzip file in a background
+    thread. Decompressed chunks are passed through a bounded queue,
+    so inflation overlaps with parsing without reading arbitrarily far
+    ahead. Wrap in ``io.BufferedReader`` for efficient reads.
+
+    Handles multi-member gzip files (including BGZF).
+
+    :param fh: Binary file handle of a gzip file
+    :type fh: io.BufferedIOBase
+    :param close_fh: Close the file handle when this reader is closed
+    :type close_fh: bool
+    :param queue_size: Maximum number of queued decompressed chunks
+    :type queue_size: int
+    """
+
+    def __init__(self, fh, close_fh=True, queue_size=READER_QUEUE_SIZE):
+        self._fh = fh
+        self._close_fh = close_fh
+
+        self._data = b''
+        self._pos = 0
+        self._eof = False
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+
+        # Give up if the reader is closed while the queue is full
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def _run(self):
+
+        try:
+            decompressor = zlib.decompressobj(wbits=31)
+            _in_member = False
+
+            while not self._stop.is_set():
+                chunk = self._fh.read(READER_CHUNK_SIZE)
+
+                if len(chunk) == 0:
+                    if _in_member:
+                        raise EOFError(
+                            "Compressed file ended before the end-of-stream marker"
+                        )
+                    break
+
+                while len(chunk) > 0:
+                    _in_member = True
+                    data = decompressor.decompress(chunk)
+
+                    if len(data) > 0 and not self._put(data):
+                        return
+
+                    # Start a new decompressor for the next gzip member
+                    if decompressor.eof:
+                        chunk = decompressor.unused_data
+                        decompressor = zlib.decompressobj(wbits=31)
+                        _in_member = False
+                    else:
+                        chunk = b''
+
+            self._put(None)
+
+        except BaseException as err:
+            self._put(err)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+
+        while self._pos >= len(self._data):
+            if self._eof:
+                return 0
+
+            item = self._queue.get()
+
+            if item is None:
+                self._eof = True
+                return 0
+
+            if isinstance(item, BaseException):
+                self._eof = True
+                raise item
+
+            self._data, self._pos = item, 0
+
+        n = min(len(b), len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+
+        return n
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+        if self._close_fh and not self.closed:
+            self._fh.close()
+
+        super().close()